@@ -0,0 +1,340 @@
+#!/usr/bin/python
+################################################################################
+#
+#   autosave.py
+#   Author: Roger Wang
+#   Date: 2024-07-19
+#
+#   AutosaveService saves a Project in the background while the user works.
+#   Every edit is recorded at once in the ProjectJournal next to the project
+#   file. Once no edit has been made for a while, the journal is compacted:
+#   the project is written to the snapshot of the project file (see 
+#   projectjournal.py) and the journal is trimmed. The project file itself 
+#   keeps the last save, so closing the project without saving still returns
+#   to it. When the journal only holds the metadata of the images (see 
+#   projectverifier.py), which is not an edit of the user, the project file 
+#   is compacted instead.
+#
+#   Snapshots and JSON project files are written by an AutosaveWorker on a 
+#   QThread, so that large projects do not freeze the GUI. The content of 
+#   the file is taken on the GUI thread, so edits made while it is written 
+#   stay in the journal for the next compaction. SQLite project files only 
+#   write the rows that changed, and are saved on the GUI thread as the 
+#   connection belongs to it.
+#
+#   Saving the project with the Save buttons also writes JSON project files 
+#   with an AutosaveWorker, while the GUI keeps being painted but ignores 
+#   the input of the user until the file is written.
+#
+#   Selections are moved continuously while they are dragged, so consecutive
+#   moves of a selection are recorded once the selection stops moving.
+#
+#   Edits are given to record as dicts with an "op" (see projectjournal.py)
+#   and the Slide objects they apply to:
+#       {"op": "select", "slide": Slide, "index": int}
+#       {"op": "move", "slide": Slide, "index": int}
+#       {"op": "remove", "slide": Slide, "index": int}
+#       {"op": "add_slide", "slide": Slide}
+#       {"op": "remove_slide", "slide": Slide, "index": int}
+#       {"op": "slides"}
+#       {"op": "resize", "width": int, "height": int}
+#       {"op": "project"}
+#   The records written to the journal are taken from the Project.
+#
+################################################################################
+
+import os
+
+from PyQt6.QtCore import *
+
+from project import *
+from projectjournal import *
+
+class AutosaveService(QObject):
+    # Emitted when the project file holds every edit.
+    saved = pyqtSignal()
+
+    # Time in ms without any edit before the journal is compacted.
+    delay = 5000
+
+    # Time in ms a selection has to stay still before its move is recorded.
+    move_delay = 300
+
+    def __init__(self, project, delay = 0):
+        super().__init__()
+        self._project = project
+        self._delay = delay if delay > 0 else AutosaveService.delay
+
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.compact)
+
+        # _move should be the record of the move waiting for its selection to 
+        # stop.
+        self._move = None
+        self._move_timer = QTimer(self)
+        self._move_timer.setSingleShot(True)
+        self._move_timer.timeout.connect(self._flush_move)
+
+        self._thread = None
+        self._worker = None
+
+        # _snapshot should be the path of the snapshot and the number of the 
+        # last edit it holds when the running compaction writes the snapshot, 
+        # or None.
+        self._snapshot = None
+
+        # Edits already in the journal, replayed after a crash or recorded 
+        # when the project was verified, are compacted as new edits are.
+        if project.path and os.path.exists(\
+            ProjectJournal.get_path(project.path)):
+            self._timer.start(self._delay)
+
+    """
+    Record an edit of the Project and schedule a compaction.
+    @param edit: dict, the edit.
+    """
+    def record(self, edit):
+        try:
+            record = self._get_record(edit)
+        except (IndexError, ValueError):
+            # The edit does not match the Project. It is still saved by the 
+            # next compaction or save.
+            record = None
+
+        if record and record["op"] == "move":
+            if self._move and (self._move["slide"] != record["slide"] or \
+                               self._move["index"] != record["index"]):
+                self._flush_move()
+            self._move = record
+            self._move_timer.start(AutosaveService.move_delay)
+        else:
+            self._flush_move()
+            if record:
+                self._write(record)
+        self._timer.start(self._delay)
+
+    """
+    Compact the journal into the snapshot, or into the project file when the 
+    project has no unsaved edit. A compaction requested while the previous 
+    one is running is retried later.
+    """
+    def compact(self):
+        self._flush_move()
+        project = self._project
+        if not project.path or not os.path.exists(\
+            ProjectJournal.get_path(project.path)):
+            return
+        if self._thread is not None:
+            self._timer.start(self._delay)
+            return
+
+        self._snapshot = None
+        if project.database and project.saved:
+            try:
+                project.save_database(project.path)
+            except Exception:
+                # The edits stay in the journal.
+                return
+            self.saved.emit()
+            return
+
+        content = project.to_json()
+        path = project.path
+        if not project.saved:
+            path = ProjectJournal.get_snapshot_path(project.path)
+            self._snapshot = (path, content["journal"])
+        self._thread = QThread()
+        self._worker = AutosaveWorker(project, path, content)
+        self._worker.finished.connect(self.worker_finished_handler)
+        self._worker.moveToThread(self._thread)
+        self._thread.started.connect(self._worker.run)
+        self._thread.start()
+
+    """
+    Stop the service. The edit being delayed is recorded, and a running
+    compaction is waited for.
+    """
+    def stop(self):
+        self._timer.stop()
+        self._flush_move()
+        if self._thread is not None:
+            # The worker has finished once the thread stops running it.
+            self._thread.quit()
+            self._thread.wait()
+            self._cleanup()
+            self._remove_stale_snapshot()
+
+    """
+    Save the project with the Save buttons. JSON project files are written 
+    by an AutosaveWorker, and the GUI ignores the input of the user until 
+    the file is written. SQLite project files are saved on the GUI thread, 
+    as the connection belongs to it.
+    @param project: Project object.
+    @param path: str, the path to the project file.
+    @param database: True (SQLite) / False (JSON) / None to keep the current
+        format.
+    """
+    @staticmethod
+    def save_project(project, path, database = None):
+        if database is None:
+            database = project.database is not None
+        if database:
+            project.save_database(path)
+            return
+
+        # The database, if any, is no longer the project file.
+        project.close_database()
+        content = project.to_json()
+        thread = QThread()
+        worker = AutosaveWorker(project, path, content)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+        loop = QEventLoop()
+        worker.finished.connect(loop.quit)
+        thread.start()
+        loop.exec(QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents)
+        thread.quit()
+        thread.wait()
+        if worker.error:
+            raise worker.error
+        project.finish_save_json(path, content["journal"])
+
+    """
+    Remove the snapshot written by the last compaction if it no longer holds 
+    the unsaved edits: the edits were discarded, the project was saved, or 
+    saved to another file, while it was written.
+    @return True (removed) / False (the snapshot is kept).
+    """
+    def _remove_stale_snapshot(self):
+        if not self._snapshot:
+            return False
+        project = self._project
+        path, sequence = self._snapshot
+        if not project.is_discarded() and project.path and \
+            path == ProjectJournal.get_snapshot_path(project.path) and \
+            sequence > project.saved_sequence:
+            return False
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return True
+
+    """
+    Handler for when the AutosaveWorker has finished.
+    @param path: str, the path of the written file.
+    @param sequence: int, the number of the last edit held by the file.
+    @param success: bool, whether the file was written.
+    """
+    def worker_finished_handler(self, path, sequence, success):
+        # The service may have been stopped meanwhile.
+        if self._thread is None:
+            return
+        self._thread.quit()
+        self._thread.wait()
+        self._cleanup()
+        if not success:
+            return
+
+        project = self._project
+        if self._snapshot:
+            if not self._remove_stale_snapshot():
+                ProjectJournal.trim(project.path, sequence)
+            return
+
+        ProjectJournal.trim(path, sequence)
+        if project.path == path and project.journal_sequence == sequence:
+            project.saved = True
+            self.saved.emit()
+
+    """
+    Release the thread and the worker of the last compaction.
+    """
+    def _cleanup(self):
+        self._worker.deleteLater()
+        self._thread.deleteLater()
+        self._worker = None
+        self._thread = None
+
+    """
+    Record the move waiting for its selection to stop, if any.
+    """
+    def _flush_move(self):
+        self._move_timer.stop()
+        if self._move:
+            move = self._move
+            self._move = None
+            self._write(move)
+
+    """
+    Write a record to the journal.
+    @param record: dict, the record.
+    """
+    def _write(self, record):
+        try:
+            self._project.record_edit(record)
+        except OSError:
+            # The edit is still saved by the next compaction or save.
+            pass
+
+    """
+    Get the record of an edit, from the current state of the Project.
+    @param edit: dict, the edit.
+    @return dict, the record.
+    """
+    def _get_record(self, edit):
+        project = self._project
+        op = edit["op"]
+        record = {"op": op}
+        if op == "slides":
+            record["paths"] = [slide.path for slide in project.slides]
+        elif op == "add_slide":
+            record["path"] = edit["slide"].path
+        elif op == "resize":
+            record["width"] = edit["width"]
+            record["height"] = edit["height"]
+        elif op == "project":
+            record.update({
+                "name": project.name,
+                "selection": project.selection,
+                "width": project.width,
+                "height": project.height,
+                "export": project.export_settings.to_dict(),
+            })
+        else:
+            slide = edit["slide"]
+            # Removed slides are no longer in the Project.
+            record["slide"] = edit["index"] if op == "remove_slide" else \
+                project.slides.index(slide)
+            record["path"] = slide.path
+            if op != "remove_slide":
+                record["index"] = edit["index"]
+            if op in ("select", "move"):
+                selection = slide.selections[edit["index"]]
+                record["center"] = list(selection.center_coordinates)
+            if op == "select":
+                record["width"] = selection.width
+                record["height"] = selection.height
+        return record
+
+class AutosaveWorker(QObject):
+    # AutosaveWorker writes a JSON project file on another thread.
+    finished = pyqtSignal(str, int, bool)
+
+    def __init__(self, project, path, content):
+        super().__init__()
+        self._project = project
+        self._path = path
+        self._content = content
+
+        # error should be the exception raised while writing the file, if any.
+        self.error = None
+
+    def run(self):
+        try:
+            success = self._project.write_json(self._path, self._content)
+        except Exception as error:
+            self.error = error
+            success = False
+        self.finished.emit(self._path, self._content["journal"], success)
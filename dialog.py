@@ -19,6 +19,8 @@ from PyQt6.QtWidgets import *
 from PyQt6.QtSvgWidgets import *
 
 from access import *
+from autosave import *
+from project import *
 
 BASEDIR = os.path.dirname(__file__)
 
@@ -39,7 +41,7 @@ class CloseSaveDialog(QDialog):
         save_button.clicked.connect(self.save_clicked)
         nosave_button = QPushButton(text = "Don't Save")
         nosave_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
-        nosave_button.clicked.connect(self.accept)
+        nosave_button.clicked.connect(self.nosave_clicked)
         cancel_button = QPushButton(text = "Cancel")
         cancel_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
         cancel_button.clicked.connect(self.reject)
@@ -63,6 +65,14 @@ class CloseSaveDialog(QDialog):
 
         self.setLayout(layout)
 
+    """
+    Handler for when the user clicks "Don't Save". The edits recorded since 
+    the last save are discarded.
+    """
+    def nosave_clicked(self):
+        self._project.discard_edits()
+        self.accept()
+
     """
     Handler for when user clicks "Save" on the dialog.
     This function is necessary as the user might click "Cancel" while the file 
@@ -79,20 +89,21 @@ class CloseSaveDialog(QDialog):
     """
     def save_project(self):
         if self._project.path:
-            self._project.save_json(self._project.path)
+            AutosaveService.save_project(self._project, self._project.path)
             self.window().setWindowModified(False)
             return True
         else:
-            filename, _ = QFileDialog.getSaveFileName(\
+            filename, selected = QFileDialog.getSaveFileName(\
                 caption = "Create a project file", \
-                filter = "SCP File (*.scp)", directory = self._project.name + \
-                ".scp")
+                filter = Project.FILE_FILTER + ";;" + Project.DATABASE_FILTER, \
+                directory = self._project.name + ".scp")
             if filename:
                 if Access.check_new_file_write(filename):
                     dialog = PermissionErrorDialog()
                     dialog.exec()
                     return False
-                self._project.save_json(filename)
+                AutosaveService.save_project(self._project, filename, \
+                    selected == Project.DATABASE_FILTER)
                 self.window().setWindowModified(False)
                 return True
             return False
@@ -224,9 +235,9 @@ class UnfoundItemActionDialog(QDialog):
         self.accept()
 
 class SettingsEditDialog(QDialog):
-    settings_changed = pyqtSignal(float, QColor)
+    settings_changed = pyqtSignal(float, QColor, bool)
 
-    def __init__(self, resolution, color):
+    def __init__(self, resolution, color, tiled = False):
         super().__init__()
         self.setWindowTitle("Settings")
         self._color = color
@@ -251,6 +262,23 @@ class SettingsEditDialog(QDialog):
         self.preview_buttongroup.addButton(self.preview_25_button)
         self.preview_buttongroup.addButton(self.preview_10_button)
 
+        # Tiled viewer section.
+        tiled_label = QLabel(text = "Tiled Viewer: ")
+        self.tiled_checkbox = QCheckBox(\
+            text = "Build tile pyramids when adding slides")
+        self.tiled_checkbox.setCursor(\
+            QCursor(Qt.CursorShape.PointingHandCursor))
+        self.tiled_checkbox.setChecked(tiled)
+
+        # Preview cache section.
+        cache_label = QLabel(text = "Preview Cache: ")
+        self.cache_size_label = QLabel()
+        self.cache_clear_button = QPushButton(text = "Clear")
+        self.cache_clear_button.setCursor(\
+            QCursor(Qt.CursorShape.PointingHandCursor))
+        self.cache_clear_button.clicked.connect(self.cache_clear_button_clicked)
+        self.update_cache_label()
+
         # Color section.
         color_label = QLabel(text = "Selection Color: ")
         self.color_button = QPushButton()
@@ -284,6 +312,17 @@ class SettingsEditDialog(QDialog):
         color_layout.addWidget(self.color_button)
         color_layout.addStretch()
 
+        tiled_layout = QHBoxLayout()
+        tiled_layout.addWidget(tiled_label)
+        tiled_layout.addWidget(self.tiled_checkbox)
+        tiled_layout.addStretch()
+
+        cache_layout = QHBoxLayout()
+        cache_layout.addWidget(cache_label)
+        cache_layout.addWidget(self.cache_size_label)
+        cache_layout.addWidget(self.cache_clear_button)
+        cache_layout.addStretch()
+
         button_layout = QHBoxLayout()
         button_layout.addStretch()
         button_layout.addWidget(apply_button)
@@ -292,7 +331,9 @@ class SettingsEditDialog(QDialog):
         layout = QVBoxLayout()
         layout.addStretch()
         layout.addLayout(preview_layout)
+        layout.addLayout(tiled_layout)
         layout.addLayout(color_layout)
+        layout.addLayout(cache_layout)
         layout.addStretch()
         layout.addLayout(button_layout)
         layout.setSizeConstraint(QLayout.SizeConstraint.SetFixedSize)
@@ -312,20 +353,40 @@ class SettingsEditDialog(QDialog):
                                             self._color.green(), \
                                             self._color.blue()))
     
+    """
+    Update the label displaying the size of the preview cache.
+    """
+    def update_cache_label(self):
+        if Slide.cache is None:
+            self.cache_size_label.setText("Disabled")
+            self.cache_clear_button.setEnabled(False)
+            return
+        self.cache_size_label.setText("%.1f MB (%d images)" \
+                                      %(Slide.cache.get_size() / 1024 ** 2, \
+                                        Slide.cache.get_count()))
+
+    """
+    Handler for when the button that clears the preview cache is clicked.
+    """
+    def cache_clear_button_clicked(self):
+        Slide.cache.clear()
+        self.update_cache_label()
+
     ############################################################################
     # The following section contains overridden functions to customize features.
     ############################################################################
 
     def accept(self):
         # New settings are emitted as a signal when the dialog is accepted.
+        tiled = self.tiled_checkbox.isChecked()
         if self.preview_100_button.isChecked():
-            self.settings_changed.emit(1, self._color)
+            self.settings_changed.emit(1, self._color, tiled)
         elif self.preview_50_button.isChecked():
-            self.settings_changed.emit(0.5, self._color)
+            self.settings_changed.emit(0.5, self._color, tiled)
         elif self.preview_25_button.isChecked():
-            self.settings_changed.emit(0.25, self._color)
+            self.settings_changed.emit(0.25, self._color, tiled)
         elif self.preview_10_button.isChecked():
-            self.settings_changed.emit(0.1, self._color)
+            self.settings_changed.emit(0.1, self._color, tiled)
         super().accept()
     
 class NoNameErrorDialog(QDialog):
@@ -688,6 +749,54 @@ class ProjectEditDialog(QDialog):
         self.height_lineedit.setText(str(self._project.height))
 
         size_label_3 = QLabel(text = "px")
+
+        export_label = QLabel(text = "Export Format: ")
+        settings = self._project.export_settings
+
+        self.format_combobox = QComboBox()
+        self.format_combobox.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.format_combobox.addItems(ExportSettings.FORMATS)
+        self.format_combobox.setCurrentText(settings.image_format)
+        self.format_combobox.currentTextChanged.connect(\
+            self.format_combobox_changed)
+
+        self.compression_combobox = QComboBox()
+        self.compression_combobox.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.compression_combobox.addItems(ExportSettings.TIFF_COMPRESSIONS)
+        self.compression_combobox.setCurrentText(settings.tiff_compression)
+
+        self.level_label = QLabel(text = "Level: ")
+        self.level_spinbox = QSpinBox()
+        self.level_spinbox.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.level_spinbox.setContextMenuPolicy(\
+            Qt.ContextMenuPolicy.NoContextMenu)
+        self.level_spinbox.setMinimum(0)
+        self.level_spinbox.setMaximum(9)
+        self.level_spinbox.setValue(settings.png_level)
+
+        benchmark_button = QPushButton(text = "Benchmark")
+        benchmark_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
+        benchmark_button.clicked.connect(self.benchmark_button_clicked)
+        self.format_combobox_changed(settings.image_format)
+
+        container_label = QLabel(text = "Container: ")
+        self.container_combobox = QComboBox()
+        self.container_combobox.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.container_combobox.addItems(ExportSettings.CONTAINERS)
+        self.container_combobox.setCurrentText(settings.container)
+        self.container_combobox.currentTextChanged.connect(\
+            self.container_combobox_changed)
+
+        self.shard_label = QLabel(text = "Shard Size: ")
+        self.shard_spinbox = QSpinBox()
+        self.shard_spinbox.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.shard_spinbox.setContextMenuPolicy(\
+            Qt.ContextMenuPolicy.NoContextMenu)
+        self.shard_spinbox.setMinimum(1)
+        self.shard_spinbox.setMaximum(1048576)
+        self.shard_spinbox.setSuffix(" MB")
+        self.shard_spinbox.setValue(settings.shard_size)
+        self.container_combobox_changed(settings.container)
         
         apply_button = QPushButton(text = "Apply")
         apply_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
@@ -714,6 +823,22 @@ class ProjectEditDialog(QDialog):
         size_layout.addWidget(size_label_3)
         size_layout.addStretch()
 
+        export_layout = QHBoxLayout()
+        export_layout.addWidget(export_label)
+        export_layout.addWidget(self.format_combobox)
+        export_layout.addWidget(self.compression_combobox)
+        export_layout.addWidget(self.level_label)
+        export_layout.addWidget(self.level_spinbox)
+        export_layout.addWidget(benchmark_button)
+        export_layout.addStretch()
+
+        container_layout = QHBoxLayout()
+        container_layout.addWidget(container_label)
+        container_layout.addWidget(self.container_combobox)
+        container_layout.addWidget(self.shard_label)
+        container_layout.addWidget(self.shard_spinbox)
+        container_layout.addStretch()
+
         button_layout = QHBoxLayout()
         button_layout.addStretch()
         button_layout.addWidget(apply_button)
@@ -724,12 +849,40 @@ class ProjectEditDialog(QDialog):
         layout.addLayout(name_layout)
         layout.addLayout(index_layout)
         layout.addLayout(size_layout)
+        layout.addLayout(export_layout)
+        layout.addLayout(container_layout)
         layout.addStretch()
         layout.addLayout(button_layout)
         layout.setSizeConstraint(QLayout.SizeConstraint.SetFixedSize)
 
         self.setLayout(layout)
 
+    """
+    Handler for when the export format is changed. Only the options of the 
+    selected format are shown.
+    @param image_format: str, the selected format.
+    """
+    def format_combobox_changed(self, image_format):
+        self.compression_combobox.setVisible(image_format == "TIFF")
+        self.level_label.setVisible(image_format == "PNG")
+        self.level_spinbox.setVisible(image_format == "PNG")
+
+    """
+    Handler for when the container is changed. The shard size only applies to
+    ZIP and TAR shards.
+    @param container: str, the selected container.
+    """
+    def container_combobox_changed(self, container):
+        self.shard_label.setVisible(container in ("ZIP", "TAR"))
+        self.shard_spinbox.setVisible(container in ("ZIP", "TAR"))
+
+    """
+    Handler for when the "Benchmark" button is clicked.
+    """
+    def benchmark_button_clicked(self):
+        dialog = ExportBenchmarkDialog(self._project)
+        dialog.exec()
+
     ############################################################################
     # The following section contains overridden functions to customize features.
     ############################################################################
@@ -741,9 +894,178 @@ class ProjectEditDialog(QDialog):
         self._project.selection = self.index_spinbox.value()
         self._project.width = int(self.width_lineedit.text())
         self._project.height = int(self.height_lineedit.text())
+        self._project.export_settings = ExportSettings(\
+            self.format_combobox.currentText(), \
+            self.compression_combobox.currentText(), \
+            self.level_spinbox.value(), \
+            self.container_combobox.currentText(), \
+            self.shard_spinbox.value())
         self.project_edited.emit()
         super().accept()
 
+class ExportBenchmarkDialog(QDialog):
+    # The ExportBenchmarkDialog is prompted when the user clicks the 
+    # "Benchmark" button in the ProjectEditDialog. The crops of the current 
+    # Slide are encoded with each export format, and the encoding time is 
+    # shown along with the size of the output.
+    # The crops are read and encoded by a BenchmarkWorker on another thread, 
+    # and each result is shown as soon as it is ready.
+
+    def __init__(self, project):
+        super().__init__()
+        self.setWindowTitle("Export Benchmark")
+
+        self._sample_label = QLabel(text = "Reading the sample...")
+
+        self._results_layout = QGridLayout()
+        self._results_layout.setHorizontalSpacing(20)
+        for column, text in enumerate(["Format", "Time", "Size", "Ratio"]):
+            self._results_layout.addWidget(QLabel(text = text), 0, column)
+
+        # The ratio is relative to the size of the first result, the 
+        # uncompressed TIFF files.
+        self._rows = 0
+        self._reference = 0
+
+        ok_button = QPushButton(text = "Ok")
+        ok_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
+        ok_button.clicked.connect(self.accept)
+
+        sample_layout = QHBoxLayout()
+        sample_layout.addWidget(self._sample_label)
+        sample_layout.addStretch()
+
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(ok_button)
+
+        layout = QVBoxLayout()
+        layout.addLayout(sample_layout)
+        layout.addLayout(self._results_layout)
+        layout.addStretch()
+        layout.addLayout(button_layout)
+        layout.setSizeConstraint(QLayout.SizeConstraint.SetFixedSize)
+
+        self.setLayout(layout)
+
+        # Setting up the worker thread.
+        self._thread = QThread()
+        self._worker = BenchmarkWorker(project)
+        self._worker.sampled.connect(self.worker_sampled_handler)
+        self._worker.result.connect(self.worker_result_handler)
+        self._worker.finished.connect(self._thread.quit)
+        self._worker.moveToThread(self._thread)
+        self._thread.started.connect(self._worker.run)
+        self._thread.start()
+
+    """
+    Handler for when the BenchmarkWorker has read the sample images.
+    @param sample: str, the description of the sample.
+    """
+    def worker_sampled_handler(self, sample):
+        self._sample_label.setText(sample)
+
+    """
+    Handler for when the BenchmarkWorker has encoded the sample images with 
+    one of the settings.
+    @param settings: ExportSettings object.
+    @param seconds: float, the total encoding time.
+    @param size: int, the total output size in bytes.
+    """
+    def worker_result_handler(self, settings, seconds, size):
+        if not self._rows:
+            self._reference = size
+        ratio = size / self._reference if self._reference else 0
+        self._rows += 1
+        self._results_layout.addWidget(QLabel(text = settings.get_label()), \
+                                       self._rows, 0)
+        self._results_layout.addWidget(QLabel(text = "%.2f s" %seconds), \
+                                       self._rows, 1)
+        self._results_layout.addWidget(QLabel(text = "%.2f MB" \
+                                              %(size / 1024 ** 2)), \
+                                       self._rows, 2)
+        self._results_layout.addWidget(QLabel(text = "%.0f%%" \
+                                              %(ratio * 100)), self._rows, 3)
+
+    """
+    Stop the benchmark when the dialog is closed. The encoding in progress 
+    is waited for.
+    @param result: int, the result of the dialog.
+    """
+    def done(self, result):
+        self._worker.stop()
+        self._thread.quit()
+        self._thread.wait()
+        super().done(result)
+
+    """
+    Read the sample images: the crops of the current Slide, or a region of the 
+    default selection size at its center if it has no selections.
+    @param project: Project object.
+    @return (list of QImage, str), the images and their description.
+    """
+    def get_sample(project):
+        if not project.slides:
+            return [], "No slides to benchmark."
+        slide = project.slides[min(max(project.work_index, 1), \
+                                   len(project.slides)) - 1]
+
+        if not slide.selections:
+            if not slide.width and not slide.probe():
+                return [], "%s could not be read." %slide.file_name
+            width = project.width if project.width else 1024
+            height = project.height if project.height else 1024
+            selection = SlideSelection()
+            selection.center_coordinates = (slide.width // 2, \
+                                            slide.height // 2)
+            selection.width = min(width, slide.width)
+            selection.height = min(height, slide.height)
+            slide = Slide(slide.path)
+            slide.selections.append(selection)
+
+        images = [image for _, image in slide.get_crops()]
+        return images, "%s, %d crop(s):" %(slide.file_name, len(images))
+
+class BenchmarkWorker(QObject):
+    # BenchmarkWorker reads the sample of the ExportBenchmarkDialog and 
+    # encodes it with each of the benchmark settings, as decoding and 
+    # encoding large slides would freeze the GUI.
+
+    sampled = pyqtSignal(str)
+    result = pyqtSignal(object, float, int)
+    finished = pyqtSignal()
+
+    def __init__(self, project):
+        super().__init__()
+        self._project = project
+
+        # 0: Continue processing.
+        # 1: Stop.
+        self.status = 0
+
+    """
+    Execute the worker.
+    """
+    def run(self):
+        try:
+            images, sample = ExportBenchmarkDialog.get_sample(self._project)
+        except Exception:
+            images, sample = [], "The sample could not be read."
+        self.sampled.emit(sample)
+
+        for settings in ExportSettings.get_benchmark_settings():
+            if self.status or not images:
+                break
+            for result in ExportSettings.benchmark(images, [settings]):
+                self.result.emit(*result)
+        self.finished.emit()
+
+    """
+    Stops the worker after the settings being benchmarked.
+    """
+    def stop(self):
+        self.status = 1
+
 class ReturnSaveDialog(QDialog):
     # The ReturnSaveDialog is prompted when the user clicks the return button 
     # but unsaved changes are present.
@@ -763,7 +1085,7 @@ class ReturnSaveDialog(QDialog):
         save_button.clicked.connect(self.save_clicked)
         nosave_button = QPushButton(text = "Don't Save")
         nosave_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
-        nosave_button.clicked.connect(self.accept)
+        nosave_button.clicked.connect(self.nosave_clicked)
         cancel_button = QPushButton(text = "Cancel")
         cancel_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
         cancel_button.clicked.connect(self.reject)
@@ -787,6 +1109,14 @@ class ReturnSaveDialog(QDialog):
 
         self.setLayout(layout)
 
+    """
+    Handler for when the user clicks "Don't Save". The edits recorded since 
+    the last save are discarded.
+    """
+    def nosave_clicked(self):
+        self._project.discard_edits()
+        self.accept()
+
     """
     Handler for when the user clicks "Save".
     If no path has been set for the project, prompt a QFileDialog to determine 
@@ -794,20 +1124,21 @@ class ReturnSaveDialog(QDialog):
     """
     def save_clicked(self):
         if self._project.path:
-            self._project.save_json(self._project.path)
+            AutosaveService.save_project(self._project, self._project.path)
             self.project_saved.emit()
             self.accept()
         else:
-            filename, _ = QFileDialog.getSaveFileName(\
+            filename, selected = QFileDialog.getSaveFileName(\
                 caption = "Create a project file", \
-                filter = "SCP File (*.scp)", directory = self._project.name + \
-                ".scp")
+                filter = Project.FILE_FILTER + ";;" + Project.DATABASE_FILTER, \
+                directory = self._project.name + ".scp")
             if filename:
                 if Access.check_new_file_write(filename):
                     dialog = PermissionErrorDialog()
                     dialog.exec()
                     return False
-                self._project.save_json(filename)
+                AutosaveService.save_project(self._project, filename, \
+                    selected == Project.DATABASE_FILTER)
                 self.project_saved.emit()
                 self.accept()
 
@@ -0,0 +1,299 @@
+#!/usr/bin/python
+################################################################################
+#
+#   exportengine.py
+#   Author: Roger Wang
+#   Date: 2024-07-11
+#
+#   ExportEngine saves the crops of a list of Slides on a pool of processes.
+#   Unlike generating previews, cropping and encoding full-resolution slides
+#   spends most of its time holding the GIL in Python and in the encoders, so
+#   separate processes are used to make use of every core.
+#
+#   Slides cannot be sent to other processes as they hold QPixmaps. Each
+#   process therefore receives the path and the selections of a Slide and
+#   rebuilds a bare Slide from them before calling save_crops.
+#   Within each process, and when exporting without a pool, the crops are
+#   saved by an ExportPipeline so that reading, encoding and writing overlap.
+#
+#   Progress and failures are always reported in the order of the given
+#   Slides, so ExportWorker behaves the same as the original sequential loop.
+#
+#   The ExportManifest of the output directory is used to only export the
+#   crops that changed since the last export. Slides without any changed crop
+#   are never decoded, and the files of deleted selections and of Slides 
+#   removed from the project are removed.
+#   Every written crop is also recorded in an ExportJournal, so exporting 
+#   again after a cancel or a crash resumes from the first unfinished crop.
+#
+#   When the settings gather the crops in containers (multi-page TIFF files or
+#   ZIP/TAR shards), the export runs in this process through a single 
+#   ExportPipeline and an ExportSink, with one encoder thread per worker. The
+#   containers are written whole on every export, so the manifest is not used.
+#
+################################################################################
+
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt6.QtGui import *
+
+from exportmanifest import *
+from exportpipeline import *
+from exportsinks import *
+from project import *
+
+class ExportEngine():
+    # Default number of processes. Change this variable to limit the number of
+    # cores (and the memory) used when exporting. Each process holds one
+    # full-resolution slide at a time.
+    workers = os.cpu_count() or 1
+
+    def __init__(self, workers = 0, settings = None):
+        self._workers = workers if workers > 0 else ExportEngine.workers
+
+        # The settings are recorded in the manifest, so crops exported with 
+        # other settings are exported again.
+        self._settings = settings if settings else ExportSettings()
+        self._futures = []
+        self._pipeline = None
+
+        # 0: Continue processing.
+        # 1: Stop.
+        self.status = 0
+
+    """
+    Save the crops of the given Slides.
+    Slides that are not exported because of a stop are skipped.
+    @param slides: list of Slide objects.
+    @param directory: str, the directory for export.
+    @param progress: function taking an int, called with the number of Slides
+        handled so far, in order.
+    @param current: list of Slide objects, all the Slides of the project, 
+        whose crops are kept in the directory / None if slides are all of 
+        them.
+    @return failed: list of str, the names of the images that failed to export.
+    """
+    def run(self, slides, directory, progress = None, current = None):
+        ExportPipeline.remove_temporary(directory)
+        if self._settings.container != "None":
+            return self._run_container(slides, directory, progress)
+
+        manifest = ExportManifest(directory)
+        entries = [ExportManifest.get_entries(\
+                       slide, self._settings.get_output_dict()) \
+                   for slide in slides]
+        indices = [self._get_changed(manifest, slides[i], entries[i]) \
+                   for i in range(len(slides))]
+
+        try:
+            # Starting a process costs more than a single Slide saves.
+            if self._workers == 1 or \
+                len([i for i in indices if i]) <= 1:
+                return self._run_sequential(slides, directory, progress, \
+                                            manifest, entries, indices)
+            return self._run_parallel(slides, directory, progress, \
+                                      manifest, entries, indices)
+        finally:
+            # Crops of the Slides removed from the project.
+            manifest.remove_missing(slides if current is None else current)
+            manifest.save()
+
+    """
+    Stops the engine. Slides already being exported are allowed to finish.
+    """
+    def stop(self):
+        self.status = 1
+        if self._pipeline:
+            self._pipeline.stop()
+        for future in self._futures:
+            if future is not None:
+                future.cancel()
+
+    """
+    Get the selections of a Slide that need to be exported.
+    @param manifest: ExportManifest of the output directory.
+    @param slide: Slide object.
+    @param entries: list of dict, the manifest entries of the Slide.
+    @return list of int, the indices of the changed selections.
+    """
+    def _get_changed(self, manifest, slide, entries):
+        names = slide.get_crop_names(self._settings.get_extension())
+        return [i for i in range(len(names)) \
+                if not manifest.is_current(names[i], entries[i])]
+
+    """
+    Record the result of exporting a Slide in the manifest, and remove the 
+    files of its deleted selections.
+    @param manifest: ExportManifest of the output directory.
+    @param slide: Slide object.
+    @param entries: list of dict, the manifest entries of the Slide.
+    @param indices: list of int, the exported selections.
+    @param failed: list of str, the names of the crops that failed.
+    """
+    def _record(self, manifest, slide, entries, indices, failed):
+        names = slide.get_crop_names(self._settings.get_extension())
+        for i in indices:
+            try:
+                if names[i] in failed:
+                    raise OSError("The crop failed to export.")
+                manifest.set(names[i], entries[i], os.path.getsize(\
+                    os.path.join(manifest.directory, names[i])))
+            except OSError:
+                manifest.remove(names[i])
+        manifest.remove_stale(slide, names)
+
+    """
+    Save the crops of the given Slides in this process.
+    @param slides: list of Slide objects.
+    @param directory: str, the directory for export.
+    @param progress: function taking an int.
+    @param manifest: ExportManifest of the output directory.
+    @param entries: list of list of dict, the manifest entries of each Slide.
+    @param indices: list of list of int, the changed selections of each Slide.
+    @return failed: list of str, the names of the images that failed to export.
+    """
+    def _run_sequential(self, slides, directory, progress, manifest, \
+                        entries, indices):
+        # All Slides go through a single pipeline, so the next Slide is read
+        # while the crops of the previous one are written.
+        finished = [0]
+        def done(i, slide_failed):
+            self._record(manifest, slides[i], entries[i], indices[i], \
+                         slide_failed)
+            finished[0] += 1
+            if progress:
+                progress(finished[0])
+
+        journal = ExportJournal(directory)
+        self._pipeline = ExportPipeline(directory, self._settings, \
+                                        journal = journal)
+        if self.status:
+            self._pipeline.stop()
+        try:
+            results = self._pipeline.run([(slides[i], indices[i]) \
+                                          for i in range(len(slides))], done)
+        finally:
+            self._pipeline = None
+            journal.close()
+
+        # Slides skipped because of a stop are still counted.
+        if progress and finished[0] < len(slides):
+            progress(len(slides))
+        return [name for result in results if result for name in result]
+
+    """
+    Save the crops of the given Slides into containers.
+    @param slides: list of Slide objects.
+    @param directory: str, the directory for export.
+    @param progress: function taking an int.
+    @return failed: list of str, the names of the images that failed to export.
+    """
+    def _run_container(self, slides, directory, progress):
+        finished = [0]
+        def done(i, slide_failed):
+            finished[0] += 1
+            if progress:
+                progress(finished[0])
+
+        self._pipeline = ExportPipeline(directory, self._settings, \
+                                        encoders = self._workers, \
+                                        sink = ExportSink.create(\
+                                            directory, self._settings))
+        if self.status:
+            self._pipeline.stop()
+        try:
+            results = self._pipeline.run([(slide, None) for slide in slides], \
+                                         done)
+        finally:
+            self._pipeline = None
+
+        if progress and finished[0] < len(slides):
+            progress(len(slides))
+        return [name for result in results if result for name in result]
+
+    """
+    Save the crops of the given Slides on the pool of processes.
+    Parameters are the same as _run_sequential.
+    @return failed: list of str, the names of the images that failed to export.
+    """
+    def _run_parallel(self, slides, directory, progress, manifest, \
+                      entries, indices):
+        failed = []
+        # Processes are spawned rather than forked, as forking a process
+        # running Qt threads is unsafe.
+        with ProcessPoolExecutor(max_workers = self._workers, \
+                                 mp_context = multiprocessing.get_context(\
+                                     "spawn"), \
+                                 initializer = _initialize) as executor:
+            # Slides without changed crops are not sent to the pool.
+            self._futures = [executor.submit(_save_crops, slides[i].path, \
+                                             _get_selections(slides[i]), \
+                                             directory, indices[i], \
+                                             self._settings.to_dict()) \
+                             if indices[i] else None \
+                             for i in range(len(slides))]
+            if self.status:
+                self.stop()
+
+            for i in range(len(self._futures)):
+                future = self._futures[i]
+                if future is None and not self.status:
+                    self._record(manifest, slides[i], entries[i], [], [])
+                elif future is not None and not future.cancelled():
+                    try:
+                        slide_failed = future.result()
+                    except Exception:
+                        # The process exporting the Slide was lost.
+                        names = slides[i].get_crop_names(\
+                            self._settings.get_extension())
+                        slide_failed = [names[j] for j in indices[i]]
+                    self._record(manifest, slides[i], entries[i], \
+                                 indices[i], slide_failed)
+                    failed += slide_failed
+                if progress:
+                    progress(i + 1)
+
+        self._futures = []
+        return failed
+
+"""
+Get the selections of a Slide in a form that can be sent to other processes.
+@param slide: Slide object.
+@return list of (tuple, float, float), the center coordinates, width and
+    height of each selection.
+"""
+def _get_selections(slide):
+    return [(tuple(selection.center_coordinates), selection.width, \
+             selection.height) for selection in slide.selections]
+
+"""
+Prepare a process of the pool.
+"""
+def _initialize():
+    # Removing the image size limit, as in main.
+    QImageReader.setAllocationLimit(0)
+
+"""
+Save the crops of a Slide. This function runs in the pool.
+@param path: str, the path to the image of the Slide.
+@param selections: list of (tuple, float, float), from _get_selections.
+@param directory: str, the directory for export.
+@param indices: list of int, the selections to save.
+@param settings: dict, the ExportSettings as a dictionary.
+@return failed: list of str, the names of the images that failed to export.
+"""
+def _save_crops(path, selections, directory, indices, settings):
+    slide = Slide(path)
+    for center_coordinates, width, height in selections:
+        slide.selections.add(center_coordinates[0], center_coordinates[1], \
+                             width, height)
+    # Each process keeps its own journal.
+    journal = ExportJournal(directory)
+    try:
+        return slide.save_crops(directory, indices, \
+                                ExportSettings.from_dict(settings), journal)
+    finally:
+        journal.close()
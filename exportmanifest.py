@@ -0,0 +1,264 @@
+#!/usr/bin/python
+################################################################################
+#
+#   exportmanifest.py
+#   Author: Roger Wang
+#   Date: 2024-07-13
+#
+#   ExportManifest records what has been exported to an output directory, so
+#   that exporting again only writes the crops that changed.
+#   For every crop file, the manifest keeps the source image (path, size and
+#   modification time), the region of the selection and the output settings.
+#   A crop is up to date when its entry is unchanged and its file still
+#   exists. Crops recorded for a source image that no longer has a matching
+#   selection are stale and are removed along with their files, as are the
+#   crops of source images that are no longer in the project.
+#
+#   The manifest is stored in the output directory as
+#   .slidescrop_manifest.json.
+#
+#   While exporting, every written crop is also appended to an ExportJournal
+#   (one .slidescrop_journal.<pid>.jsonl file per process). The journals are
+#   replayed into the manifest before it is saved, so the crops of a Slide
+#   whose export was cancelled are kept, and when the manifest is loaded, in
+#   case the program crashed before saving it. Either way, the next export
+#   resumes from the first unfinished crop. The size of each crop file is
+#   recorded as well, so that partially written files are exported again.
+#
+################################################################################
+
+import glob
+import json
+import os
+
+class ExportManifest():
+    file_name = ".slidescrop_manifest.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+
+        # _crops maps the name of each crop file to its entry.
+        self._crops = {}
+        self.load()
+
+    """
+    Load the manifest from the output directory.
+    A missing or unreadable manifest is treated as empty.
+    """
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, \
+                                   ExportManifest.file_name), "r") as file:
+                manifest = json.load(file)
+            self._crops = dict(manifest["crops"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self._crops = {}
+
+        # Crops written by an interrupted export.
+        self._replay()
+
+    """
+    Save the manifest to the output directory.
+    @return True (success) / False (the manifest could not be written).
+    """
+    def save(self):
+        # The Slides cut by a cancel were never recorded, but their finished 
+        # crops are in the journals.
+        self._replay()
+
+        path = os.path.join(self.directory, ExportManifest.file_name)
+        try:
+            with open(path + ".tmp", "w") as file:
+                json.dump({"crops": self._crops}, file)
+            os.replace(path + ".tmp", path)
+        except OSError:
+            return False
+
+        # The journals are only needed until the manifest is saved.
+        ExportJournal.clear(self.directory)
+        return True
+
+    """
+    Record the crops of the journals of the output directory.
+    """
+    def _replay(self):
+        for name, entry, size in ExportJournal.replay(self.directory):
+            self.set(name, entry, size)
+
+    """
+    Get the entries describing the crops of a Slide.
+    @param slide: Slide object.
+    @param settings: dict, the output settings of the export.
+    @return list of dict, the entry of each selection.
+    """
+    def get_entries(slide, settings):
+        try:
+            stat = os.stat(slide.path)
+            fingerprint = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            fingerprint = []
+        source = os.path.abspath(slide.path)
+
+        entries = []
+        for rect in slide.get_crop_rects():
+            entries.append({
+                "source": source,
+                "fingerprint": fingerprint,
+                "rect": [rect.left(), rect.top(), rect.width(), \
+                         rect.height()],
+                "settings": settings,
+            })
+        return entries
+
+    """
+    Check whether a crop file is up to date.
+    @param name: str, the name of the crop file.
+    @param entry: dict, the current entry of the crop.
+    @return True (up to date) / False (needs to be exported).
+    """
+    def is_current(self, name, entry):
+        # Entries without a fingerprint can never be trusted.
+        recorded = self._crops.get(name)
+        if not entry["fingerprint"] or not recorded:
+            return False
+        if {key: value for key, value in recorded.items() \
+            if key != "size"} != entry:
+            return False
+
+        # A file of another size was only partially written.
+        try:
+            return os.path.getsize(os.path.join(self.directory, name)) == \
+                recorded.get("size")
+        except OSError:
+            return False
+
+    """
+    Record an exported crop file.
+    @param name: str, the name of the crop file.
+    @param entry: dict, the entry of the crop.
+    @param size: int, the size of the written file in bytes.
+    """
+    def set(self, name, entry, size):
+        self._crops[name] = dict(entry, size = size)
+
+    """
+    Forget a crop file, so that it is exported again.
+    @param name: str, the name of the crop file.
+    """
+    def remove(self, name):
+        self._crops.pop(name, None)
+
+    """
+    Remove the crop files recorded for a source image that are no longer
+    among its crops.
+    @param slide: Slide object.
+    @param names: list of str, the names of the current crops of the Slide.
+    @return list of str, the names of the removed crop files.
+    """
+    def remove_stale(self, slide, names):
+        source = os.path.abspath(slide.path)
+        names = set(names)
+        return self._remove_files([name for name, entry in self._crops.items() \
+                                   if entry.get("source") == source and \
+                                   name not in names])
+
+    """
+    Remove the crop files recorded for source images that are not the image 
+    of any of the given Slides.
+    @param slides: list of Slide objects, all the Slides of the project.
+    @return list of str, the names of the removed crop files.
+    """
+    def remove_missing(self, slides):
+        sources = set(os.path.abspath(slide.path) for slide in slides)
+        return self._remove_files([name for name, entry in self._crops.items() \
+                                   if entry.get("source") not in sources])
+
+    """
+    Remove crop files and forget them. Files that cannot be removed are kept
+    in the manifest.
+    @param names: list of str, the names of the crop files.
+    @return list of str, the names of the removed crop files.
+    """
+    def _remove_files(self, names):
+        removed = []
+        for name in names:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # The file will be removed during the next export.
+                continue
+            del self._crops[name]
+            removed.append(name)
+        return removed
+
+class ExportJournal():
+    # ExportJournal appends the crops written by this process to a journal in
+    # the output directory. Each line is written and flushed as soon as the
+    # crop file is complete.
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._path = os.path.join(directory, ".slidescrop_journal.%d.jsonl" \
+                                  %os.getpid())
+        self._file = None
+
+    """
+    Record a written crop file.
+    @param name: str, the name of the crop file.
+    @param entry: dict, the manifest entry of the crop.
+    @param size: int, the size of the file in bytes.
+    """
+    def record(self, name, entry, size):
+        if self._file is None:
+            self._file = open(self._path, "a")
+        self._file.write(json.dumps({"name": name, "entry": entry, \
+                                     "size": size}) + "\n")
+        self._file.flush()
+
+    """
+    Close the journal.
+    """
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    """
+    Read the journals left in an output directory.
+    @param directory: str, the output directory.
+    @return list of (str, dict, int), the name, entry and size of each 
+        recorded crop file.
+    """
+    def replay(directory):
+        records = []
+        for path in sorted(glob.glob(os.path.join(glob.escape(directory), \
+                                                  ".slidescrop_journal.*"))):
+            try:
+                with open(path, "r") as file:
+                    lines = file.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                # The last line is incomplete if the program crashed while
+                # writing it.
+                try:
+                    record = json.loads(line)
+                    records.append((record["name"], record["entry"], \
+                                    record["size"]))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        return records
+
+    """
+    Remove the journals of an output directory.
+    @param directory: str, the output directory.
+    """
+    def clear(directory):
+        for path in glob.glob(os.path.join(glob.escape(directory), \
+                                           ".slidescrop_journal.*")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
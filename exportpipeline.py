@@ -0,0 +1,468 @@
+#!/usr/bin/python
+################################################################################
+#
+#   exportpipeline.py
+#   Author: Roger Wang
+#   Date: 2024-07-15
+#
+#   ExportPipeline saves the crops of Slides as a streaming pipeline, so that
+#   reading, encoding and writing overlap instead of waiting on each other:
+#       decoder -> cropper -> encoders -> writer
+#   The decoder opens each slide (a TiffRegionReader when possible, otherwise
+#   the decoded QImage), the cropper cuts the selections out of it, a small
+#   pool of encoders turns the crops into files in memory, and the writer
+#   writes them to the disk.
+#
+#   The stages run on threads joined by bounded queues. A stage blocks when
+#   the next one falls behind, so at most one opened slide is waiting and the
+#   number of crops in flight is capped by the depth of the queues, whatever
+#   the number of Slides.
+#
+#   When an ExportJournal is given, every crop is recorded in it as soon as
+#   its file is written, so an interrupted export can be resumed.
+#
+#   Crop files are never written in place. Each crop is written to a hidden
+#   temporary file in the output directory, synced to the disk and renamed
+#   over the final name, so a crash or a full disk never leaves a truncated
+#   crop behind. Each file is synced before it is renamed, while the renames
+#   are done in batches followed by a single sync of the directory, so that
+#   the directory is not synced once per crop on large exports.
+#
+#   Temporary files are named .slidescrop.<name>.<pid>.tmp. Only files with
+#   this prefix are removed when an interrupted export is cleaned up, so 
+#   other files of the output directory are never touched.
+#
+#   When an ExportSink is given (see exportsinks.py), the crops are encoded 
+#   by the sink and handed to it in the order of the selections instead of
+#   being written as separate files.
+#
+################################################################################
+
+import glob
+import os
+import queue
+import threading
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+from exportmanifest import *
+from exportsettings import *
+from tiffio import *
+
+class ExportPipeline():
+    # Default number of encoder threads.
+    encoders = 2
+
+    # Default number of crops held by each queue.
+    depth = 4
+
+    # Whether written files are synced to the disk before being renamed.
+    sync = True
+
+    # Number of files renamed before the directory is synced. The writer also
+    # commits whatever it has written as soon as no other crop is waiting.
+    sync_batch = 16
+
+    # Whether the output directory is synced after each batch of renames.
+    sync_directory = True
+
+    # Prefix of the temporary files written in the output directory.
+    TEMPORARY_PREFIX = ".slidescrop."
+
+    def __init__(self, directory, settings = None, encoders = 0, depth = 0, \
+                 journal = None, sink = None):
+        self.directory = directory
+        self._settings = settings if settings else ExportSettings()
+        self._journal = journal
+        self._sink = sink
+        self._encoders = encoders if encoders > 0 else ExportPipeline.encoders
+        self._depth = depth if depth > 0 else ExportPipeline.depth
+
+        # 0: Continue processing.
+        # 1: Stop.
+        self.status = 0
+
+    """
+    Save the crops of the given Slides.
+    @param jobs: list of (Slide, list of int), each Slide with the selections
+        to save (None for all).
+    @param done: function taking an int and a list of str, called from the
+        writer with the index of each finished job and its failed crops.
+    @return list of list of str, the names of the crops that failed for each
+        job, or None for jobs not finished because of a stop.
+    """
+    def run(self, jobs, done = None):
+        self._jobs = []
+        for slide, indices in jobs:
+            if indices is None:
+                indices = list(range(len(slide.selections)))
+            self._jobs.append((slide, list(indices), \
+                               slide.get_crop_names(\
+                                   self._settings.get_extension())))
+        self._done = done
+        self._results = [None] * len(self._jobs)
+        self._failed = [[] for job in self._jobs]
+        self._remaining = [len(indices) for slide, indices, names in \
+                           self._jobs]
+        self._entries = [ExportManifest.get_entries(\
+            slide, self._settings.get_output_dict()) if self._journal else [] \
+            for slide, indices, names in self._jobs]
+
+        # A single opened slide waits for the cropper, as decoded slides can
+        # be very large.
+        self._decoded = queue.Queue(maxsize = 1)
+        self._crops = queue.Queue(maxsize = self._depth)
+        self._encoded = queue.Queue(maxsize = self._depth)
+        self._error = None
+
+        threads = [threading.Thread(target = self._decode), \
+                   threading.Thread(target = self._crop), \
+                   threading.Thread(target = self._write_sink if self._sink \
+                                    else self._write)]
+        threads += [threading.Thread(target = self._encode) \
+                    for i in range(self._encoders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error:
+            raise self._error
+        return self._results
+
+    """
+    Stops the pipeline. Crops already cut are still encoded and written.
+    """
+    def stop(self):
+        self.status = 1
+
+    """
+    Decoder stage: open the slides in order.
+    """
+    def _decode(self):
+        try:
+            for job in range(len(self._jobs)):
+                if self.status:
+                    break
+                slide, indices, names = self._jobs[job]
+                if not indices:
+                    # Nothing is decoded when there is nothing to save. The 
+                    # job still goes through the stages, so that every job is
+                    # finished by the writer.
+                    self._decoded.put((job, None))
+                    continue
+
+                reader = TiffRegionReader(slide.path)
+                if reader.is_supported():
+                    source = reader
+                else:
+                    reader.close()
+                    source = QImage(slide.path)
+                self._decoded.put((job, source))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            # The end marker is always sent, so the next stages never wait
+            # forever.
+            self._decoded.put(None)
+
+    """
+    Crop stage: cut the selections out of the opened slides.
+    """
+    def _crop(self):
+        try:
+            while True:
+                item = self._decoded.get()
+                if item is None:
+                    break
+                job, source = item
+                if source is None:
+                    self._crops.put((job, None, None))
+                    continue
+                slide, indices, names = self._jobs[job]
+                rects = slide.get_crop_rects()
+
+                try:
+                    for i in indices:
+                        if self.status or self._error:
+                            break
+                        if isinstance(source, TiffRegionReader):
+                            image = source.read_region(rects[i])
+                        else:
+                            image = source.copy(rects[i])
+                        self._crops.put((job, i, image))
+                finally:
+                    if isinstance(source, TiffRegionReader):
+                        source.close()
+        except Exception as e:
+            self._fail(e)
+            # The remaining slides are drained so the decoder can finish.
+            while self._decoded.get() is not None:
+                pass
+        finally:
+            # Each encoder stops after one end marker.
+            for i in range(self._encoders):
+                self._crops.put(None)
+
+    """
+    Encoder stage: encode the crops into files in memory.
+    """
+    def _encode(self):
+        while True:
+            item = self._crops.get()
+            if item is None:
+                break
+            job, i, image = item
+            try:
+                if i is None:
+                    data = b""
+                elif self._sink:
+                    data = self._sink.encode(self._jobs[job][0], image, \
+                                             self._jobs[job][2][i])
+                else:
+                    data = self._settings.encode(image)
+            except Exception:
+                # The crop is reported as failed by the writer.
+                data = b""
+            self._encoded.put((job, i, data))
+        self._encoded.put(None)
+
+    """
+    Writer stage: write the encoded crops to the disk.
+    """
+    def _write(self):
+        ended = 0
+
+        # batch should be a list of (int, int, file), the job, the selection 
+        # and the open temporary file of each crop waiting to be synced.
+        batch = []
+        while ended < self._encoders:
+            item = self._encoded.get()
+            if item is None:
+                ended += 1
+                continue
+            job, i, data = item
+            if i is None:
+                self._finish(job)
+                continue
+            temp_path = self._get_temporary_path(self._jobs[job][2][i])
+
+            file = None
+            try:
+                if not data:
+                    raise ValueError("The crop could not be encoded.")
+                file = open(temp_path, "wb")
+                file.write(data)
+                file.flush()
+                batch.append((job, i, file))
+            except Exception:
+                if file:
+                    file.close()
+                    ExportPipeline._remove(temp_path)
+                self._failed[job].append(self._jobs[job][2][i])
+                self._complete(job)
+
+            if len(batch) >= ExportPipeline.sync_batch or \
+                self._encoded.empty():
+                self._commit(batch)
+                batch = []
+        self._commit(batch)
+
+    """
+    Writer stage when a sink is given: hand the encoded crops to the sink in
+    the order of the jobs and of their selections.
+    """
+    def _write_sink(self):
+        ended = 0
+        order = [(job, i) for job in range(len(self._jobs)) \
+                 for i in (self._jobs[job][1] or [None])]
+        position = 0
+
+        # Crops encoded ahead of their turn wait in pending.
+        pending = {}
+        try:
+            while ended < self._encoders:
+                item = self._encoded.get()
+                if item is None:
+                    ended += 1
+                    continue
+                job, i, data = item
+                pending[(job, i)] = data
+                while position < len(order) and order[position] in pending:
+                    self._add(*order[position], pending.pop(order[position]))
+                    position += 1
+
+            # After a stop, the crops that were cut are still added.
+            for key in order[position:]:
+                if key in pending:
+                    self._add(*key, pending.pop(key))
+        except Exception as e:
+            self._fail(e)
+            while ended < self._encoders:
+                if self._encoded.get() is None:
+                    ended += 1
+        finally:
+            lost = self._sink.close()
+
+        # Crops lost when closing the containers were already reported by
+        # done, but are still returned as failed.
+        for job in range(len(self._jobs)):
+            names = self._jobs[job][2]
+            if self._results[job] is not None:
+                self._failed[job] += [name for name in names \
+                                      if name in lost and \
+                                      name not in self._failed[job]]
+                self._results[job] = sorted(self._failed[job], \
+                                            key = names.index)
+
+    """
+    Hand an encoded crop to the sink.
+    @param job: int, the index of the job.
+    @param i: int, the selection, or None for a job without selections.
+    @param data: the encoded crop.
+    """
+    def _add(self, job, i, data):
+        slide, indices, names = self._jobs[job]
+        if i is not None:
+            try:
+                if not data:
+                    raise ValueError("The crop could not be encoded.")
+                self._sink.add(slide, i, names[i], data)
+            except Exception:
+                self._failed[job].append(names[i])
+            self._remaining[job] -= 1
+            if self._remaining[job]:
+                return
+
+        try:
+            self._failed[job] += self._sink.end(slide)
+        except Exception:
+            self._failed[job] = [names[i] for i in indices]
+        self._finish(job)
+
+    """
+    Sync a batch of temporary files and rename them to their final names.
+    The crops are recorded in the journal once they are in place.
+    @param batch: list of (int, int, file), the written crops.
+    """
+    def _commit(self, batch):
+        committed = []
+        for job, i, file in batch:
+            name = self._jobs[job][2][i]
+            try:
+                try:
+                    if ExportPipeline.sync:
+                        os.fsync(file.fileno())
+                    size = file.tell()
+                finally:
+                    file.close()
+                os.replace(file.name, os.path.join(self.directory, name))
+                committed.append((job, i, size))
+            except Exception:
+                ExportPipeline._remove(file.name)
+                self._failed[job].append(name)
+                self._complete(job)
+
+        if committed and ExportPipeline.sync and \
+            ExportPipeline.sync_directory:
+            self._sync_directory()
+
+        for job, i, size in committed:
+            try:
+                if self._journal:
+                    self._journal.record(self._jobs[job][2][i], \
+                                         self._entries[job][i], size)
+            except Exception:
+                self._failed[job].append(self._jobs[job][2][i])
+            self._complete(job)
+
+    """
+    Count a crop of a job as handled, and finish the job after its last crop.
+    @param job: int, the index of the job.
+    """
+    def _complete(self, job):
+        self._remaining[job] -= 1
+        if not self._remaining[job]:
+            self._finish(job)
+
+    """
+    Sync the output directory, so that renamed files survive a crash.
+    Directories cannot be synced on every system, in which case this is 
+    skipped.
+    """
+    def _sync_directory(self):
+        try:
+            descriptor = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(descriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(descriptor)
+
+    """
+    Get the path of the temporary file of a crop.
+    @param name: str, the name of the crop file.
+    @return str, the path of the temporary file.
+    """
+    def _get_temporary_path(self, name):
+        return ExportPipeline.get_temporary_path(self.directory, name)
+
+    """
+    Get the path of the temporary file of a file written by an export.
+    @param directory: str, the output directory.
+    @param name: str, the name of the file.
+    @return str, the path of the temporary file.
+    """
+    def get_temporary_path(directory, name):
+        return os.path.join(directory, "%s%s.%d.tmp" \
+                            %(ExportPipeline.TEMPORARY_PREFIX, name, \
+                              os.getpid()))
+
+    """
+    Remove the temporary files left in an output directory by an interrupted 
+    export. Only the files named by get_temporary_path are removed.
+    @param directory: str, the output directory.
+    """
+    def remove_temporary(directory):
+        for path in glob.glob(os.path.join(glob.escape(directory), \
+            glob.escape(ExportPipeline.TEMPORARY_PREFIX) + "*.tmp")):
+            ExportPipeline._remove(path)
+
+    """
+    Remove a file, ignoring errors.
+    @param path: str, the path of the file.
+    """
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    """
+    Record a finished job.
+    @param job: int, the index of the job.
+    """
+    def _finish(self, job):
+        # Failures are reported in the order of the selections.
+        names = self._jobs[job][2]
+        self._results[job] = sorted(self._failed[job], key = names.index)
+        if self._done and not self._error:
+            try:
+                self._done(job, self._results[job])
+            except Exception as e:
+                # The writer keeps draining the queues.
+                self._fail(e)
+
+    """
+    Record an unexpected error and stop the pipeline. The error is raised by
+    run once every stage has finished.
+    @param error: Exception, the error.
+    """
+    def _fail(self, error):
+        if not self._error:
+            self._error = error
+        self.stop()
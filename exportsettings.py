@@ -0,0 +1,181 @@
+#!/usr/bin/python
+################################################################################
+#
+#   exportsettings.py
+#   Author: Roger Wang
+#   Date: 2024-07-14
+#
+#   ExportSettings describes how the crops of a Project are written: TIFF
+#   (uncompressed, LZW or Deflate), PNG with a zlib compression level, or
+#   lossless WebP. The settings are stored in the project file.
+#
+#   The crops are written as individual files by default. They can instead 
+#   be gathered in containers: one multi-page TIFF per slide, ZIP or TAR 
+#   shards of a limited size, or NumPy stacks of raw pixels (see 
+#   exportsinks.py).
+#
+#   Uncompressed, LZW and WebP files are encoded by QImageWriter. Deflate
+#   TIFF files are encoded by TiffWriter, as Qt does not offer Deflate.
+#   benchmark encodes a sample image with several settings, so that the
+#   encoding time can be weighed against the size of the output.
+#
+################################################################################
+
+import math
+import time
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+from tiffio import *
+
+class ExportSettings():
+    FORMATS = ("TIFF", "PNG", "WebP")
+    TIFF_COMPRESSIONS = ("None", "LZW", "Deflate")
+    CONTAINERS = ("None", "TIFF", "ZIP", "TAR", "NPY")
+
+    def __init__(self, image_format = "TIFF", tiff_compression = "None", \
+                 png_level = 6, container = "None", shard_size = 2048):
+        # The default settings write uncompressed TIFF files, as before.
+        self.image_format = image_format
+        self.tiff_compression = tiff_compression
+
+        # png_level should be a zlib compression level from 0 to 9.
+        self.png_level = png_level
+
+        # container should be one of CONTAINERS, "None" for individual files.
+        # The pages of multi-page TIFF files are always TIFF, compressed 
+        # with Deflate unless the TIFF compression is "None".
+        self.container = container
+
+        # shard_size is the maximum size of ZIP and TAR shards in MB.
+        self.shard_size = shard_size
+
+    """
+    Get the extension of the crop files.
+    @return str, the extension without the dot.
+    """
+    def get_extension(self):
+        return {"TIFF": "tif", "PNG": "png", "WebP": "webp"}[self.image_format]
+
+    """
+    Get a short description of the settings.
+    @return str, the description.
+    """
+    def get_label(self):
+        if self.image_format == "TIFF":
+            return "TIFF (%s)" %self.tiff_compression
+        if self.image_format == "PNG":
+            return "PNG (level %d)" %self.png_level
+        return "WebP (lossless)"
+
+    """
+    Get the settings as a dictionary, as stored in the project file.
+    @return dict, the settings.
+    """
+    def to_dict(self):
+        return {
+            "format": self.image_format,
+            "tiff_compression": self.tiff_compression,
+            "png_level": self.png_level,
+            "container": self.container,
+            "shard_size": self.shard_size,
+        }
+
+    """
+    Get the settings that the crop files depend on, as recorded in the export 
+    manifest. The options of the other formats and the container are left 
+    out, so that changing them does not export the crops again.
+    @return dict, the settings.
+    """
+    def get_output_dict(self):
+        settings = {"format": self.image_format}
+        if self.image_format == "TIFF":
+            settings["tiff_compression"] = self.tiff_compression
+        elif self.image_format == "PNG":
+            settings["png_level"] = self.png_level
+        return settings
+
+    """
+    Create settings from a dictionary made by to_dict.
+    Unknown or missing values are replaced by the defaults.
+    @param settings: dict, the settings.
+    @return ExportSettings object.
+    """
+    def from_dict(settings):
+        result = ExportSettings()
+        if settings.get("format") in ExportSettings.FORMATS:
+            result.image_format = settings["format"]
+        if settings.get("tiff_compression") in \
+            ExportSettings.TIFF_COMPRESSIONS:
+            result.tiff_compression = settings["tiff_compression"]
+        if settings.get("png_level") in range(10):
+            result.png_level = settings["png_level"]
+        if settings.get("container") in ExportSettings.CONTAINERS:
+            result.container = settings["container"]
+        if isinstance(settings.get("shard_size"), int) and \
+            settings["shard_size"] > 0:
+            result.shard_size = settings["shard_size"]
+        return result
+
+    """
+    Encode an image with these settings.
+    @param image: QImage, the image to encode.
+    @return bytes, the encoded file (empty if the image could not be encoded).
+    """
+    def encode(self, image):
+        if image.isNull():
+            return b""
+        if self.image_format == "TIFF" and self.tiff_compression == "Deflate":
+            return TiffWriter.encode(image)
+
+        data = QByteArray()
+        buffer = QBuffer(data)
+        buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+        writer = QImageWriter(buffer, self.get_extension().encode())
+        if self.image_format == "TIFF":
+            # 0: Uncompressed. 1: LZW.
+            writer.setCompression(\
+                ExportSettings.TIFF_COMPRESSIONS.index(self.tiff_compression))
+        elif self.image_format == "PNG":
+            # Qt maps a quality of 100 to 0 (level 0) to about 9 (level 9).
+            writer.setQuality(100 - math.ceil(self.png_level * 91 / 9))
+        else:
+            # A quality of 100 makes WebP lossless.
+            writer.setQuality(100)
+
+        if not writer.write(image):
+            return b""
+        buffer.close()
+        return data.data()
+
+    """
+    Get the settings compared by benchmark.
+    @return list of ExportSettings objects.
+    """
+    def get_benchmark_settings():
+        return [ExportSettings("TIFF", "None"), \
+                ExportSettings("TIFF", "LZW"), \
+                ExportSettings("TIFF", "Deflate"), \
+                ExportSettings("PNG", png_level = 1), \
+                ExportSettings("PNG", png_level = 6), \
+                ExportSettings("PNG", png_level = 9), \
+                ExportSettings("WebP")]
+
+    """
+    Encode sample images with each of the benchmark settings.
+    @param images: list of QImage, the sample images.
+    @param settings_list: list of ExportSettings objects to compare, or None 
+        for get_benchmark_settings.
+    @return list of (ExportSettings, float, int), the settings, the total
+        encoding time in seconds and the total output size in bytes.
+    """
+    def benchmark(images, settings_list = None):
+        if settings_list is None:
+            settings_list = ExportSettings.get_benchmark_settings()
+        results = []
+        for settings in settings_list:
+            start = time.perf_counter()
+            size = sum(len(settings.encode(image)) for image in images)
+            results.append((settings, time.perf_counter() - start, size))
+        return results
@@ -0,0 +1,469 @@
+#!/usr/bin/python
+################################################################################
+#
+#   exportsinks.py
+#   Author: Roger Wang
+#   Date: 2024-07-17
+#
+#   Export sinks gather the crops of an export into a few container files
+#   instead of one file per crop, as creating thousands of small files on a
+#   network share is dominated by the round trips for each file.
+#
+#   MultiPageTiffSink writes one multi-page TIFF per Slide, each page named
+#   after its crop. ShardSink writes the crops as members of ZIP or TAR
+#   shards of a limited size, along with an index (crops_index.json) giving
+#   the shard, the offset and the size of every crop, so that a crop can be
+#   read without going through the shards. In both cases the names given by
+#   Slide.get_crop_names are kept as page and member names.
+#
+#   ArrayStackSink writes the raw pixels of the crops into NumPy .npy stacks,
+#   one per crop shape, so that the whole export can be opened with
+#   numpy.load(path, mmap_mode = "r") without decoding any file. An index
+#   (stack_index.json) maps every row of every stack to its Slide and its
+#   selection. NumPy is not needed to write the stacks.
+#
+#   The containers are written like the crop files of ExportPipeline: to a
+#   hidden temporary file in the output directory, synced and renamed once
+#   complete.
+#
+################################################################################
+
+import io
+import json
+import os
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+
+from exportpipeline import *
+from exportsettings import *
+from tiffio import *
+
+class ExportSink():
+    # ExportSink is the base of the sinks. The pipeline calls encode from its
+    # encoders, then add for every crop in the order of the selections, end
+    # after the last crop of each Slide and close once everything is added.
+    # Each sink defines add(slide, i, name, data), which adds the crop of 
+    # selection i of the Slide, as returned by encode, to its container. 
+    # Errors are raised, and the crop is then reported as failed.
+
+    def __init__(self, directory, settings):
+        self.directory = directory
+        self._settings = settings
+
+    """
+    Create the sink for the container of the given settings.
+    @param directory: str, the output directory.
+    @param settings: ExportSettings object.
+    @return ExportSink, or None when the crops are written as separate files.
+    """
+    def create(directory, settings):
+        if settings.container == "TIFF":
+            return MultiPageTiffSink(directory, settings)
+        if settings.container in ("ZIP", "TAR"):
+            return ShardSink(directory, settings)
+        if settings.container == "NPY":
+            return ArrayStackSink(directory, settings)
+        return None
+
+    """
+    Encode a crop. This function is called from several threads.
+    @param slide: Slide object, the Slide of the crop.
+    @param image: QImage, the crop.
+    @param name: str, the name of the crop.
+    @return the encoded crop, empty or None if it could not be encoded.
+    """
+    def encode(self, slide, image, name):
+        return self._settings.encode(image)
+
+    """
+    Finish the crops of a Slide.
+    @param slide: Slide object.
+    @return list of str, the names of the crops lost while finishing.
+    """
+    def end(self, slide):
+        return []
+
+    """
+    Finish the export.
+    @return list of str, the names of the crops lost while finishing.
+    """
+    def close(self):
+        return []
+
+    """
+    Open the temporary file of a container.
+    @param name: str, the name of the container.
+    @return file, the temporary file opened for writing.
+    """
+    def _open(self, name):
+        return open(ExportPipeline.get_temporary_path(self.directory, name), \
+                    "wb")
+
+    """
+    Sync and close the temporary file of a container, and rename it to the
+    final name of the container. The file is removed if this fails.
+    @param file: file, the temporary file from _open.
+    @param name: str, the name of the container.
+    """
+    def _commit(self, file, name):
+        try:
+            try:
+                file.flush()
+                if ExportPipeline.sync:
+                    os.fsync(file.fileno())
+            finally:
+                file.close()
+            os.replace(file.name, os.path.join(self.directory, name))
+        except Exception:
+            ExportPipeline._remove(file.name)
+            raise
+        if ExportPipeline.sync and ExportPipeline.sync_directory:
+            ExportSink._sync_directory(self.directory)
+
+    """
+    Write a JSON file to the output directory, through a temporary file.
+    @param name: str, the name of the file.
+    @param value: the content of the file.
+    @return True (success) / False (failure).
+    """
+    def _save_json(self, name, value):
+        file = None
+        try:
+            file = self._open(name)
+            file.write(json.dumps(value, indent = 4).encode("utf-8"))
+            self._commit(file, name)
+        except Exception:
+            if file:
+                file.close()
+                ExportPipeline._remove(file.name)
+            return False
+        return True
+
+    """
+    Remove the containers left by a previous export. Only the containers 
+    listed in the index of the previous export are removed, so that other 
+    files of the output directory are never touched. This must be called 
+    before the index is replaced.
+    @param index_name: str, the name of the index.
+    @param key: str, the key of the index listing the containers.
+    @param names: list of str, the names of the containers to keep.
+    """
+    def _remove_old(self, index_name, key, names):
+        try:
+            with open(os.path.join(self.directory, index_name), "r") as file:
+                containers = json.load(file)[key]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if not isinstance(containers, (list, dict)):
+            return
+        for name in containers:
+            # Names are only trusted within the output directory.
+            if not isinstance(name, str) or name in names or \
+                os.path.basename(name) != name or name.startswith("."):
+                continue
+            ExportPipeline._remove(os.path.join(self.directory, name))
+
+    """
+    Sync a directory, skipping systems where this is not possible.
+    @param directory: str, the directory.
+    """
+    def _sync_directory(directory):
+        try:
+            descriptor = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(descriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(descriptor)
+
+class MultiPageTiffSink(ExportSink):
+    # MultiPageTiffSink writes the crops of each Slide as the pages of
+    # <name>_crops.tif. The pages are compressed with Deflate unless the TIFF
+    # compression of the settings is "None".
+
+    def __init__(self, directory, settings):
+        super().__init__(directory, settings)
+        self._level = None if settings.tiff_compression == "None" else 6
+
+        # The file of the Slide being written, with its pages.
+        self._slide = None
+        self._file = None
+        self._writer = None
+        self._names = []
+
+    """
+    Get the name of the multi-page TIFF of a Slide.
+    @param slide: Slide object.
+    @return str, the name of the file.
+    """
+    def get_name(slide):
+        return slide.file_name[:slide.file_name.rfind(".")] + "_crops.tif"
+
+    def encode(self, slide, image, name):
+        return TiffWriter.encode_page(image, self._level, name)
+
+    def add(self, slide, i, name, data):
+        if self._slide is not slide:
+            self._discard()
+            path = os.path.join(self.directory, \
+                                MultiPageTiffSink.get_name(slide))
+            if os.path.exists(path) and os.path.samefile(path, slide.path):
+                raise OSError("The container would replace the slide.")
+            self._file = self._open(MultiPageTiffSink.get_name(slide))
+            self._writer = TiffWriter(self._file)
+            self._slide = slide
+            self._names = []
+        self._writer.add_page(data)
+        self._names.append(name)
+
+    def end(self, slide):
+        if self._slide is not slide:
+            return []
+        file = self._file
+        names = self._names
+        self._slide = None
+        self._file = None
+        self._writer = None
+        self._names = []
+        try:
+            self._commit(file, MultiPageTiffSink.get_name(slide))
+        except Exception:
+            return names
+        return []
+
+    def close(self):
+        # A Slide that was not finished is not written.
+        self._discard()
+        return []
+
+    """
+    Remove the file of an unfinished Slide.
+    """
+    def _discard(self):
+        if self._file is not None:
+            self._file.close()
+            ExportPipeline._remove(self._file.name)
+        self._slide = None
+        self._file = None
+        self._writer = None
+        self._names = []
+
+class ShardSink(ExportSink):
+    # ShardSink writes the crops as members of crops_0001.zip, crops_0002.zip
+    # and so on (or .tar), starting a new shard before one would exceed the
+    # shard size of the settings. ZIP members are stored without compression,
+    # as the crops are already encoded.
+
+    index_name = "crops_index.json"
+
+    def __init__(self, directory, settings):
+        super().__init__(directory, settings)
+        self._kind = settings.container.lower()
+        self._limit = settings.shard_size * 1024 * 1024
+
+        # The shard being written.
+        self._file = None
+        self._archive = None
+        self._names = []
+
+        # _shards should be a list of the names of the written shards, and
+        # _crops should map the name of each crop to its index entry.
+        self._shards = []
+        self._crops = {}
+
+    def add(self, slide, i, name, data):
+        if not data:
+            raise ValueError("The crop could not be encoded.")
+        # Each member takes a header of at most about 1 kB.
+        if self._file is not None and self._names and \
+            self._file.tell() + len(data) + 1024 > self._limit:
+            self._finish_shard()
+        if self._file is None:
+            self._shards.append("crops_%04d.%s" %(len(self._shards) + 1, \
+                                                  self._kind))
+            self._file = self._open(self._shards[-1])
+            if self._kind == "zip":
+                self._archive = zipfile.ZipFile(self._file, "w", \
+                                                zipfile.ZIP_STORED, \
+                                                allowZip64 = True)
+            else:
+                self._archive = tarfile.open(fileobj = self._file, \
+                                             mode = "w", \
+                                             format = tarfile.PAX_FORMAT)
+            self._names = []
+
+        if self._kind == "zip":
+            info = zipfile.ZipInfo(name, time.localtime()[:6])
+            self._archive.writestr(info, data)
+            # Stored members end where the data ends.
+            offset = self._file.tell() - len(data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = int(time.time())
+            self._archive.addfile(info, io.BytesIO(data))
+            # The data is padded to blocks of 512 bytes.
+            offset = self._archive.offset - (len(data) + 511) // 512 * 512
+
+        self._names.append(name)
+        self._crops[name] = {
+            "shard": self._shards[-1],
+            "source": os.path.abspath(slide.path),
+            "offset": offset,
+            "size": len(data),
+        }
+
+    def close(self):
+        lost = self._finish_shard()
+
+        # Shards left by a previous export would be mistaken for this one.
+        self._remove_old(ShardSink.index_name, "shards", self._shards)
+
+        # Without the index, the crops are still in the shards.
+        self._save_json(ShardSink.index_name, {"shards": self._shards, \
+                                               "crops": self._crops})
+        return lost
+
+    """
+    Close the shard being written.
+    @return list of str, the names of its crops if it could not be written.
+    """
+    def _finish_shard(self):
+        if self._file is None:
+            return []
+        file = self._file
+        names = self._names
+        self._file = None
+        self._names = []
+        try:
+            try:
+                self._archive.close()
+            finally:
+                self._archive = None
+            self._commit(file, self._shards[-1])
+        except Exception:
+            file.close()
+            ExportPipeline._remove(file.name)
+            self._shards.pop()
+            for name in names:
+                self._crops.pop(name, None)
+            return names
+        return []
+
+class ArrayStackSink(ExportSink):
+    # ArrayStackSink appends the pixels of each crop as a row of the stack of
+    # its shape: stack_0001.npy, stack_0002.npy and so on. Each stack holds an
+    # array of shape (rows, height, width) for grayscale crops, or (rows,
+    # height, width, samples) for color crops, in the layout used by
+    # TiffWriter.encode_page. All crops of a Slide have the same layout.
+
+    index_name = "stack_index.json"
+
+    # Size of the .npy header, which is rewritten with the final number of
+    # rows once a stack is complete. A multiple of 64 keeps the data aligned.
+    header_size = 128
+
+    def __init__(self, directory, settings):
+        super().__init__(directory, settings)
+
+        # _stacks maps the shape and the type of each stack to its name, its
+        # open temporary file and its rows.
+        self._stacks = {}
+
+        # _layouts maps each Slide to the layout all its crops are written 
+        # in. It is shared by the encoders.
+        self._layouts = {}
+        self._lock = threading.Lock()
+
+    def encode(self, slide, image, name):
+        # The layout of a Slide is chosen from the format of the first of its 
+        # crops, as decoded from the source, and every crop of the Slide is 
+        # converted to it, so that crops of the same size always share a 
+        # stack.
+        with self._lock:
+            layout = self._layouts.setdefault(slide, \
+                                              TiffWriter.get_layout(image))
+
+        # Uncompressed pages hold the rows of pixels without any padding.
+        return TiffWriter.encode_page(image, None, name, layout)
+
+    def add(self, slide, i, name, data):
+        if data.samples == 1:
+            shape = (data.height, data.width)
+        else:
+            shape = (data.height, data.width, data.samples)
+        if data.bits == 16:
+            dtype = ("<" if sys.byteorder == "little" else ">") + "u2"
+        else:
+            dtype = "|u1"
+
+        if (shape, dtype) not in self._stacks:
+            stack_name = "stack_%04d.npy" %(len(self._stacks) + 1)
+            file = self._open(stack_name)
+            file.write(b"\x00" * ArrayStackSink.header_size)
+            self._stacks[(shape, dtype)] = (stack_name, file, [])
+        stack_name, file, rows = self._stacks[(shape, dtype)]
+
+        # A row that fails is cut off, so the following rows stay aligned.
+        position = file.tell()
+        try:
+            for strip in data.strips:
+                file.write(strip)
+        except Exception:
+            file.seek(position)
+            file.truncate()
+            raise
+        rows.append({
+            "name": name,
+            "slide": slide.file_name,
+            "source": os.path.abspath(slide.path),
+            "selection": i,
+        })
+
+    def close(self):
+        lost = []
+        stacks = {}
+        for (shape, dtype), (stack_name, file, rows) in self._stacks.items():
+            try:
+                file.seek(0)
+                file.write(ArrayStackSink.get_header((len(rows),) + shape, \
+                                                     dtype))
+                file.seek(0, os.SEEK_END)
+                self._commit(file, stack_name)
+            except Exception:
+                file.close()
+                ExportPipeline._remove(file.name)
+                lost += [row["name"] for row in rows]
+                continue
+            stacks[stack_name] = {
+                "shape": [len(rows)] + list(shape),
+                "dtype": dtype,
+                "rows": rows,
+            }
+        self._stacks = {}
+
+        self._remove_old(ArrayStackSink.index_name, "stacks", stacks)
+        self._save_json(ArrayStackSink.index_name, {"stacks": stacks})
+        return lost
+
+    """
+    Get the header of a .npy file (format version 1.0).
+    @param shape: tuple of int, the shape of the array.
+    @param dtype: str, the NumPy type of the array.
+    @return bytes, the header, padded to header_size.
+    """
+    def get_header(shape, dtype):
+        header = repr({"descr": dtype, "fortran_order": False, \
+                       "shape": tuple(shape)}).encode("latin1")
+        size = ArrayStackSink.header_size - 10
+        if len(header) + 1 > size:
+            raise ValueError("The shape does not fit in the header.")
+        header = header.ljust(size - 1) + b"\n"
+        return b"\x93NUMPY\x01\x00" + len(header).to_bytes(2, "little") + \
+            header
@@ -0,0 +1,194 @@
+#!/usr/bin/python
+################################################################################
+#
+#   imageprobe.py
+#   Author: Roger Wang
+#   Date: 2024-07-03
+#
+#   Static class that reads the metadata of an image (width, height, bit depth,
+#   number of channels and file format) from the header of the file only.
+#   PNG, JPEG and TIFF (including BigTIFF) headers are parsed directly. Other
+#   formats fall back to QImageReader, which also only reads the header.
+#   Probing an image therefore costs milliseconds regardless of its size.
+#
+################################################################################
+
+import struct
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+class ImageInfo():
+    # ImageInfo contains the metadata of an image.
+
+    def __init__(self, width = 0, height = 0, depth = 0, channels = 0, \
+                 file_format = ""):
+        self.width = width
+        self.height = height
+
+        # depth is the number of bits per channel.
+        self.depth = depth
+        self.channels = channels
+
+        # file_format is the format of the file in lower case, such as "png".
+        self.file_format = file_format
+
+class ImageProbe():
+    """
+    Read the metadata of an image from its header.
+    @param path: str, the path to the image.
+    @return ImageInfo / None if the header cannot be read.
+    """
+    def probe(path):
+        try:
+            with open(path, "rb") as file:
+                file_format = ImageProbe.get_format(file.read(8))
+                file.seek(0)
+                if file_format == "png":
+                    info = ImageProbe._probe_png(file)
+                elif file_format == "jpeg":
+                    info = ImageProbe._probe_jpeg(file)
+                elif file_format == "tiff":
+                    info = ImageProbe._probe_tiff(file)
+                else:
+                    info = None
+        except (OSError, struct.error):
+            return None
+
+        if info and info.width > 0 and info.height > 0:
+            info.file_format = file_format
+            return info
+        return ImageProbe._probe_qt(path)
+
+    """
+    Recognize the format of an image from the first bytes of the file.
+    @param signature: bytes, the first 8 bytes of the file.
+    @return str, "png", "jpeg" or "tiff" / "" for other formats.
+    """
+    def get_format(signature):
+        if signature.startswith(b"\x89PNG\r\n\x1a\n"):
+            return "png"
+        if signature.startswith(b"\xff\xd8"):
+            return "jpeg"
+        if signature[:4] in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"):
+            return "tiff"
+        return ""
+
+    """
+    Read the metadata of a PNG file from its IHDR chunk.
+    @param file: file object opened in binary mode.
+    @return ImageInfo / None.
+    """
+    def _probe_png(file):
+        header = file.read(26)
+        if len(header) < 26 or header[12:16] != b"IHDR":
+            return None
+        width, height, depth, color_type = struct.unpack(">IIBB", \
+                                                         header[16:26])
+
+        # Gray, RGB, palette, gray with alpha, RGBA.
+        channels = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}.get(color_type, 0)
+        return ImageInfo(width, height, depth, channels)
+
+    """
+    Read the metadata of a JPEG file from its start of frame marker.
+    @param file: file object opened in binary mode.
+    @return ImageInfo / None.
+    """
+    def _probe_jpeg(file):
+        file.read(2)
+        while True:
+            marker = file.read(2)
+            if len(marker) < 2 or marker[0] != 0xff:
+                return None
+
+            # Skipping fill bytes.
+            while marker[1] == 0xff:
+                marker = marker[1:] + file.read(1)
+                if len(marker) < 2:
+                    return None
+            code = marker[1]
+
+            # Markers without a payload.
+            if code == 0x01 or 0xd0 <= code <= 0xd9:
+                continue
+
+            length = struct.unpack(">H", file.read(2))[0]
+
+            # SOF0 to SOF15, except DHT (C4), JPG (C8) and DAC (CC).
+            if 0xc0 <= code <= 0xcf and code not in (0xc4, 0xc8, 0xcc):
+                depth, height, width, channels = struct.unpack(">BHHB", \
+                                                               file.read(6))
+                return ImageInfo(width, height, depth, channels)
+            file.seek(length - 2, 1)
+
+    """
+    Read the metadata of a TIFF file from its first image file directory.
+    @param file: file object opened in binary mode.
+    @return ImageInfo / None.
+    """
+    def _probe_tiff(file):
+        header = file.read(16)
+        order = "<" if header[:2] == b"II" else ">"
+        bigtiff = struct.unpack(order + "H", header[2:4])[0] == 43
+
+        if bigtiff:
+            offset = struct.unpack(order + "Q", header[8:16])[0]
+            file.seek(offset)
+            count = struct.unpack(order + "Q", file.read(8))[0]
+            entry_size = 20
+        else:
+            offset = struct.unpack(order + "I", header[4:8])[0]
+            file.seek(offset)
+            count = struct.unpack(order + "H", file.read(2))[0]
+            entry_size = 12
+        entries = file.read(count * entry_size)
+
+        # Only the first value of each tag is needed here.
+        # SHORT, LONG and LONG8 values are stored in the entry itself.
+        formats = {3: "H", 4: "I", 16: "Q"}
+        values = {}
+        for i in range(count):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            tag, value_type = struct.unpack(order + "HH", entry[:4])
+            if tag not in (256, 257, 258, 277) or value_type not in formats:
+                continue
+            if bigtiff:
+                value_count = struct.unpack(order + "Q", entry[4:12])[0]
+                data = entry[12:20]
+            else:
+                value_count = struct.unpack(order + "I", entry[4:8])[0]
+                data = entry[8:12]
+
+            value_format = order + formats[value_type]
+            size = struct.calcsize(value_format)
+            if value_count * size > len(data):
+                # The values are stored elsewhere in the file.
+                position = file.tell()
+                file.seek(struct.unpack(order + ("Q" if bigtiff else "I"), \
+                                        data)[0])
+                data = file.read(size)
+                file.seek(position)
+            values[tag] = struct.unpack(value_format, data[:size])[0]
+
+        # ImageWidth, ImageLength, BitsPerSample, SamplesPerPixel.
+        return ImageInfo(values.get(256, 0), values.get(257, 0), \
+                         values.get(258, 1), values.get(277, 1))
+
+    """
+    Read the metadata of an image with QImageReader.
+    @param path: str, the path to the image.
+    @return ImageInfo / None.
+    """
+    def _probe_qt(path):
+        reader = QImageReader(path)
+        size = reader.size()
+        if not size.isValid():
+            return None
+
+        # QImage formats carry the bit depth of all channels together.
+        image_format = QImage.toPixelFormat(reader.imageFormat())
+        channels = image_format.channelCount()
+        depth = image_format.bitsPerPixel() // channels if channels else 0
+        return ImageInfo(size.width(), size.height(), depth, channels, \
+                         bytes(reader.format()).decode().lower())
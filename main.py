@@ -10,6 +10,7 @@
 ################################################################################
 
 import darkdetect
+import multiprocessing
 import os
 import platform
 import sys
@@ -19,10 +20,16 @@ from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
 from mainwindow import *
+from previewcache import *
+from project import *
 
 BASEDIR = os.path.dirname(__file__)
 
 if __name__ == "__main__":
+    # Processes of the ExportEngine must not start the application when the 
+    # program is frozen into an executable.
+    multiprocessing.freeze_support()
+
     QLocale.setDefault(QLocale(QLocale.Language.English))
     
     # Removing the image size limit.
@@ -39,6 +46,13 @@ if __name__ == "__main__":
         icon = QIcon(os.path.join(BASEDIR, "icon", "Slides Crop.ico"))
     app.setWindowIcon(icon)
 
+    # Previews and icons are cached on disk so that reopening a project does 
+    # not decode every slide again.
+    Slide.cache = PreviewCache(os.path.join(QStandardPaths.writableLocation(\
+        QStandardPaths.StandardLocation.CacheLocation), "previews"))
+    Slide.pyramid_directory = os.path.join(QStandardPaths.writableLocation(\
+        QStandardPaths.StandardLocation.CacheLocation), "pyramids")
+
     # Using darkdetect to check if the system is currently in dark mode.
     if darkdetect.isDark():
         stylesheet_file = os.path.join(BASEDIR, "qss", "style_dark.qss")
@@ -11,13 +11,22 @@
 #   Step1, where users add, remove, or change the order of slides, to Step2, 
 #   where users make selections and export the cropped images.
 #
+#   While a project is open, an AutosaveService records every edit made in 
+#   Step1 and Step2 and saves the project in the background.
+#
+#   The tile pyramids beyond their size limit are evicted when a project is 
+#   opened or closed, keeping those of the slides of the project.
+#
 ################################################################################
 
+import threading
+
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
 from access import *
+from autosave import *
 from dialog import *
 from project import *
 from starter import *
@@ -39,6 +48,7 @@ class MainWindow(QMainWindow):
         self.setCentralWidget(self._central_widget)
 
         self._project = None
+        self._autosave = None
 
         # Placeholder variables for the 3 QWidgets.
         self._starter = None
@@ -47,6 +57,7 @@ class MainWindow(QMainWindow):
 
         self._resolution = 0.5
         self._color = QColor(255, 0, 0)
+        self._tiled = False
 
         # Starter is shown when the program initiates.
         self.goto_starter()
@@ -57,12 +68,15 @@ class MainWindow(QMainWindow):
     def goto_starter(self):
         # Creating Starter if not already initialized.
         if not self._starter:
-            self._starter = Starter(self, self._resolution, self._color)
+            self._starter = Starter(self, self._resolution, self._color, \
+                                    self._tiled)
             self._starter.continue_clicked.connect(\
                 self.starter_continue_handler)
             self._central_widget.addWidget(self._starter)
         if self._project:
+            self.evict_pyramids()
             self._project = None
+        self.stop_autosave()
         self._central_widget.setCurrentWidget(self._starter)
 
         # No project can be open when Starter is showing.
@@ -82,9 +96,14 @@ class MainWindow(QMainWindow):
         if not project.saved:
             self.project_edited_handler()
 
+        self._autosave = AutosaveService(project)
+        self._autosave.saved.connect(self.autosave_saved_handler)
+        self.evict_pyramids()
+
         # Get settings.
         self._resolution = self._starter.get_resolution()
         self._color = self._starter.get_color()
+        self._tiled = self._starter.get_tiled()
         self.goto_step_1()
 
     """
@@ -93,13 +112,16 @@ class MainWindow(QMainWindow):
     def goto_step_1(self):
         # Creating Step1 if not already initialized.
         if not self._step_1:
-            self._step_1 = Step1(self, self._project, self._resolution)
+            self._step_1 = Step1(self, self._project, self._resolution, \
+                                 self._tiled)
             self._step_1.project_edited.connect(self.project_edited_handler)
+            self._step_1.edit_recorded.connect(self.edit_recorded_handler)
             self._step_1.continue_clicked.connect(self.goto_step_2)
             self._step_1.returned.connect(self.goto_starter)
             self._central_widget.addWidget(self._step_1)
         else:
             self._step_1.set_resolution(self._resolution)
+            self._step_1.set_tiled(self._tiled)
         self._step_1.update()
         self._central_widget.setCurrentWidget(self._step_1)
 
@@ -117,14 +139,16 @@ class MainWindow(QMainWindow):
         # Creating Starter if not already initialized.
         if not self._step_2:
             self._step_2 = Step2(self, self._project, self._color, \
-                                 self._resolution)
+                                 self._resolution, self._tiled)
             self._step_2.project_edited.connect(self.project_edited_handler)
+            self._step_2.edit_recorded.connect(self.edit_recorded_handler)
             self._step_2.back_clicked.connect(self.goto_step_1)
             self._step_2.returned.connect(self.goto_starter)
             self._central_widget.addWidget(self._step_2)
         else:
             self._step_2.set_color(self._color)
             self._step_2.set_resolution(self._resolution)
+            self._step_2.set_tiled(self._tiled)
             self._step_2.set_selection_size(self._project.width, \
                                             self._project.height)
             self._step_2.update()
@@ -138,18 +162,63 @@ class MainWindow(QMainWindow):
         self.setWindowModified(True)
         self._project.saved = False
 
+    """
+    Handler for when an edit of the Project has been recorded.
+    @param edit: dict, the edit, see autosave.py.
+    """
+    def edit_recorded_handler(self, edit):
+        if self._autosave:
+            self._autosave.record(edit)
+
+    """
+    Handler for when the AutosaveService has saved the Project.
+    """
+    def autosave_saved_handler(self):
+        self.setWindowModified(not self._project.saved)
+
+    """
+    Stop the AutosaveService of the closed project, if any.
+    """
+    def stop_autosave(self):
+        if self._autosave:
+            self._autosave.stop()
+            self._autosave = None
+
+    """
+    Evict the least recently used tile pyramids in the background, keeping 
+    those of the Slides of the project.
+    """
+    def evict_pyramids(self):
+        if Slide.pyramid_directory is None:
+            return
+        paths = [slide.path for slide in self._project.slides]
+        threading.Thread(target = SlidePyramid.evict, args = \
+                         (Slide.pyramid_directory, paths), daemon = True).start()
+
+    """
+    Stop the previews being loaded for Step2, if any.
+    """
+    def stop_preview_loader(self):
+        if self._step_2:
+            self._step_2.stop_preview_loader()
+
     """
     Upon a closeEvent, check if the project has been saved.
     """
     def closeEvent(self, event):
+        # Edits waiting to be recorded are written to the journal first.
+        if self._autosave:
+            self._autosave.stop()
         if not self._project or self._project.saved:
             # Close the program directly if no project is opened or if no 
             # modifications have been made.
+            self.stop_preview_loader()
             super().closeEvent(event)
         else:
             # If the project is not saved, prompt a dialog to save.
             close_dialog = CloseSaveDialog(self._project)
             if close_dialog.exec():
+                self.stop_preview_loader()
                 super().closeEvent(event)
             else:
                 # The user has selected cancel and the program shouldn't be 
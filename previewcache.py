@@ -0,0 +1,219 @@
+#!/usr/bin/python
+################################################################################
+#
+#   previewcache.py
+#   Author: Roger Wang
+#   Date: 2024-07-02
+#
+#   PreviewCache is a persistent, on-disk cache of the previews and icons
+#   generated for Slides, so that reopening a project does not need to decode
+#   every full-resolution image again.
+#
+#   Icons and previews are cached as separate entries, keyed by the path, size 
+#   and modification time of the image along with the kind of the entry (the 
+#   icon size or the preview resolution). Any change to the image
+#   file therefore results in a new key, and the stale entry is eventually
+#   evicted. The size of the cache is capped, and the least recently used
+#   entries are removed first.
+#
+################################################################################
+
+import hashlib
+import os
+import threading
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+class PreviewCache():
+    # Default size limit of the cache in bytes.
+    size_limit = 2 * 1024 ** 3
+
+    # Quality of the PNG files written to the cache and to the tile pyramids.
+    # A quality of 80 keeps the PNG compression fast.
+    png_quality = 80
+
+    def __init__(self, directory, size_limit = 0):
+        self.directory = directory
+        self.size_limit = size_limit if size_limit > 0 else \
+            PreviewCache.size_limit
+
+        # Previews are generated on multiple threads, so eviction is guarded.
+        self._lock = threading.Lock()
+
+    """
+    Get the key of a cache entry.
+    @param path: str, the path to the image.
+    @param kind: str, the kind of the entry (e.g. "icon-100x100" or 
+        "preview-0.5").
+    @return str, the key / None if the image cannot be accessed.
+    """
+    def get_key(self, path, kind):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        identity = "%s|%d|%d|%s" %(os.path.abspath(path), stat.st_size, \
+                                   stat.st_mtime_ns, kind)
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    """
+    Load a cache entry.
+    @param path: str, the path to the image.
+    @param kind: str, the kind of the entry.
+    @return (QImage, int, int), the cached image, and the width and height of 
+        the original image / None if there is no valid entry.
+    """
+    def load(self, path, kind):
+        key = self.get_key(path, kind)
+        if not key:
+            return None
+        image_path = self._get_path(key)
+        if not os.path.isfile(image_path):
+            return None
+
+        image = QImage(image_path)
+        if image.isNull():
+            return None
+
+        try:
+            width = int(image.text("SlideWidth"))
+            height = int(image.text("SlideHeight"))
+        except ValueError:
+            return None
+
+        # Touching the file marks the entry as recently used.
+        try:
+            os.utime(image_path)
+        except OSError:
+            pass
+
+        return image, width, height
+
+    """
+    Store a cache entry. Failing to write to the cache is never an error.
+    @param path: str, the path to the image.
+    @param kind: str, the kind of the entry.
+    @param image: QImage, the image to be cached.
+    @param width: int, the width of the original image.
+    @param height: int, the height of the original image.
+    """
+    def store(self, path, kind, image, width, height):
+        key = self.get_key(path, kind)
+        if not key:
+            return
+
+        # The size of the original image is kept inside the cached file.
+        image = image.copy()
+        image.setText("SlideWidth", str(width))
+        image.setText("SlideHeight", str(height))
+
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            self._write(image, self._get_path(key))
+        except OSError:
+            return
+
+        self._evict()
+
+    """
+    Get the total size of the cache.
+    @return int, the size of all cache files in bytes.
+    """
+    def get_size(self):
+        return sum(entry[2] for entry in self._get_entries())
+
+    """
+    Get the number of cached images.
+    @return int, the number of entries.
+    """
+    def get_count(self):
+        return len([entry for entry in self._get_entries() \
+                    if entry[0].endswith(".png")])
+
+    """
+    Remove every entry in the cache.
+    """
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._get_entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    """
+    Get the path of the file of an entry.
+    @param key: str, the key of the entry.
+    @return str, the path to the cached image.
+    """
+    def _get_path(self, key):
+        return os.path.join(self.directory, key + ".png")
+
+    """
+    Write a QImage to a path. The image is first written to a temporary file 
+    and then renamed, so that other threads never read a partial file.
+    @param image: QImage, the image to be written.
+    @param path: str, the destination.
+    """
+    def _write(self, image, path):
+        temp_path = "%s.%d.tmp" %(path, threading.get_ident())
+
+        if not image.save(temp_path, "PNG", PreviewCache.png_quality):
+            raise OSError("Failed to write " + temp_path)
+        os.replace(temp_path, path)
+
+    """
+    Get all files in the cache.
+    @return list of (str, float, int), the path, time of last use and size of 
+        every file.
+    """
+    def _get_entries(self):
+        entries = []
+        try:
+            with os.scandir(self.directory) as iterator:
+                for entry in iterator:
+                    if not entry.is_file():
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((entry.path, stat.st_mtime, stat.st_size))
+        except OSError:
+            pass
+
+        return entries
+
+    """
+    Remove the least recently used files until the cache fits in its limit.
+    """
+    def _evict(self):
+        with self._lock:
+            PreviewCache.remove_least_used(self._get_entries(), \
+                                           self.size_limit, os.remove)
+
+    """
+    Remove the least recently used entries until the rest fits in a limit.
+    This is also used for the tile pyramids (see slidepyramid.py).
+    @param entries: list of (str, float, int), the path, time of last use and
+        size of every entry.
+    @param size_limit: int, the size limit in bytes.
+    @param remove: function taking the path of an entry, raising OSError if 
+        the entry cannot be removed.
+    """
+    def remove_least_used(entries, size_limit, remove):
+        total = sum(entry[2] for entry in entries)
+        if total <= size_limit:
+            return
+
+        entries = sorted(entries, key = lambda entry: entry[1])
+        for path, _, size in entries:
+            if total <= size_limit:
+                break
+            try:
+                remove(path)
+                total -= size
+            except OSError:
+                pass
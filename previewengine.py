@@ -0,0 +1,102 @@
+#!/usr/bin/python
+################################################################################
+#
+#   previewengine.py
+#   Author: Roger Wang
+#   Date: 2024-07-02
+#
+#   PreviewEngine generates the previews of a list of Slides on a pool of
+#   threads so that large batches of images make use of every core.
+#   The decoding and scaling in Qt release the GIL, so threads are enough here
+#   and QImages never have to be copied between processes.
+#
+#   When previews is not set, only the icons are generated and the previews 
+#   are left to be loaded on demand.
+#   When tiled is set, the tile pyramid of each Slide is built (or reused) 
+#   right after its preview.
+#
+#   Progress is always reported in the order of the given Slides, so a
+#   ProgressDialog shows the same behavior as the original sequential loop.
+#   Each finished Slide can also be handed over as soon as it is done (and 
+#   every Slide before it), so that callers can show the Slides incrementally.
+#
+################################################################################
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+class PreviewEngine():
+    # Default number of threads. Change this variable to limit the number of
+    # cores used when generating previews.
+    workers = os.cpu_count() or 1
+
+    def __init__(self, resolution, workers = 0, tiled = False, \
+                 previews = True):
+        self._resolution = resolution
+        self._workers = workers if workers > 0 else PreviewEngine.workers
+        self._tiled = tiled
+        self._previews = previews
+
+        # 0: Continue processing.
+        # 1: Stop.
+        self.status = 0
+
+    """
+    Generate the previews of the given Slides.
+    Slides that are not processed because of a stop are left untouched and are
+    not included in the returned list.
+    @param slides: list of Slide objects.
+    @param progress: function taking an int, called with the number of Slides
+        handled so far, in order.
+    @param done: function taking a Slide object, called with each finished
+        Slide, in order.
+    @return finished: list of Slide objects, the Slides with generated previews
+        in their original order.
+    """
+    def run(self, slides, progress = None, done = None):
+        finished = []
+        with ThreadPoolExecutor(max_workers = self._workers) as executor:
+            futures = [executor.submit(self._generate, slide) \
+                       for slide in slides]
+
+            # Waiting for the futures in submission order keeps the progress
+            # and the order of the finished Slides the same as before.
+            for i in range(len(futures)):
+                if self.status:
+                    futures[i].cancel()
+                elif futures[i].result():
+                    finished.append(slides[i])
+                    if done:
+                        done(slides[i])
+                if progress:
+                    progress(i + 1)
+
+        return finished
+
+    """
+    Stops the engine. Slides already being processed are allowed to finish.
+    """
+    def stop(self):
+        self.status = 1
+
+    """
+    Generate the preview of a single Slide unless the engine has been stopped.
+    @param slide: Slide object.
+    @return True (preview generated) / False (skipped).
+    """
+    def _generate(self, slide):
+        if self.status:
+            return False
+
+        # The metadata of new Slides is saved with the project, so that the 
+        # image need not be probed when the project is opened again.
+        if slide.metadata is None:
+            slide.probe()
+        if self._previews:
+            slide.generate_preview(self._resolution)
+        else:
+            slide.generate_icon()
+        if self._tiled:
+            slide.generate_pyramid()
+        return True
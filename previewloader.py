@@ -0,0 +1,145 @@
+#!/usr/bin/python
+################################################################################
+#
+#   previewloader.py
+#   Author: Roger Wang
+#   Date: 2024-07-08
+#
+#   PreviewLoader generates the previews of Slides on demand during Step2.
+#   Requests are handled on a small pool of threads, and preview_ready is
+#   emitted on the GUI thread once the preview of a Slide is available, so
+#   that the SlideViewer can show a placeholder in the meantime.
+#
+#   Along with the displayed Slide, the previews of its neighbours are 
+#   prefetched so that going to the next or previous Slide is instant. When 
+#   the user jumps elsewhere, prefetches that have not started yet and are no 
+#   longer needed are cancelled, so the new Slide is not queued behind them.
+#
+#   stop shuts the pool down when Step2 is left or the window is closed. The
+#   pool is started again by the next request.
+#
+################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import *
+
+class PreviewLoader(QObject):
+    preview_ready = pyqtSignal(object)
+
+    # _loaded is emitted from the pool and delivered on the GUI thread.
+    _loaded = pyqtSignal(object)
+
+    # Default number of threads used to load previews.
+    workers = 2
+
+    # Default number of Slides prefetched on each side of the displayed Slide.
+    prefetch_count = 2
+
+    def __init__(self, resolution, workers = 0, prefetch_count = -1):
+        super().__init__()
+        self._resolution = resolution
+        self.prefetch_count = prefetch_count if prefetch_count >= 0 else \
+            PreviewLoader.prefetch_count
+        self._workers = workers if workers > 0 else PreviewLoader.workers
+        self._executor = None
+
+        # _pending maps the Slides being loaded to their futures.
+        self._pending = {}
+
+        self._loaded.connect(self._loaded_handler)
+
+    """
+    Set the resolution of the previews.
+    Previews generated at another resolution are loaded again when requested.
+    @param resolution: float, the resolution of the previews.
+    """
+    def set_resolution(self, resolution):
+        self._resolution = resolution
+
+    """
+    Check if the preview of a Slide is available at the current resolution.
+    @param slide: Slide object.
+    @return True (available) / False (needs to be loaded).
+    """
+    def is_ready(self, slide):
+        return slide.preview is not None and \
+            slide.preview_resolution == self._resolution
+
+    """
+    Get the indices of the Slides to prefetch around a displayed Slide, 
+    nearest first.
+    @param index: int, the index of the displayed Slide.
+    @param count: int, the number of Slides.
+    @return list of int, the indices to prefetch.
+    """
+    def get_prefetch_indices(self, index, count):
+        indices = []
+        for distance in range(1, self.prefetch_count + 1):
+            for i in (index + distance, index - distance):
+                if 0 <= i < count:
+                    indices.append(i)
+        return indices
+
+    """
+    Request the preview of a Slide. If the preview is not available, it is
+    loaded in the background and preview_ready is emitted when done.
+    Pending loads of any other Slides that have not started are cancelled, 
+    then the given neighbours are prefetched.
+    @param slide: Slide object, or None to only prefetch.
+    @param neighbours: list of Slide objects, the Slides to prefetch, in 
+        order of priority.
+    @return True (preview already available) / False (loading).
+    """
+    def request(self, slide, neighbours = []):
+        slides = list(neighbours)
+        if slide is not None:
+            slides.insert(0, slide)
+
+        # Cancelling stale prefetches first puts the requested Slide at the 
+        # front of the queue.
+        wanted = set(slides)
+        for pending_slide, future in list(self._pending.items()):
+            if pending_slide not in wanted and future.cancel():
+                del self._pending[pending_slide]
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers = self._workers)
+        for temp_slide in slides:
+            if not self.is_ready(temp_slide) and \
+                temp_slide not in self._pending:
+                self._pending[temp_slide] = self._executor.submit(\
+                    self._load, temp_slide, self._resolution)
+
+        return slide is not None and self.is_ready(slide)
+
+    """
+    Stop the pool. Pending loads are cancelled, and the loads already 
+    running are waited for.
+    """
+    def stop(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(cancel_futures = True)
+        self._executor = None
+        self._pending = {}
+
+    """
+    Generate the preview of a Slide. This function runs in the pool.
+    @param slide: Slide object.
+    @param resolution: float, the resolution of the preview.
+    """
+    def _load(self, slide, resolution):
+        try:
+            slide.generate_preview(resolution)
+        finally:
+            self._loaded.emit(slide)
+
+    """
+    Handler for when a preview has been loaded by the pool.
+    @param slide: Slide object.
+    """
+    def _loaded_handler(self, slide):
+        self._pending.pop(slide, None)
+        if self.is_ready(slide):
+            self.preview_ready.emit(slide)
@@ -0,0 +1,93 @@
+#!/usr/bin/python
+################################################################################
+#
+#   previewmemory.py
+#   Author: Roger Wang
+#   Date: 2024-07-09
+#
+#   PreviewMemory keeps the previews held in memory within a byte budget.
+#   Slides are tracked in the order they were last viewed, and when the
+#   budget is exceeded the previews of the least recently viewed Slides are
+#   released. A released preview is simply loaded again by the PreviewLoader
+#   the next time its Slide is requested (from the PreviewCache if enabled).
+#
+################################################################################
+
+from collections import OrderedDict
+
+class PreviewMemory():
+    # Default budget for all previews in bytes.
+    budget = 2 * 1024 ** 3
+
+    def __init__(self, budget = 0):
+        self.budget = budget if budget > 0 else PreviewMemory.budget
+
+        # _slides maps the Slides holding a preview to the size of the
+        # preview, ordered from the least to the most recently viewed.
+        self._slides = OrderedDict()
+
+    """
+    Mark the preview of a Slide as used, or start tracking it.
+    @param slide: Slide object.
+    @param viewed: True (the preview is displayed) / False (the preview is 
+        only prefetched and is released before any viewed preview).
+    """
+    def touch(self, slide, viewed = True):
+        if slide.preview is None:
+            self._slides.pop(slide, None)
+            return
+        self._slides[slide] = PreviewMemory.get_pixmap_bytes(slide.preview)
+        self._slides.move_to_end(slide, last = viewed)
+
+    """
+    Release the previews of the least recently viewed Slides until the
+    budget is met.
+    @param keep: list of Slide objects, the Slides that must keep their
+        previews (e.g. the displayed Slide and its neighbours).
+    @return int, the number of previews released.
+    """
+    def evict(self, keep = []):
+        keep = set(keep)
+        released = 0
+        total = self.get_preview_bytes()
+        for slide in list(self._slides):
+            if total <= self.budget:
+                break
+            if slide in keep:
+                continue
+            total -= self._slides.pop(slide)
+            slide.preview = None
+            slide.preview_resolution = 0
+            released += 1
+
+        return released
+
+    """
+    Stop tracking all Slides. The previews themselves are left untouched.
+    """
+    def clear(self):
+        self._slides = OrderedDict()
+
+    """
+    Get the number of bytes held by the tracked previews.
+    @return int, the size in bytes.
+    """
+    def get_preview_bytes(self):
+        return sum(self._slides.values())
+
+    """
+    Get the number of bytes held by the icons of a list of Slides.
+    @param slides: list of Slide objects.
+    @return int, the size in bytes.
+    """
+    def get_icon_bytes(slides):
+        return sum(PreviewMemory.get_pixmap_bytes(slide.icon) \
+                   for slide in slides if slide.icon is not None)
+
+    """
+    Get the number of bytes held by a QPixmap.
+    @param pixmap: QPixmap.
+    @return int, the size in bytes.
+    """
+    def get_pixmap_bytes(pixmap):
+        return pixmap.width() * pixmap.height() * pixmap.depth() // 8
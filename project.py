@@ -7,19 +7,65 @@
 #
 #   Project and all associated classes to contain information of a project.
 #   A Project contains a list of Slides, while a Slide contains a list of 
-#   SlideSelections.
+#   SlideSelections, held in a SelectionStore (see selectionstore.py).
+#
+#   A Project is stored either as a JSON file or as an SQLite database (see 
+#   projectdb.py), both with the SCP extension. save and load keep using the 
+#   format of the project file, and save_json and load_json can be used to 
+#   export and import JSON files whatever the format.
+#
+#   Edits are also recorded in a ProjectJournal next to the project file 
+#   (see projectjournal.py and autosave.py), which is replayed when the 
+#   project is loaded after a crash. The journal is compacted into a 
+#   snapshot, which is loaded in place of the project file until the project
+#   is saved.
+#
+#   The metadata of the image of each Slide (see slidemetadata.py) is saved 
+#   with the Slide, so that the images need not be read when a project is 
+#   loaded. ProjectVerifier only probes the images whose file changed.
+#
+#   The crops of a Project can also be used directly from Python, without 
+#   writing any file or creating a QApplication: iter_crops yields SlideCrops
+#   holding NumPy arrays of the regions read from TIFF files, or views over 
+#   the decoded image of other Slides.
 #
 ################################################################################
 
 import json
-import math
 import os
+import threading
 
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
+from exportpipeline import *
+from exportsettings import *
+from imageprobe import *
+from projectdb import *
+from projectjournal import *
+from projectstream import *
+from scaleddecoder import *
+from selectionstore import *
+from slidemetadata import *
+from slidepyramid import *
+from tiffio import *
+
+try:
+    import numpy
+except ImportError:
+    # NumPy is only needed by iter_crops.
+    numpy = None
+
 class Project():
+    # Filters of the file dialogs for JSON and SQLite project files.
+    FILE_FILTER = "SCP File (*.scp)"
+    DATABASE_FILTER = "SCP Database (*.scp)"
+
+    # Writes of JSON project files are serialized, so that an autosave
+    # finishing late never replaces a newer save.
+    _write_lock = threading.Lock()
+
     def __init__(self):
         self.name = ""
         self.path = ""
@@ -38,12 +84,168 @@ class Project():
         self.width = 0
         self.height = 0
 
+        # export_settings describes the format of the exported crops.
+        self.export_settings = ExportSettings()
+
+        # database should be the ProjectDB of the project file when it is 
+        # stored in SQLite, or None for JSON.
+        self.database = None
+
+        # journal_sequence is the number of the last edit recorded in the 
+        # journal. _written maps the path of each JSON file written to the 
+        # number of the last edit it holds.
+        self.journal_sequence = 0
+        self._written = {}
+
+        # saved_sequence is the number of the last edit held by the project 
+        # file when it was last saved.
+        self.saved_sequence = 0
+
+        # Edits are not recorded once they have been discarded, until the 
+        # project is saved or loaded again.
+        self._discarded = False
+
+    """
+    Save the project.
+    @param path: str, the path to the project file.
+    @param database: True (SQLite) / False (JSON) / None to keep the current
+        format.
+    """
+    def save(self, path, database = None):
+        if database is None:
+            database = self.database is not None
+        if database:
+            self.save_database(path)
+        else:
+            self.save_json(path)
+
+    """
+    Load the project, in the format of the project file.
+    @param path: str, the path to the project file.
+    """
+    def load(self, path):
+        if ProjectDB.is_database(path):
+            self.load_database(path)
+        else:
+            self.load_json(path)
+
+    """
+    Save the project into an SQLite database. Saving again to the same file
+    only writes what changed.
+    @param path: str, the path to the project file.
+    """
+    def save_database(self, path):
+        if self.database and os.path.abspath(self.database.path) == \
+            os.path.abspath(path):
+            self.database.save(self)
+        else:
+            self.close_database()
+            self.database = ProjectDB.create(self, path)
+
+        # The project file now holds the edits of the snapshot.
+        ProjectJournal.remove_snapshot(path)
+        ProjectJournal.trim(path, self.journal_sequence)
+        self._discarded = False
+        self.saved = True
+        self.saved_sequence = self.journal_sequence
+        self._set_path(path)
+
+    """
+    Load and initialize the Project from an SQLite database.
+    As with load_json, the previews are not generated in this function.
+    @param path: str, the path to the project file.
+    """
+    def load_database(self, path):
+        self.close_database()
+        self._discarded = False
+        database = ProjectDB(path)
+        try:
+            values, slides = database.read()
+        except Exception:
+            database.close()
+            raise
+
+        self.path = path
+        self.saved = True
+        self._set_values(values)
+
+        self.slides = []
+        for row, slide_path, metadata, selections in slides:
+            temp_slide = Slide(slide_path = slide_path)
+            metadata = SlideMetadata.from_dict(metadata)
+            if metadata:
+                temp_slide.set_metadata(metadata)
+            for center_x, center_y, width, height in selections:
+                temp_slide.selections.add(center_x, center_y, width, height)
+            self.slides.append(temp_slide)
+
+        database.remember(self, [row for row, slide_path, metadata, \
+                                 selections in slides])
+        self.database = database
+
+        # The Slides of a snapshot are new to the database, which replaces 
+        # its rows when the project is saved.
+        if ProjectJournal.has_snapshot(path):
+            stream = ProjectStream(ProjectJournal.get_snapshot_path(path))
+            self.slides = [Project._read_slide(slide) for slide in stream]
+            self._set_values(stream.values)
+            self.saved = False
+        self.replay_journal()
+
+    """
+    Close the database of the project file, if any.
+    """
+    def close_database(self):
+        if self.database:
+            self.database.close()
+            self.database = None
+
     """
     Save the project into a JSON format file.
     Note that in practice, the project file always have SCP extensions.
     @param path: str, the path to the project file.
     """
     def save_json(self, path):
+        # The database, if any, is no longer the project file.
+        self.close_database()
+        project = self.to_json()
+        self.write_json(path, project)
+        self.finish_save_json(path, project["journal"])
+
+    """
+    Finish saving the project into a JSON format file once it has been 
+    written with write_json.
+    @param path: str, the path to the project file.
+    @param sequence: int, the number of the last edit held by the file.
+    """
+    def finish_save_json(self, path, sequence):
+        ProjectJournal.remove_snapshot(path)
+        ProjectJournal.trim(path, sequence)
+        self._discarded = False
+
+        # Edits made while the file was written stay in the journal.
+        self.saved = self.journal_sequence == sequence
+        self.saved_sequence = sequence
+        self._set_path(path)
+
+    """
+    Set the path of the project file once the project has been saved to it.
+    @param path: str, the path to the project file.
+    """
+    def _set_path(self, path):
+        # The journal and snapshot of the previous project file hold edits 
+        # that are now in the new file, and that would otherwise be replayed 
+        # into the previous file when it is opened again.
+        if self.path and os.path.abspath(self.path) != os.path.abspath(path):
+            ProjectJournal.remove(self.path)
+            ProjectJournal.remove_snapshot(self.path)
+        self.path = path
+
+    """
+    Get the content of the JSON project file.
+    @return dict, the project.
+    """
+    def to_json(self):
         slides = []
 
         # Iterate slides.
@@ -51,15 +253,17 @@ class Project():
             temp_slide = {
                 "path": slide.path,
             }
+            if slide.metadata:
+                temp_slide["metadata"] = slide.metadata.to_dict()
             selections = []
 
             # Iterate selections.
-            for selection in slide.selections:
+            for center_x, center_y, width, height in slide.selections.rows():
                 temp_selection = {
-                    "center_x": selection.center_coordinates[0],
-                    "center_y": selection.center_coordinates[1],
-                    "width": selection.width,
-                    "height": selection.height,
+                    "center_x": center_x,
+                    "center_y": center_y,
+                    "width": width,
+                    "height": height,
                 }
                 selections.append(temp_selection)
             temp_slide.update({"selections": selections})
@@ -72,15 +276,34 @@ class Project():
             "selection": self.selection,
             "width": self.width,
             "height": self.height,
+            "export": self.export_settings.to_dict(),
+            "journal": self.journal_sequence,
             "slides": slides
         }
+        return project
 
-        # Saving.
-        with open(path, "w") as file: 
+    """
+    Write a JSON project file. The file is written to a temporary file that
+    replaces the project file once complete. This function can be called 
+    from other threads.
+    @param path: str, the path to the project file.
+    @param project: dict, the project from to_json.
+    @return True (written) / False (a newer save was already written).
+    """
+    def write_json(self, path, project):
+        temp_path = "%s.%d.tmp" %(path, threading.get_ident())
+        with open(temp_path, "w") as file: 
             json.dump(project, file, indent = 4)
+            file.flush()
+            os.fsync(file.fileno())
 
-        self.saved = True
-        self.path = path
+        with Project._write_lock:
+            if self._written.get(path, -1) > project["journal"]:
+                os.remove(temp_path)
+                return False
+            os.replace(temp_path, path)
+            self._written[path] = project["journal"]
+        return True
         
     """
     Load and initialize the Project from a JSON format file.
@@ -91,34 +314,201 @@ class Project():
     @param path: str, the path to the project file.
     """
     def load_json(self, path):
+        for slide in self.iter_load_json(path):
+            pass
+
+    """
+    Load the project, in the format of the project file, yielding the Slides 
+    as they are loaded. See iter_load_json.
+    @param path: str, the path to the project file.
+    @return generator of Slide objects.
+    """
+    def iter_load(self, path):
+        if ProjectDB.is_database(path):
+            self.load_database(path)
+            yield from list(self.slides)
+        else:
+            yield from self.iter_load_json(path)
+
+    """
+    Load and initialize the Project from a JSON format file, yielding each 
+    Slide as soon as it is read, so that large project files can be checked 
+    while they are being read (see projectstream.py).
+    The Slides are appended to the Project as they are yielded. The other 
+    values of the Project, and the edits of the journal, are only set once 
+    the whole file has been read.
+    The snapshot of the project file is read instead, if any.
+    @param path: str, the path to the project file.
+    @return generator of Slide objects.
+    """
+    def iter_load_json(self, path):
+        self.close_database()
+        self._discarded = False
         self.path = path
         self.saved = True
         self.slides = []
 
-        # Loading project file.
-        with open(path, "r") as file:
-            project = json.load(file)
-        
-        self.name = project["name"]
-        self.work_index = project["work_index"]
-        self.selection = project["selection"]
-        self.width = project["width"]
-        self.height = project["height"]
+        # Loading project file, or its snapshot.
+        if ProjectJournal.has_snapshot(path):
+            stream = ProjectStream(ProjectJournal.get_snapshot_path(path))
+            self.saved = False
+        else:
+            stream = ProjectStream(path)
 
         # Iterate slides.
-        for slide in project["slides"]:
-            temp_slide = Slide(slide_path = slide["path"])
+        for slide in stream:
+            temp_slide = Project._read_slide(slide)
+            self.slides.append(temp_slide)
+            yield temp_slide
+        self._set_values(stream.values)
 
-            # Iterate selections.
-            for selection in slide["selections"]:
-                temp_selection = SlideSelection()
-                temp_selection.center_coordinates = (selection["center_x"], 
-                                                     selection["center_y"])
-                temp_selection.width = selection["width"]
-                temp_selection.height = selection["height"]
-                temp_slide.selections.append(temp_selection)
+        # The journal may still add, reorder or remove Slides once all the 
+        # Slides of the file have been yielded.
+        self.replay_journal()
 
-            self.slides.append(temp_slide)
+    """
+    Create a Slide from its dictionary in a JSON project file.
+    @param slide: dict, the Slide as written by to_json.
+    @return Slide object.
+    """
+    def _read_slide(slide):
+        temp_slide = Slide(slide_path = slide["path"])
+
+        # Projects saved before metadata existed have their images probed 
+        # by ProjectVerifier.
+        metadata = SlideMetadata.from_dict(slide.get("metadata"))
+        if metadata:
+            temp_slide.set_metadata(metadata)
+
+        # Iterate selections.
+        for selection in slide["selections"]:
+            temp_slide.selections.add(selection["center_x"], \
+                                      selection["center_y"], \
+                                      selection["width"], \
+                                      selection["height"])
+        return temp_slide
+
+    """
+    Set the values of the Project other than its Slides.
+    @param values: dict, the values as written by to_json.
+    """
+    def _set_values(self, values):
+        self.name = values["name"]
+        self.work_index = values["work_index"]
+        self.selection = values["selection"]
+        self.width = values["width"]
+        self.height = values["height"]
+
+        # Projects saved before export settings existed use the defaults.
+        self.export_settings = ExportSettings.from_dict(\
+            values.get("export", {}))
+        self.journal_sequence = values.get("journal", 0)
+
+    """
+    Record an edit in the journal of the project file. Nothing is recorded
+    for projects that have never been saved.
+    @param record: dict, the record without its "seq" number.
+    @return True (recorded) / False (not recorded).
+    """
+    def record_edit(self, record):
+        if not self.path or self._discarded:
+            return False
+        self.journal_sequence += 1
+        ProjectJournal.append(self.path, dict(record, \
+                                              seq = self.journal_sequence))
+        return True
+
+    """
+    Discard the edits recorded in the journal and its snapshot, when the 
+    project is closed without saving. Later edits are not recorded.
+    """
+    def discard_edits(self):
+        self._discarded = True
+        if self.path:
+            ProjectJournal.remove(self.path)
+            ProjectJournal.remove_snapshot(self.path)
+
+    """
+    Check whether the edits since the last save have been discarded.
+    @return True (discarded) / False.
+    """
+    def is_discarded(self):
+        return self._discarded
+
+    """
+    Apply the edits of the journal that are not in the project file yet.
+    Replaying stops at the first record that does not match the Project.
+    """
+    def replay_journal(self):
+        for record in ProjectJournal.read(self.path):
+            if record["seq"] <= self.journal_sequence:
+                continue
+            try:
+                self.apply_record(record)
+            except (KeyError, IndexError, TypeError, ValueError):
+                break
+            self.journal_sequence = record["seq"]
+
+            # The metadata of the images is not an edit of the user.
+            if record["op"] != "metadata":
+                self.saved = False
+
+    """
+    Apply a record of the journal. See projectjournal.py for the records.
+    @param record: dict, the record.
+    """
+    def apply_record(self, record):
+        op = record["op"]
+        if op == "add_slide":
+            self.slides.append(Slide(slide_path = record["path"]))
+        elif op == "slides":
+            # Slides are matched by path, so that their selections are kept.
+            slides = {}
+            for slide in self.slides:
+                slides.setdefault(slide.path, []).append(slide)
+            self.slides = [slides[path].pop(0) if slides.get(path) else \
+                           Slide(slide_path = path) \
+                           for path in record["paths"]]
+        elif op == "resize":
+            for slide in self.slides:
+                slide.set_selection_size(record["width"], record["height"])
+        elif op == "project":
+            self.name = record["name"]
+            self.selection = record["selection"]
+            self.width = record["width"]
+            self.height = record["height"]
+            self.export_settings = ExportSettings.from_dict(record["export"])
+        else:
+            slide = self.slides[record["slide"]]
+            if slide.path != record["path"]:
+                raise ValueError("The record does not match the slide.")
+            if op == "remove_slide":
+                self.slides.pop(record["slide"])
+            elif op == "metadata":
+                metadata = SlideMetadata.from_dict(record["metadata"])
+                if not metadata:
+                    raise ValueError("The record holds no metadata.")
+                slide.set_metadata(metadata)
+            elif op == "select":
+                center_x, center_y = record["center"]
+                slide.selections.add(center_x, center_y, record["width"], \
+                                     record["height"])
+            elif op == "move":
+                slide.selections[record["index"]].center_coordinates = \
+                    tuple(record["center"])
+            elif op == "remove":
+                slide.selections.pop(record["index"])
+            else:
+                raise ValueError("Unknown record: %s" %op)
+
+    """
+    Iterate over the crops of all the slides in the Project, one slide at a 
+    time. See Slide.iter_crops.
+    @return generator of SlideCrop objects.
+    """
+    def iter_crops(self):
+        for slide in self.slides:
+            yield from slide.iter_crops()
 
     """
     Generate previews for all the slides in the Project.
@@ -131,22 +521,83 @@ class Project():
 class Slide():
     # Each Slide corresponds to an image of a slide.
 
+    # cache should be a PreviewCache shared by all Slides, or None to always 
+    # generate previews from the original images.
+    cache = None
+
+    # pyramid_directory should be the directory holding the tile pyramids of 
+    # all Slides, or None to disable tile pyramids.
+    pyramid_directory = None
+
     def __init__(self, slide_path):
         self.file_name = os.path.basename(slide_path)
 
         self.path = slide_path
         self.folder_path = os.path.dirname(slide_path)
 
-        # selections should be a list of SlideSelection objects.
-        self.selections = []
+        # selections should be a SelectionStore, used as a list of 
+        # SlideSelection objects.
+        self.selections = SelectionStore()
 
         self.width = 0
         self.height = 0
 
+        # metadata should be the SlideMetadata of the image, once it has been 
+        # probed or loaded from the project file.
+        self.metadata = None
+
         # Path of the temporary preview file.
+        # preview_resolution is the resolution the preview was generated at.
         self.preview = None
+        self.preview_resolution = 0
         self.icon = None
 
+        # pyramid should be a SlidePyramid once generate_pyramid is called.
+        self.pyramid = None
+
+    """
+    Read the width and height of the Slide, along with its metadata, from the 
+    header of the image, without decoding the image.
+    @return True (success) / False (the header could not be read).
+    """
+    def probe(self):
+        metadata = SlideMetadata.read(self.path)
+        if not metadata:
+            return False
+        self.set_metadata(metadata)
+        return True
+
+    """
+    Set the metadata of the Slide, along with its width and height.
+    @param metadata: SlideMetadata object.
+    """
+    def set_metadata(self, metadata):
+        self.metadata = metadata
+        self.width = metadata.width
+        self.height = metadata.height
+
+    """
+    Check the file of the Slide against its metadata. The image is only 
+    probed again if the size or modification time of the file changed, or 
+    if the Slide has no metadata yet.
+    Raises OSError if the file cannot be found.
+    @return True (the file holds another image than the metadata described) / 
+        False (the image is unchanged, or was never probed).
+    """
+    def update_metadata(self):
+        stat = os.stat(self.path)
+        if self.metadata and self.metadata.matches(stat):
+            self.width = self.metadata.width
+            self.height = self.metadata.height
+            return False
+
+        metadata = SlideMetadata.read(self.path, stat)
+        if not metadata:
+            return False
+        previous = self.metadata
+        self.set_metadata(metadata)
+        return previous is not None and not previous.same_image(metadata)
+
     """
     Check if any selection will be over the boundary of the slide for an 
     arbitrary new selection size.
@@ -155,26 +606,7 @@ class Slide():
     @return True (all selections are safe) / False (overflow exists).
     """
     def check_selection_size(self, width, height):
-        # Calculate the new length in each direction from the center.
-        left = width // 2
-        right = math.ceil(width / 2)
-        top = height // 2
-        bottom = math.ceil(height / 2)
-
-        # Iterate through each selection point to check.
-        for selection in self.selections:
-            x = selection.center_coordinates[0]
-            y = selection.center_coordinates[1]
-            if x - left < 0:
-                return False
-            if x + right > self.width:
-                return False
-            if y - top < 0:
-                return False
-            if y + bottom > self.height:
-                return False
-
-        return True
+        return self.selections.fits(self.width, self.height, width, height)
     
     """
     Update the width and height of all selections.
@@ -182,100 +614,257 @@ class Slide():
     @param height: int, the new height.
     """
     def set_selection_size(self, width, height):
-        for i in range(len(self.selections)):
-            self.selections[i].width = width
-            self.selections[i].height = height
+        self.selections.resize(width, height)
 
-            # Check if the center coordinates need to be changed.
-            x = self.selections[i].center_coordinates[0]
-            y = self.selections[i].center_coordinates[1]
-            x = max(x, math.ceil(width / 2))
-            y = max(y, math.ceil(height / 2))
-            x = min(x, self.width - math.ceil(width / 2))
-            y = min(y, self.height - math.ceil(height / 2))
+    """
+    Generate the icon of the Slide, along with its width and height.
+    The image is decoded directly at the size of the icon where possible.
+    @param icon_width: int, the width of the QPixmap used during Step1.
+    @param icon_height: int, the height of the QPixmap used during Step1.
+    """
+    def generate_icon(self, icon_width = 100, icon_height = 100):
+        kind = "icon-%dx%d" %(icon_width, icon_height)
+        if Slide.cache is not None:
+            cached = Slide.cache.load(self.path, kind)
+            if cached:
+                icon, self.width, self.height = cached
+                self.icon = QPixmap.fromImage(icon)
+                return
+
+        image, self.width, self.height = ScaledDecoder.decode_to_fit(\
+            self.path, icon_width, icon_height)
+        icon = image.scaled(icon_width, icon_height, \
+            Qt.AspectRatioMode.KeepAspectRatio, \
+            Qt.TransformationMode.SmoothTransformation)
+
+        if Slide.cache is not None and not icon.isNull():
+            Slide.cache.store(self.path, kind, icon, self.width, self.height)
+        self.icon = QPixmap.fromImage(icon)
 
     """
-    Generate a preview temp file and store its path with the given resolution.
+    Generate the preview of the Slide with the given resolution.
+    The icon is also generated from the preview if it does not exist yet.
     @param preview_res: float, the resolution of the preview files generated.
     @param icon_width: int, the width of the QPixmap used during Step1.
     @param icon_height: int, the height of the QPixmap used during Step1.
     """
     def generate_preview(self, preview_res, icon_width = 100, \
                          icon_height = 100):
-        # For some reason, using QPixmap here clogs the main thread.
-        original = QImage(self.path)
-        self.width = original.width()
-        self.height = original.height()
-
-        if preview_res != 1:
-            # Resizing the image.
-            self.preview = original.scaled(\
-                math.ceil(self.width * preview_res), \
-                math.ceil(self.height * preview_res), \
-                Qt.AspectRatioMode.KeepAspectRatio, \
-                Qt.TransformationMode.SmoothTransformation)
+        # Previews at 100% resolution are the original image, so only the 
+        # scaled-down previews are worth caching.
+        kind = "preview-%s" %repr(preview_res)
+        use_cache = Slide.cache is not None and preview_res != 1
+        cached = Slide.cache.load(self.path, kind) if use_cache else None
+
+        if cached:
+            preview, self.width, self.height = cached
         else:
-            self.preview = original
+            # For some reason, using QPixmap here clogs the main thread.
+            # The preview is decoded directly at its reduced size where the 
+            # format allows it.
+            preview, self.width, self.height = ScaledDecoder.decode(\
+                self.path, preview_res)
+            if use_cache and not preview.isNull():
+                Slide.cache.store(self.path, kind, preview, self.width, \
+                                  self.height)
+
+        # The icon is cascaded from the preview so that the full-resolution 
+        # image is never scaled twice.
+        if self.icon is None:
+            self.icon = QPixmap.fromImage(preview.scaled(icon_width, \
+                icon_height, Qt.AspectRatioMode.KeepAspectRatio, \
+                Qt.TransformationMode.SmoothTransformation))
+
+        # Finally, convert the QImage back to QPixmap, losing some efficiency.
+        self.preview = QPixmap.fromImage(preview)
+        self.preview_resolution = preview_res
+
+    """
+    Build the tile pyramid of the Slide, or reuse the one already on disk.
+    @return True (pyramid available) / False (pyramids are disabled or the 
+        image could not be read).
+    """
+    def generate_pyramid(self):
+        if Slide.pyramid_directory is None:
+            return False
+        pyramid = SlidePyramid(Slide.pyramid_directory, self.path)
+        if not pyramid.exists() and not pyramid.build():
+            self.pyramid = None
+            return False
+        self.pyramid = pyramid
+        return True
 
-        self.icon = original.scaled(icon_width, icon_height, \
-            Qt.AspectRatioMode.KeepAspectRatio, \
-            Qt.TransformationMode.SmoothTransformation)
-        
-        # Finally, convert the QImages back to QPixmap, losing some efficiency.
-        self.preview = QPixmap.fromImage(self.preview)
-        self.icon = QPixmap.fromImage(self.icon)
-        
     """
     Get a list of the names of the cropped image files for this Slide.
+    @param extension: str, the extension of the files without the dot.
     @return list of str, the list of file names.
     """
-    def get_crop_names(self):
+    def get_crop_names(self, extension = "tif"):
         names = []
         name_prefix = self.file_name[:self.file_name.rfind(".")]
         for i in range(len(self.selections)):
-            names.append(name_prefix + "_" + str(i + 1) + ".tif")
+            names.append(name_prefix + "_" + str(i + 1) + "." + extension)
         
         return names
 
     """
-    Save all cropped image selections to a given path.
-    NOte that get_crop_names is called in this function.
-    @param path: str, the path to the directory for the files to be saved in.
-    @return failed: list, the files that failed to export.
+    Get the regions of the original image cropped by the selections.
+    @return list of QRect, the region of each selection.
     """
-    def save_crops(self, path):
-        failed = []
-        names = self.get_crop_names()
-        original = QImage(self.path)
-
-        for i in range(len(self.selections)):
-            temp_path = os.path.join(path, names[i])
-
-            x = self.selections[i].center_coordinates[0]
-            y = self.selections[i].center_coordinates[1]
-            width = int(self.selections[i].width)
-            height = int(self.selections[i].height)
+    def get_crop_rects(self):
+        rects = []
+        for selection in self.selections:
+            x = selection.center_coordinates[0]
+            y = selection.center_coordinates[1]
+            width = int(selection.width)
+            height = int(selection.height)
 
             left = int(x - width // 2)
             top = int(y - height // 2)
+            rects.append(QRect(left, top, width, height))
 
-            temp_image = original.copy(QRect(left, top, width, height))
+        return rects
 
-            try:
-                # Removing any existing file with os is always safer.
-                # In some cases, Pillow will cause even the GUI to freeze.
-                if os.path.exists(temp_path) and os.path.isfile(temp_path):
-                    os.remove(temp_path)
-                temp_image.save(temp_path)
-            except Exception as e:
-                failed.append(os.path.basename(names[i]))
-
-        return failed
-
-class SlideSelection():
-    # SlideSelection contains information about a selected area on a slide.
-    
-    def __init__(self):
-        self.center_coordinates = (0, 0)
-        self.width = 0
-        self.height = 0
+    """
+    Read the cropped image selections.
+    The selected regions of TIFF images are read directly from the file.
+    Other images are decoded as a whole, once.
+    @param indices: list of int, the selections to read, or None for all.
+    @return generator of (int, QImage), the index and the image of each crop.
+    """
+    def get_crops(self, indices = None):
+        rects = self.get_crop_rects()
+        if indices is None:
+            indices = range(len(self.selections))
+
+        # Nothing is decoded when there is nothing to read.
+        if not indices:
+            return
+
+        reader = TiffRegionReader(self.path)
+        try:
+            if not reader.is_supported():
+                original = QImage(self.path)
+            for i in indices:
+                if reader.is_supported():
+                    yield i, reader.read_region(rects[i])
+                else:
+                    yield i, original.copy(rects[i])
+        finally:
+            reader.close()
+
+    """
+    Iterate over the cropped image selections as NumPy arrays.
+    The selected regions of TIFF images are read directly from the file, as 
+    in get_crops. Other images are decoded once, and each crop is then a 
+    read-only view over the decoded image, so no pixel is copied. The parts 
+    of a selection outside the image are left out of its array.
+    The shape of the arrays follows the format of the image, never its pixels:
+    (height, width) for grayscale images, (height, width, 3) for RGB images 
+    and (height, width, 4) for images with an alpha channel, with uint16 
+    samples for 16-bit grayscale images and uint8 samples otherwise. All 
+    crops of a Slide therefore have the same layout.
+    Requires NumPy, but no QApplication.
+    @param indices: list of int, the selections to read, or None for all.
+    @return generator of SlideCrop objects.
+    """
+    def iter_crops(self, indices = None):
+        if numpy is None:
+            raise ImportError("NumPy is needed to iterate over crops.")
+        rects = self.get_crop_rects()
+        names = self.get_crop_names()
+        if indices is None:
+            indices = range(len(self.selections))
+        if not indices:
+            return
+
+        reader = TiffRegionReader(self.path)
+        try:
+            if reader.is_supported():
+                bounds = QRect(0, 0, reader.width, reader.height)
+                for i in indices:
+                    rect = rects[i].intersected(bounds)
+                    # A region is read even for selections outside the image,
+                    # so that their empty array has the layout of the others.
+                    image = reader.read_region(QRect(rect.left(), rect.top(), \
+                        max(1, rect.width()), max(1, rect.height())))
+                    if image.isNull():
+                        raise OSError("The image could not be read: %s" \
+                                      %self.path)
+                    image, array = Slide._get_array(image)
+                    yield SlideCrop(self, i, names[i], rects[i], image, \
+                                    array[:rect.height(), :rect.width()])
+                return
+        finally:
+            reader.close()
+
+        # As in main, the size limit of the image reader is removed, as 
+        # slides are often larger than the limit.
+        QImageReader.setAllocationLimit(0)
+        image = QImage(self.path)
+        if image.isNull():
+            raise OSError("The image could not be read: %s" %self.path)
+        image, array = Slide._get_array(image)
+
+        bounds = QRect(0, 0, image.width(), image.height())
+        for i in indices:
+            rect = rects[i].intersected(bounds)
+            yield SlideCrop(self, i, names[i], rects[i], image, \
+                            array[rect.top():rect.top() + rect.height(), \
+                                  rect.left():rect.left() + rect.width()])
+
+    """
+    Get a NumPy array over the pixels of an image.
+    @param image: QImage, the image.
+    @return (QImage, numpy.ndarray), the image converted to the layout of 
+        TiffWriter.get_layout, and a read-only array sharing its buffer.
+    """
+    def _get_array(image):
+        # The layout is chosen from the format of the image.
+        image_format, pixel_size, samples, bits, photometric = \
+            TiffWriter.get_layout(image)
+        image = image.convertToFormat(image_format)
+
+        pixels = image.constBits()
+        pixels.setsize(image.sizeInBytes())
+        item_size = bits // 8
+        shape = (image.height(), image.width())
+        strides = (image.bytesPerLine(), pixel_size)
+        if samples > 1:
+            shape += (samples,)
+            strides += (item_size,)
+        return image, numpy.ndarray(shape, "u%d" %item_size, pixels, 0, \
+                                    strides)
+
+    """
+    Save all cropped image selections to a given path.
+    NOte that get_crop_names is called in this function.
+    @param path: str, the path to the directory for the files to be saved in.
+    @param indices: list of int, the selections to save, or None for all.
+    @param settings: ExportSettings object, the format of the files, or None
+        for uncompressed TIFF files.
+    @param journal: ExportJournal recording the written files, or None.
+    @return failed: list, the files that failed to export.
+    """
+    def save_crops(self, path, indices = None, settings = None, \
+                   journal = None):
+        # Reading, encoding and writing the crops overlap in the pipeline.
+        pipeline = ExportPipeline(path, settings, journal = journal)
+        return pipeline.run([(self, indices)])[0]
+
+class SlideCrop():
+    # SlideCrop contains a crop yielded by Slide.iter_crops: the pixels of a 
+    # selection along with where it comes from.
+
+    def __init__(self, slide, index, name, rect, image, array):
+        self.slide = slide
+        self.index = index
+
+        # name is the name the crop is exported with, and rect its region.
+        self.name = name
+        self.rect = rect
+
+        # array is a view over the pixels of image, which is kept here so 
+        # that the buffer stays alive as long as the crop.
+        self.image = image
+        self.array = array
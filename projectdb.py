@@ -0,0 +1,239 @@
+#!/usr/bin/python
+################################################################################
+#
+#   projectdb.py
+#   Author: Roger Wang
+#   Date: 2024-07-18
+#
+#   ProjectDB stores a Project in an SQLite database, as an alternative to the
+#   JSON project file for projects with thousands of slides. Both keep the
+#   SCP extension; the format of a project file is recognized by its header.
+#
+#   Slides, with the metadata of their image (see slidemetadata.py), and 
+#   selections are kept in their own indexed tables. ProjectDB
+#   remembers what it last saved or loaded, so that saving again only writes
+#   the rows that changed, within a single transaction. A save that fails
+#   leaves the file as it was.
+#
+################################################################################
+
+import json
+import os
+import sqlite3
+
+class ProjectDB():
+    # Every SQLite database begins with this header.
+    HEADER = b"SQLite format 3\x00"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS project (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS slides (
+            id INTEGER PRIMARY KEY,
+            position INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            metadata TEXT
+        );
+        CREATE INDEX IF NOT EXISTS slides_position ON slides (position);
+        CREATE TABLE IF NOT EXISTS selections (
+            slide_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            center_x NUMERIC NOT NULL,
+            center_y NUMERIC NOT NULL,
+            width NUMERIC NOT NULL,
+            height NUMERIC NOT NULL,
+            PRIMARY KEY (slide_id, position)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.executescript(ProjectDB.SCHEMA)
+
+        # Databases saved before metadata existed lack its column.
+        columns = [column[1] for column in self._connection.execute(\
+            "PRAGMA table_info(slides)")]
+        if "metadata" not in columns:
+            with self._connection:
+                self._connection.execute(\
+                    "ALTER TABLE slides ADD COLUMN metadata TEXT")
+
+        # _project maps each key of the project table to its saved value.
+        # _slides maps the id of each saved Slide object to its row id, the
+        # Slide (so that the id is not reused), and its saved position, path,
+        # metadata and selections.
+        self._project = {}
+        self._slides = {}
+
+    """
+    Check whether a project file is an SQLite database.
+    @param path: str, the path to the project file.
+    @return True (SQLite) / False (JSON, or not readable).
+    """
+    def is_database(path):
+        try:
+            with open(path, "rb") as file:
+                return file.read(len(ProjectDB.HEADER)) == ProjectDB.HEADER
+        except OSError:
+            return False
+
+    """
+    Create a new database at the given path holding the Project. An existing
+    file at the path is only replaced once the database is complete.
+    @param project: Project object.
+    @param path: str, the path to the project file.
+    @return ProjectDB of the new file.
+    """
+    def create(project, path):
+        temp_path = path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        database = ProjectDB(temp_path)
+        try:
+            database.save(project)
+        finally:
+            database.close()
+        os.replace(temp_path, path)
+        database = ProjectDB(path)
+        values, slides = database.read()
+        database.remember(project, [row for row, path, metadata, selections \
+                                    in slides])
+        return database
+
+    """
+    Read the content of the database.
+    @return (dict, list), the values of the project table, and the row id, 
+        path, metadata (as from SlideMetadata.to_dict, or None) and 
+        selections (as from _get_selections) of each slide in order.
+    """
+    def read(self):
+        values = {key: json.loads(value) for key, value in \
+                  self._connection.execute("SELECT key, value FROM project")}
+
+        selections = {}
+        for row in self._connection.execute(\
+            "SELECT slide_id, center_x, center_y, width, height " \
+            "FROM selections ORDER BY slide_id, position"):
+            selections.setdefault(row[0], []).append(row[1:])
+
+        slides = [(row, path, json.loads(metadata) if metadata else None, \
+                   selections.get(row, [])) for row, path, metadata in \
+                  self._connection.execute(\
+                      "SELECT id, path, metadata FROM slides " \
+                      "ORDER BY position")]
+        return values, slides
+
+    """
+    Save the Project to the database. Only the rows that changed since the
+    last save or load are written, in a single transaction.
+    @param project: Project object.
+    """
+    def save(self, project):
+        values = ProjectDB._get_values(project)
+        rows = []
+        with self._connection:
+            cursor = self._connection.cursor()
+            cursor.executemany("INSERT OR REPLACE INTO project (key, value) " \
+                               "VALUES (?, ?)", [(key, value) for key, value \
+                               in values.items() \
+                               if self._project.get(key) != value])
+
+            # Slides that are no longer in the Project.
+            current = set(id(slide) for slide in project.slides)
+            for key, (row, slide, saved) in self._slides.items():
+                if key not in current:
+                    cursor.execute("DELETE FROM selections " \
+                                   "WHERE slide_id = ?", (row,))
+                    cursor.execute("DELETE FROM slides WHERE id = ?", (row,))
+
+            for position in range(len(project.slides)):
+                slide = project.slides[position]
+                selections = ProjectDB._get_selections(slide)
+                metadata = ProjectDB._get_metadata(slide)
+                if id(slide) not in self._slides:
+                    cursor.execute("INSERT INTO slides (position, path, " \
+                                   "metadata) VALUES (?, ?, ?)", \
+                                   (position, slide.path, metadata))
+                    row = cursor.lastrowid
+                    saved = (None, None, None, [])
+                else:
+                    row, saved_slide, saved = self._slides[id(slide)]
+                    if saved[:3] != (position, slide.path, metadata):
+                        cursor.execute("UPDATE slides SET position = ?, " \
+                                       "path = ?, metadata = ? WHERE id = ?", \
+                                       (position, slide.path, metadata, row))
+                rows.append(row)
+
+                # Selections are compared by position.
+                saved_selections = saved[3]
+                cursor.executemany("INSERT OR REPLACE INTO selections " \
+                                   "(slide_id, position, center_x, center_y, " \
+                                   "width, height) VALUES (?, ?, ?, ?, ?, ?)", \
+                                   [(row, i) + selections[i] for i in \
+                                    range(len(selections)) \
+                                    if i >= len(saved_selections) or \
+                                    saved_selections[i] != selections[i]])
+                if len(saved_selections) > len(selections):
+                    cursor.execute("DELETE FROM selections " \
+                                   "WHERE slide_id = ? AND position >= ?", \
+                                   (row, len(selections)))
+
+        self.remember(project, rows)
+
+    """
+    Close the database.
+    """
+    def close(self):
+        self._connection.close()
+
+    """
+    Remember the Project as saved, after it was saved or loaded.
+    @param project: Project object.
+    @param rows: list of int, the row id of each Slide of the Project.
+    """
+    def remember(self, project, rows):
+        self._project = ProjectDB._get_values(project)
+        self._slides = {}
+        for position in range(len(project.slides)):
+            slide = project.slides[position]
+            self._slides[id(slide)] = (rows[position], slide, \
+                (position, slide.path, ProjectDB._get_metadata(slide), \
+                 ProjectDB._get_selections(slide)))
+
+    """
+    Get the values of the project table.
+    @param project: Project object.
+    @return dict, the JSON encoded value of each key.
+    """
+    def _get_values(project):
+        return {
+            "name": json.dumps(project.name),
+            "work_index": json.dumps(project.work_index),
+            "selection": json.dumps(project.selection),
+            "width": json.dumps(project.width),
+            "height": json.dumps(project.height),
+            "export": json.dumps(project.export_settings.to_dict()),
+            "journal": json.dumps(project.journal_sequence),
+        }
+
+    """
+    Get the selections of a Slide as rows.
+    @param slide: Slide object.
+    @return list of tuple, the center x and y, width and height of each
+        selection.
+    """
+    def _get_selections(slide):
+        return slide.selections.rows()
+
+    """
+    Get the metadata of a Slide as stored in the slides table.
+    @param slide: Slide object.
+    @return str, the JSON encoded metadata / None if the Slide has none.
+    """
+    def _get_metadata(slide):
+        if not slide.metadata:
+            return None
+        return json.dumps(slide.metadata.to_dict())
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+################################################################################
+#
+#   projectjournal.py
+#   Author: Roger Wang
+#   Date: 2024-07-19
+#
+#   ProjectJournal appends the edits made to a Project to a journal next to
+#   the project file (<project file>.journal), one JSON record per line, so
+#   that the edits made since the last save survive a crash. The journal is
+#   replayed when the project is loaded, and trimmed once the project file
+#   holds the edits.
+#
+#   Each record has a "seq" number, increasing with every edit. The project
+#   file stores the number of the last edit it holds, so records already in
+#   the project file are never applied twice. Records have an "op":
+#       select: a selection added to a slide.
+#       move: a selection moved.
+#       remove: a selection removed.
+#       add_slide: a slide added to the end of the project.
+#       remove_slide: a slide removed.
+#       slides: the slides reordered, as the list of their paths.
+#       resize: all selections resized.
+#       project: the settings of the project changed.
+#       metadata: the image of a slide probed, when the project was opened.
+#   Records about a slide hold its index and its path, which are checked
+#   when the record is applied (see Project.apply_record).
+#
+#   The journal is compacted into a snapshot next to the project file 
+#   (<project file>.autosave), a JSON project file holding every edit up to
+#   the number of its last record, so that the project file itself is only 
+#   written when the user saves. A snapshot newer than the project file is 
+#   loaded in its place, before the journal is replayed. Saving the project 
+#   file, or discarding the edits, removes the snapshot.
+#
+################################################################################
+
+import json
+import os
+
+class ProjectJournal():
+    """
+    Get the path of the journal of a project file.
+    @param path: str, the path to the project file.
+    @return str, the path to the journal.
+    """
+    def get_path(path):
+        return path + ".journal"
+
+    """
+    Get the path of the snapshot of a project file.
+    @param path: str, the path to the project file.
+    @return str, the path to the snapshot.
+    """
+    def get_snapshot_path(path):
+        return path + ".autosave"
+
+    """
+    Check whether a project file has a snapshot to be loaded in its place.
+    A snapshot older than the project file was left by a save that did not
+    remove it, and is ignored.
+    @param path: str, the path to the project file.
+    @return True (load the snapshot) / False (load the project file).
+    """
+    def has_snapshot(path):
+        try:
+            snapshot = os.stat(ProjectJournal.get_snapshot_path(path))
+        except OSError:
+            return False
+        try:
+            return snapshot.st_mtime_ns > os.stat(path).st_mtime_ns
+        except OSError:
+            return True
+
+    """
+    Remove the snapshot of a project file.
+    @param path: str, the path to the project file.
+    """
+    def remove_snapshot(path):
+        try:
+            os.remove(ProjectJournal.get_snapshot_path(path))
+        except OSError:
+            pass
+
+    """
+    Append a record to the journal of a project file.
+    The journal is opened for each record, as it is replaced when trimmed.
+    The record is flushed to the disk before returning, so that it survives 
+    a crash of the system as well as of the application. Moves are recorded 
+    once their selection stops moving, so this happens once per edit.
+    @param path: str, the path to the project file.
+    @param record: dict, the record.
+    """
+    def append(path, record):
+        with open(ProjectJournal.get_path(path), "a") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    """
+    Read the journal of a project file.
+    @param path: str, the path to the project file.
+    @return list of dict, the records in order. Reading stops at the first
+        incomplete record.
+    """
+    def read(path):
+        records = []
+        try:
+            with open(ProjectJournal.get_path(path), "r") as file:
+                lines = file.readlines()
+        except OSError:
+            return records
+        for line in lines:
+            # The last line is incomplete if the program crashed while
+            # writing it.
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict) or \
+                    not isinstance(record.get("seq"), int):
+                    break
+            except ValueError:
+                break
+            records.append(record)
+        return records
+
+    """
+    Remove the records held by the project file from its journal.
+    @param path: str, the path to the project file.
+    @param sequence: int, the number of the last edit held by the file.
+    """
+    def trim(path, sequence):
+        records = [record for record in ProjectJournal.read(path) \
+                   if record["seq"] > sequence]
+        if not records:
+            ProjectJournal.remove(path)
+            return
+        journal_path = ProjectJournal.get_path(path)
+        try:
+            with open(journal_path + ".tmp", "w") as file:
+                for record in records:
+                    file.write(json.dumps(record) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(journal_path + ".tmp", journal_path)
+        except OSError:
+            # The records are skipped when replayed anyway.
+            pass
+
+    """
+    Remove the journal of a project file.
+    @param path: str, the path to the project file.
+    """
+    def remove(path):
+        try:
+            os.remove(ProjectJournal.get_path(path))
+        except OSError:
+            pass
@@ -0,0 +1,156 @@
+#!/usr/bin/python
+################################################################################
+#
+#   projectstream.py
+#   Author: Roger Wang
+#   Date: 2024-07-22
+#
+#   ProjectStream reads a JSON project file incrementally. The file is read in
+#   chunks and the slides are decoded one at a time from the "slides" list, so
+#   that large project files are never held in memory as a whole, and slides
+#   can be used while the rest of the file is still being read.
+#
+#   Iterating over a ProjectStream yields the dict of each slide, as written
+#   by Project.to_json. The other values of the project are gathered in
+#   values as they are read. As "slides" is the last key written by
+#   Project.to_json, values is complete once the first slide is yielded for
+#   such files, and in any case once the iteration is over.
+#
+################################################################################
+
+import json
+import re
+
+class ProjectStream():
+    # Number of characters read from the file at a time.
+    chunk_size = 1 << 20
+
+    # Whitespaces allowed between JSON values.
+    _whitespace = re.compile(r"[ \t\n\r]*")
+
+    def __init__(self, path, chunk_size = 0):
+        self.path = path
+        self.values = {}
+        self._chunk_size = chunk_size if chunk_size > 0 else \
+            ProjectStream.chunk_size
+
+        self._decoder = json.JSONDecoder()
+        self._file = None
+        self._buffer = ""
+        self._position = 0
+        self._end = False
+
+    """
+    Iterate over the slides of the project file.
+    @return generator of dict, the slides.
+    """
+    def __iter__(self):
+        with open(self.path, "r") as file:
+            self._file = file
+            self._buffer = ""
+            self._position = 0
+            self._end = False
+            try:
+                yield from self._read_project()
+            finally:
+                self._file = None
+                self._buffer = ""
+
+    """
+    Read the project object, yielding the slides.
+    """
+    def _read_project(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self._position += 1
+            return
+
+        while True:
+            key = self._decode()
+            if not isinstance(key, str):
+                raise ValueError("Expecting a key in %s" %self.path)
+            self._expect(":")
+            if key == "slides":
+                yield from self._read_slides()
+            else:
+                self.values[key] = self._decode()
+            if self._expect(",}") == "}":
+                return
+
+    """
+    Read the list of slides, yielding them one at a time.
+    """
+    def _read_slides(self):
+        self._expect("[")
+        if self._peek() == "]":
+            self._position += 1
+            return
+
+        while True:
+            yield self._decode()
+            if self._expect(",]") == "]":
+                return
+
+    """
+    Get the next character after whitespaces, without consuming it.
+    @return str, the character, or "" at the end of the file.
+    """
+    def _peek(self):
+        while True:
+            self._position = ProjectStream._whitespace.match(\
+                self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return ""
+
+    """
+    Consume the next character after whitespaces, which must be one of the
+    given characters.
+    @param characters: str, the expected characters.
+    @return str, the character.
+    """
+    def _expect(self, characters):
+        character = self._peek()
+        if not character or character not in characters:
+            raise ValueError("Expecting one of '%s' at character %d in %s" \
+                             %(characters, self._position, self.path))
+        self._position += 1
+        return character
+
+    """
+    Decode the next JSON value. More of the file is read until the value is
+    complete.
+    @return the value.
+    """
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, \
+                                                      self._position)
+                # A number at the end of the buffer may continue in the next
+                # chunk.
+                if end < len(self._buffer) or self._end:
+                    self._position = end
+                    return value
+            except ValueError:
+                if self._end:
+                    raise
+            self._read()
+
+    """
+    Read the next chunk of the file into the buffer. The characters already
+    consumed are dropped.
+    @return True (read) / False (end of the file).
+    """
+    def _read(self):
+        if self._end:
+            return False
+        chunk = self._file.read(self._chunk_size)
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        if not chunk:
+            self._end = True
+            return False
+        return True
@@ -9,6 +9,17 @@
 #   image paths are valid. If invalid paths are found, a QDialog will first be 
 #   prompted to ask the user if the missing Slides should be located or removed.
 #
+#   The Slides can also be checked while the project file is being read, by 
+#   giving verify the Slides yielded by Project.iter_load.
+#
+#   The images of the Slides are not read when their files are unchanged 
+#   since the project was saved (see slidemetadata.py). Changed files are 
+#   probed again, and if they hold another image, the selections are moved 
+#   back within it. The metadata of the probed images is recorded in the 
+#   journal, so that the project file is updated by the next autosave and 
+#   the images are not probed again when the project is reopened. As the 
+#   metadata is not an edit of the user, the project is not marked unsaved.
+#
 #   Clicking "Cancel" at this step cancels the Project load entirely.
 #   Clicking "Remove" at this step removes all unfound Slides.
 #   Clicking "Locate" at this step will prompt QFileDialogs that ask the user 
@@ -35,6 +46,9 @@ class ProjectVerifier():
         self._project = project
         self._unfounds = []
 
+        # _probed holds the Slides whose image was probed by verify.
+        self._probed = set()
+
         # _to_remove is a temporary list of indices.
         # Notice that when trying to locate files, recursion is used to make 
         # sure that the user is asked to locate each unfound file exactly once.
@@ -47,18 +61,38 @@ class ProjectVerifier():
     """
     Verify the path to Slides of a Project. Prompt dialog to ask for actions if 
     unfound images exist, and locate, remove, or cancel the load.
+    @param slides: iterable of Slides being loaded into the Project (see 
+    Project.iter_load), which are checked as soon as they are loaded / None to 
+    check the Slides already in the Project.
     @return True (Project is now safe and loading should continue) / False 
     (Project loading should be canceled).
     """
-    def verify(self):
+    def verify(self, slides = None):
         # Reset variables.
         self._unfounds = []
         self._to_remove = []
+        self._probed = set()
+
+        # Checking the Slides while they are loaded. The unfound Slides are 
+        # kept rather than their indices, as the Slides can still be changed 
+        # by the journal once they are all loaded. The Slides themselves are
+        # kept, as a Slide removed by the journal could otherwise leave its 
+        # id to a new Slide.
+        checked = set()
+        unfound_slides = set()
+        if slides is not None:
+            for slide in slides:
+                checked.add(slide)
+                if not self._check_slide(slide):
+                    unfound_slides.add(slide)
 
         # Iterating through Slides to check that all paths exist.
         for i in range(len(self._project.slides)):
-            if not os.path.exists(self._project.slides[i].path):
+            slide = self._project.slides[i]
+            if slide in unfound_slides or (slide not in checked and \
+                not self._check_slide(slide)):
                 self._unfounds.append(i)
+        self._record_probed()
 
         # Return True immediately if all images were found.
         if not self._unfounds:
@@ -80,6 +114,46 @@ class ProjectVerifier():
         self._project.work_index = 1
         return True
 
+    """
+    Check that the image of a Slide exists, and update its metadata. The 
+    selections are fixed if the file holds another image than when the 
+    project was saved.
+    @param slide: Slide object.
+    @return True (found) / False (unfound).
+    """
+    def _check_slide(self, slide):
+        metadata = slide.metadata
+        try:
+            changed = slide.update_metadata()
+        except OSError:
+            return False
+
+        if slide.metadata is not metadata:
+            self._probed.add(slide)
+        if changed and len(slide.selections):
+            slide.selections.clamp(slide.width, slide.height)
+            self._project.saved = False
+        return True
+
+    """
+    Record the metadata of the probed Slides in the journal of the project 
+    file. The records are only made once all the Slides are loaded, as 
+    they follow the edits replayed from the journal.
+    """
+    def _record_probed(self):
+        for i in range(len(self._project.slides)):
+            slide = self._project.slides[i]
+            if slide not in self._probed:
+                continue
+            try:
+                self._project.record_edit({"op": "metadata", "slide": i, \
+                                           "path": slide.path, "metadata": \
+                                           slide.metadata.to_dict()})
+            except OSError:
+                # The metadata is still saved with the project.
+                pass
+        self._probed = set()
+
     """
     Handler for if user chooses to locate the missing images.
     """
@@ -139,38 +213,9 @@ class ProjectVerifier():
     @param slide: Slide object.
     """
     def _fix_selections(self, slide):
-        original = QImage(slide.path)
-        image_width = original.width()
-        image_height = original.height()
-
-        for selection in slide.selections:
-            # Calculating the position of the selection rectangle.
-            x = selection.center_coordinates[0]
-            y = selection.center_coordinates[1]
-            selection_width = selection.width
-            selection_height = selection.height
-
-            left = x - selection_width // 2
-            right = x + math.ceil(selection_width / 2)
-            top = y - selection_height // 2
-            bottom = y + math.ceil(selection_height / 2)
-        
-            # Adjusting coordinates if necessary.
-            if right > image_width:
-                selection.center_coordinates = (image_width - \
-                    selection_width // 2, selection.center_coordinates[1])
-                left = selection.center_coordinates[0] - selection_width // 2
-            if left < 0:
-                selection.center_coordinates = (selection_width // 2, \
-                    selection.center_coordinates[1])
-            if bottom > image_height:
-                selection.center_coordinates = (\
-                    selection.center_coordinates[0], \
-                    image_height - selection_height // 2)
-                top = selection.center_coordinates[1] - selection_height // 2
-            if top < 0:
-                selection.center_coordinates = (\
-                    selection.center_coordinates[0], selection_height // 2)
+        # Only the header of the image is read to get its size.
+        slide.probe()
+        slide.selections.clamp(slide.width, slide.height)
 
     """
     Handler for when the user clicks the "Remove" button.
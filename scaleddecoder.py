@@ -0,0 +1,119 @@
+#!/usr/bin/python
+################################################################################
+#
+#   scaleddecoder.py
+#   Author: Roger Wang
+#   Date: 2024-07-03
+#
+#   Static class that decodes an image directly at a reduced size.
+#   Instead of decoding the full-resolution image and scaling it afterwards,
+#   the reduced size is handed to QImageReader before decoding, so formats
+#   that support it (e.g. the DCT scaling of JPEG) never produce the full
+#   image in memory. For TIFF files carrying reduced-resolution subfiles, the
+#   smallest subfile that is still large enough is decoded instead of the
+#   full-resolution image.
+#
+################################################################################
+
+import math
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+class ScaledDecoder():
+    """
+    Decode an image at a given scale.
+    @param path: str, the path to the image.
+    @param scale: float, the scale of the decoded image (1 for full size).
+    @return (QImage, int, int), the decoded image, and the width and height
+        of the full-resolution image. The QImage is null if decoding failed.
+    """
+    def decode(path, scale):
+        reader = QImageReader(path)
+
+        # The TIFF handler misreads the number of images once the header has 
+        # been parsed, so the count is queried first.
+        image_count = reader.imageCount()
+        size = reader.size()
+
+        # Without the size in the header, the image is decoded in full.
+        if not size.isValid():
+            image = reader.read()
+            if scale != 1 and not image.isNull():
+                image = image.scaled(\
+                    math.ceil(image.width() * scale), \
+                    math.ceil(image.height() * scale), \
+                    Qt.AspectRatioMode.KeepAspectRatio, \
+                    Qt.TransformationMode.SmoothTransformation)
+            return image, image.width(), image.height()
+
+        width = size.width()
+        height = size.height()
+        if scale == 1:
+            return reader.read(), width, height
+
+        target = QSize(math.ceil(width * scale), math.ceil(height * scale))
+        reader = ScaledDecoder._get_subfile_reader(path, reader, image_count, \
+                                                  size, target)
+        reader.setScaledSize(target)
+        return reader.read(), width, height
+
+    """
+    Decode an image at the largest scale that fits in a given size.
+    @param path: str, the path to the image.
+    @param width: int, the maximum width of the decoded image.
+    @param height: int, the maximum height of the decoded image.
+    @return (QImage, int, int), the decoded image, and the width and height
+        of the full-resolution image. The QImage is null if decoding failed.
+    """
+    def decode_to_fit(path, width, height):
+        size = QImageReader(path).size()
+        if not size.isValid() or size.isEmpty():
+            return ScaledDecoder.decode(path, 1)
+
+        scale = min(1, width / size.width(), height / size.height())
+        return ScaledDecoder.decode(path, scale)
+
+    """
+    Get a QImageReader positioned at the smallest reduced-resolution subfile
+    that is at least as large as the target size.
+    Subfiles are only used if they share the aspect ratio of the full image.
+    @param path: str, the path to the image.
+    @param reader: QImageReader, the reader of the full-resolution image.
+    @param image_count: int, the number of images in the file.
+    @param size: QSize, the size of the full-resolution image.
+    @param target: QSize, the size of the image to be decoded.
+    @return QImageReader, the reader to be used.
+    """
+    def _get_subfile_reader(path, reader, image_count, size, target):
+        if image_count <= 1 or \
+            bytes(reader.format()).lower() not in (b"tif", b"tiff"):
+            return reader
+
+        best_index = -1
+        best_size = size
+        for i in range(1, image_count):
+            if not reader.jumpToImage(i):
+                break
+            subfile_size = reader.size()
+            if not subfile_size.isValid():
+                continue
+            if subfile_size.width() < target.width() or \
+                subfile_size.height() < target.height() or \
+                subfile_size.width() >= best_size.width():
+                continue
+
+            # Pages of a different aspect ratio are not reduced versions of
+            # the full image.
+            if abs(subfile_size.width() / subfile_size.height() - \
+                   size.width() / size.height()) > 0.01:
+                continue
+            best_index = i
+            best_size = subfile_size
+
+        # Starting over with a new reader is more reliable than jumping back,
+        # as some handlers do not support going backwards.
+        reader = QImageReader(path)
+        if best_index > 0:
+            reader.jumpToImage(best_index)
+        return reader
@@ -0,0 +1,225 @@
+#!/usr/bin/python
+################################################################################
+#
+#   selectionstore.py
+#   Author: Roger Wang
+#   Date: 2024-07-24
+#
+#   SelectionStore holds the selections of a Slide in columns (array.array)
+#   rather than as one Python object per selection, which takes a fraction of
+#   the memory for projects with many selections. The checks and changes of
+#   all the selections of a Slide (bounds checks, clamping and resizing) run
+#   on whole columns, with NumPy when it is installed.
+#
+#   A SelectionStore is used as the list of SlideSelections of a Slide: it
+#   supports len, indexing, iteration, append and pop. The SlideSelections it
+#   returns are views of its rows, so that changing them changes the store.
+#   As with list indices, a view refers to another selection once a
+#   selection before it has been removed, so views should not be kept.
+#
+#   A SlideSelection created on its own holds its values in a store of its
+#   own, and its values are copied when it is appended to a SelectionStore.
+#
+################################################################################
+
+import array
+
+try:
+    import numpy
+except ImportError:
+    # Columns are processed in Python without NumPy.
+    numpy = None
+
+class SelectionStore():
+    # Minimum number of selections for NumPy to be used. Smaller stores are
+    # faster to process in Python.
+    vector_size = 64
+
+    __slots__ = ("center_x", "center_y", "width", "height")
+
+    def __init__(self):
+        # The center coordinates can be fractional when selections are made
+        # on a preview, while the size is always a number of pixels.
+        self.center_x = array.array("d")
+        self.center_y = array.array("d")
+        self.width = array.array("q")
+        self.height = array.array("q")
+
+    def __len__(self):
+        return len(self.center_x)
+
+    def __getitem__(self, index):
+        # Checking the index, including negative indices, as a list would.
+        return SlideSelection(self, range(len(self.center_x))[index])
+
+    def __iter__(self):
+        for i in range(len(self.center_x)):
+            yield SlideSelection(self, i)
+
+    """
+    Append a copy of a SlideSelection.
+    @param selection: SlideSelection object.
+    """
+    def append(self, selection):
+        center_x, center_y = selection.center_coordinates
+        self.add(center_x, center_y, selection.width, selection.height)
+
+    """
+    Append a selection from its values.
+    @param center_x: int/float, the center x coordinate.
+    @param center_y: int/float, the center y coordinate.
+    @param width: int, the width.
+    @param height: int, the height.
+    """
+    def add(self, center_x, center_y, width, height):
+        self.center_x.append(center_x)
+        self.center_y.append(center_y)
+        self.width.append(int(width))
+        self.height.append(int(height))
+
+    """
+    Remove a selection.
+    @param index: int, the index of the selection, the last one by default.
+    @return SlideSelection object, a copy of the removed selection.
+    """
+    def pop(self, index = -1):
+        selection = SlideSelection()
+        selection.center_coordinates = (self.center_x.pop(index), \
+                                         self.center_y.pop(index))
+        selection.width = self.width.pop(index)
+        selection.height = self.height.pop(index)
+        return selection
+
+    """
+    Get the values of all selections.
+    @return list of (float, float, int, int), the center coordinates, width
+        and height of each selection.
+    """
+    def rows(self):
+        return list(zip(self.center_x, self.center_y, self.width, \
+                        self.height))
+
+    """
+    Check if all selections would be within an image for a new selection
+    size.
+    @param image_width: int, the width of the image.
+    @param image_height: int, the height of the image.
+    @param width: int, the new width of the selections.
+    @param height: int, the new height of the selections.
+    @return True (all selections are safe) / False (overflow exists).
+    """
+    def fits(self, image_width, image_height, width, height):
+        if not len(self):
+            return True
+        if numpy is not None and len(self) >= SelectionStore.vector_size:
+            x = numpy.frombuffer(self.center_x, "d")
+            y = numpy.frombuffer(self.center_y, "d")
+            min_x, max_x, min_y, max_y = x.min(), x.max(), y.min(), y.max()
+        else:
+            min_x, max_x = min(self.center_x), max(self.center_x)
+            min_y, max_y = min(self.center_y), max(self.center_y)
+
+        # The selections extend width // 2 to the left of their center and
+        # the rest to the right.
+        return min_x - width // 2 >= 0 and \
+            max_x + (width - width // 2) <= image_width and \
+            min_y - height // 2 >= 0 and \
+            max_y + (height - height // 2) <= image_height
+
+    """
+    Set the size of all selections. The center coordinates are not changed.
+    @param width: int, the new width.
+    @param height: int, the new height.
+    """
+    def resize(self, width, height):
+        count = len(self)
+        self.width[:] = array.array("q", [int(width)]) * count
+        self.height[:] = array.array("q", [int(height)]) * count
+
+    """
+    Move the selections that overflow an image back within it. A selection
+    larger than the image is aligned to its top left corner.
+    @param image_width: int, the width of the image.
+    @param image_height: int, the height of the image.
+    """
+    def clamp(self, image_width, image_height):
+        if numpy is not None and len(self) >= SelectionStore.vector_size:
+            SelectionStore._clamp_column(\
+                numpy.frombuffer(self.center_x, "d"), \
+                numpy.frombuffer(self.width, "q"), image_width)
+            SelectionStore._clamp_column(\
+                numpy.frombuffer(self.center_y, "d"), \
+                numpy.frombuffer(self.height, "q"), image_height)
+            return
+
+        for i in range(len(self)):
+            self.center_x[i] = SelectionStore._clamp_value(\
+                self.center_x[i], self.width[i], image_width)
+            self.center_y[i] = SelectionStore._clamp_value(\
+                self.center_y[i], self.height[i], image_height)
+
+    """
+    Clamp a center coordinate within an image.
+    @param center: float, the center coordinate.
+    @param size: int, the size of the selection along the coordinate.
+    @param image_size: int, the size of the image along the coordinate.
+    @return float, the clamped center coordinate.
+    """
+    def _clamp_value(center, size, image_size):
+        if center + (size - size // 2) > image_size:
+            center = image_size - (size - size // 2)
+        if center - size // 2 < 0:
+            center = size // 2
+        return center
+
+    """
+    Clamp a column of center coordinates within an image, in place.
+    @param centers: numpy.ndarray, the center coordinates.
+    @param sizes: numpy.ndarray, the sizes of the selections along the
+        coordinate.
+    @param image_size: int, the size of the image along the coordinate.
+    """
+    def _clamp_column(centers, sizes, image_size):
+        half = sizes // 2
+        numpy.copyto(centers, image_size - (sizes - half), \
+                     where = centers + (sizes - half) > image_size)
+        numpy.copyto(centers, half, where = centers - half < 0)
+
+class SlideSelection():
+    # SlideSelection contains information about a selected area on a slide.
+    # It is a view of a row of a SelectionStore.
+
+    __slots__ = ("_store", "_index")
+
+    def __init__(self, store = None, index = 0):
+        if store is None:
+            store = SelectionStore()
+            store.add(0, 0, 0, 0)
+        self._store = store
+        self._index = index
+
+    @property
+    def center_coordinates(self):
+        return (self._store.center_x[self._index], \
+                self._store.center_y[self._index])
+
+    @center_coordinates.setter
+    def center_coordinates(self, value):
+        self._store.center_x[self._index] = value[0]
+        self._store.center_y[self._index] = value[1]
+
+    @property
+    def width(self):
+        return self._store.width[self._index]
+
+    @width.setter
+    def width(self, value):
+        self._store.width[self._index] = int(value)
+
+    @property
+    def height(self):
+        return self._store.height[self._index]
+
+    @height.setter
+    def height(self, value):
+        self._store.height[self._index] = int(value)
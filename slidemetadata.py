@@ -0,0 +1,143 @@
+#!/usr/bin/python
+################################################################################
+#
+#   slidemetadata.py
+#   Author: Roger Wang
+#   Date: 2024-07-25
+#
+#   SlideMetadata holds what is known about the image of a Slide: its size,
+#   pixel format and file format from the header (see imageprobe.py), along
+#   with the size and modification time of the file and a fingerprint of its
+#   content. It is saved in the project file, so that reopening a project
+#   does not read the images again: the size of each slide is known from the
+#   project file, and an image is only probed again when a stat of its file
+#   differs from the saved one.
+#
+#   The fingerprint is a BLAKE2b digest of the size of the file and of its
+#   first and last bytes. It tells whether a file whose stat changed (copied,
+#   touched, or moved to another location) still holds the same image.
+#
+################################################################################
+
+import hashlib
+import os
+
+from imageprobe import *
+
+class SlideMetadata():
+    # Number of bytes read at each end of the file for the fingerprint.
+    sample_size = 1 << 16
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+
+        # depth is the number of bits per channel.
+        self.depth = 0
+        self.channels = 0
+        self.file_format = ""
+
+        # file_size is in bytes and mtime in nanoseconds, as from os.stat.
+        self.file_size = 0
+        self.mtime = 0
+        self.fingerprint = ""
+
+    """
+    Read the metadata of an image. Only the header of the image and the bytes
+    of the fingerprint are read.
+    @param path: str, the path to the image.
+    @param stat: os.stat_result of the file / None to stat it.
+    @return SlideMetadata / None if the header cannot be read.
+    """
+    def read(path, stat = None):
+        try:
+            if stat is None:
+                stat = os.stat(path)
+            fingerprint = SlideMetadata.get_fingerprint(path, stat.st_size)
+        except OSError:
+            return None
+        info = ImageProbe.probe(path)
+        if not info:
+            return None
+
+        metadata = SlideMetadata()
+        metadata.width = info.width
+        metadata.height = info.height
+        metadata.depth = info.depth
+        metadata.channels = info.channels
+        metadata.file_format = info.file_format
+        metadata.file_size = stat.st_size
+        metadata.mtime = stat.st_mtime_ns
+        metadata.fingerprint = fingerprint
+        return metadata
+
+    """
+    Compute the fingerprint of a file.
+    @param path: str, the path to the file.
+    @param size: int, the size of the file in bytes.
+    @return str, the hexadecimal digest.
+    """
+    def get_fingerprint(path, size):
+        digest = hashlib.blake2b(str(size).encode(), digest_size = 16)
+        with open(path, "rb") as file:
+            digest.update(file.read(SlideMetadata.sample_size))
+            if size > SlideMetadata.sample_size:
+                file.seek(max(size - SlideMetadata.sample_size, \
+                              SlideMetadata.sample_size))
+                digest.update(file.read(SlideMetadata.sample_size))
+        return digest.hexdigest()
+
+    """
+    Check whether the file is unchanged since the metadata was read.
+    @param stat: os.stat_result of the file.
+    @return True (same size and modification time) / False.
+    """
+    def matches(self, stat):
+        return self.file_size == stat.st_size and self.mtime == stat.st_mtime_ns
+
+    """
+    Check whether other metadata describes the same image.
+    @param other: SlideMetadata object.
+    @return True (same size and fingerprint) / False.
+    """
+    def same_image(self, other):
+        return self.fingerprint == other.fingerprint and \
+            self.width == other.width and self.height == other.height
+
+    """
+    Get the metadata as a dictionary, as saved in the project file.
+    @return dict.
+    """
+    def to_dict(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "depth": self.depth,
+            "channels": self.channels,
+            "format": self.file_format,
+            "size": self.file_size,
+            "mtime": self.mtime,
+            "fingerprint": self.fingerprint,
+        }
+
+    """
+    Create SlideMetadata from a dictionary saved in the project file.
+    @param values: dict, from to_dict.
+    @return SlideMetadata / None if values is not valid metadata.
+    """
+    def from_dict(values):
+        if not isinstance(values, dict):
+            return None
+        metadata = SlideMetadata()
+        try:
+            metadata.width = int(values["width"])
+            metadata.height = int(values["height"])
+            metadata.depth = int(values.get("depth", 0))
+            metadata.channels = int(values.get("channels", 0))
+            metadata.file_format = str(values.get("format", ""))
+            metadata.file_size = int(values["size"])
+            metadata.mtime = int(values["mtime"])
+            metadata.fingerprint = str(values.get("fingerprint", ""))
+        except (KeyError, TypeError, ValueError):
+            return None
+        return metadata
@@ -0,0 +1,350 @@
+#!/usr/bin/python
+################################################################################
+#
+#   slidepyramid.py
+#   Author: Roger Wang
+#   Date: 2024-07-05
+#
+#   SlidePyramid is a multi-resolution, tiled copy of a slide image kept on
+#   disk. Level 0 is the full-resolution image and every following level
+#   halves the width and height of the previous one, until the whole image
+#   fits in a single tile. Each level is cut into square PNG tiles so that
+#   any zoom level of any region can be served from the nearest level
+#   without holding the whole slide in memory.
+#
+#   The pyramid of a Slide is stored in its own directory, named after the
+#   path, size and modification time of the image:
+#       <directory>/<key>/pyramid.json
+#       <directory>/<key>/<level>/<column>_<row>.png
+#   pyramid.json is written last and marks a complete pyramid.
+#
+#   Pyramids are built on the threads of PreviewEngine, and each build holds
+#   a decoded full-resolution image, so only a few pyramids are built at once
+#   whatever the number of threads. As with PreviewCache, the total size of 
+#   the pyramids is capped, and the least recently used pyramids are removed 
+#   first. Loading a pyramid marks it as recently used. Pyramids are only 
+#   evicted when a project is opened or closed (see mainwindow.py), and never
+#   those of the Slides of that project, as the tiles of the open project are
+#   read while it is displayed.
+#
+################################################################################
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+from previewcache import *
+
+class SlidePyramid():
+    # Default width and height of a tile in pixels.
+    tile_size = 512
+
+    # Number of pyramids built at once. Change this variable to limit the 
+    # memory used by building pyramids, as each build holds a full-resolution
+    # image and its first level.
+    builders = 2
+
+    # Default size limit of all the pyramids of a directory in bytes.
+    size_limit = PreviewCache.size_limit
+
+    # _slots limits the number of builds, and _building holds the directories
+    # of the pyramids being built, which are never evicted. Both are guarded
+    # by _lock.
+    _lock = threading.Lock()
+    _slots = None
+    _building = set()
+
+    def __init__(self, directory, path, tile_size = 0):
+        self.path = path
+        self.tile_size = tile_size if tile_size > 0 else SlidePyramid.tile_size
+
+        # width and height of the full-resolution image.
+        self.width = 0
+        self.height = 0
+
+        # levels should be a list of (width, height) for each level.
+        self.levels = []
+
+        self._directory = os.path.join(directory, \
+                                       SlidePyramid._get_key(path))
+        self.load()
+
+    """
+    Load the description of the pyramid if it has been built.
+    @return True (pyramid exists) / False (pyramid needs to be built).
+    """
+    def load(self):
+        try:
+            with open(os.path.join(self._directory, "pyramid.json"), "r") \
+                as file:
+                pyramid = json.load(file)
+        except (OSError, ValueError):
+            return False
+        if pyramid["tile_size"] != self.tile_size:
+            return False
+
+        self.width = pyramid["width"]
+        self.height = pyramid["height"]
+        self.levels = [tuple(level) for level in pyramid["levels"]]
+
+        # Touching the file marks the pyramid as recently used.
+        try:
+            os.utime(os.path.join(self._directory, "pyramid.json"))
+        except OSError:
+            pass
+        return True
+
+    """
+    Check whether the pyramid has been built.
+    @return True (built) / False (not built).
+    """
+    def exists(self):
+        return bool(self.levels)
+
+    """
+    Build the pyramid from the original image.
+    The full-resolution image is decoded once, and each level is scaled from
+    the previous one. The build waits while SlidePyramid.builders pyramids 
+    are being built.
+    @param image: QImage, the decoded original image if already available.
+    @return True (success) / False (the image could not be read or written).
+    """
+    def build(self, image = None):
+        with SlidePyramid._lock:
+            if SlidePyramid._slots is None:
+                SlidePyramid._slots = threading.Semaphore(\
+                    SlidePyramid.builders)
+            slots = SlidePyramid._slots
+
+        with slots:
+            with SlidePyramid._lock:
+                SlidePyramid._building.add(self._directory)
+            try:
+                return self._build(image)
+            finally:
+                with SlidePyramid._lock:
+                    SlidePyramid._building.discard(self._directory)
+
+    """
+    Remove the least recently used pyramids of a directory until they fit in
+    the size limit. Pyramids being built are kept.
+    @param directory: str, the directory holding the pyramids.
+    @param paths: list of str, the paths to the images whose pyramids are 
+        kept.
+    @param size_limit: int, the size limit in bytes, or 0 for the default.
+    """
+    def evict(directory, paths = [], size_limit = 0):
+        if size_limit <= 0:
+            size_limit = SlidePyramid.size_limit
+        kept = set(os.path.join(directory, SlidePyramid._get_key(path)) \
+                   for path in paths)
+        with SlidePyramid._lock:
+            entries = [entry for entry in SlidePyramid._get_entries(directory) \
+                       if entry[0] not in SlidePyramid._building and \
+                       entry[0] not in kept]
+            PreviewCache.remove_least_used(entries, size_limit, \
+                                           SlidePyramid._remove_directory)
+
+    """
+    Decode the image if needed and write the pyramid.
+    @param image: QImage, the decoded original image, or None.
+    @return True (success) / False (the image could not be read or written).
+    """
+    def _build(self, image):
+        if image is None:
+            image = QImage(self.path)
+        if image.isNull():
+            return False
+
+        shutil.rmtree(self._directory, ignore_errors = True)
+        width = image.width()
+        height = image.height()
+        levels = []
+
+        # size is the total size of the tiles, recorded for eviction.
+        size = 0
+        try:
+            level = 0
+            while True:
+                levels.append((image.width(), image.height()))
+                size += self._write_level(image, level)
+                if max(image.width(), image.height()) <= self.tile_size:
+                    break
+                image = image.scaled(\
+                    max(1, math.ceil(image.width() / 2)), \
+                    max(1, math.ceil(image.height() / 2)), \
+                    Qt.AspectRatioMode.IgnoreAspectRatio, \
+                    Qt.TransformationMode.SmoothTransformation)
+                level += 1
+
+            pyramid = {
+                "width": width,
+                "height": height,
+                "tile_size": self.tile_size,
+                "levels": levels,
+                "size": size,
+            }
+            with open(os.path.join(self._directory, "pyramid.json"), "w") \
+                as file:
+                json.dump(pyramid, file)
+        except OSError:
+            shutil.rmtree(self._directory, ignore_errors = True)
+            return False
+
+        self.width = width
+        self.height = height
+        self.levels = levels
+        return True
+
+    """
+    Get the level best suited to display the image at a given scale, i.e.
+    the smallest level that still has at least as many pixels as displayed.
+    @param scale: float, the displayed size relative to the full resolution.
+    @return int, the index of the level.
+    """
+    def get_level(self, scale):
+        if scale <= 0 or not self.levels:
+            return 0
+        level = int(math.floor(math.log2(1 / scale))) if scale < 1 else 0
+        return max(0, min(level, len(self.levels) - 1))
+
+    """
+    Get the factor between a level and the full resolution.
+    @param level: int, the index of the level.
+    @return (float, float), the horizontal and vertical factors.
+    """
+    def get_level_scale(self, level):
+        return self.width / self.levels[level][0], \
+            self.height / self.levels[level][1]
+
+    """
+    Get the number of tiles of a level.
+    @param level: int, the index of the level.
+    @return (int, int), the number of columns and rows.
+    """
+    def get_tile_count(self, level):
+        return math.ceil(self.levels[level][0] / self.tile_size), \
+            math.ceil(self.levels[level][1] / self.tile_size)
+
+    """
+    Read a tile.
+    @param level: int, the index of the level.
+    @param column: int, the column of the tile.
+    @param row: int, the row of the tile.
+    @return QImage, the tile (null if unavailable).
+    """
+    def get_tile(self, level, column, row):
+        return QImage(self._get_tile_path(level, column, row))
+
+    """
+    Remove the pyramid from the disk.
+    """
+    def remove(self):
+        shutil.rmtree(self._directory, ignore_errors = True)
+        self.levels = []
+
+    """
+    Get the name of the directory of the pyramid of an image.
+    @param path: str, the path to the image.
+    @return str, the key of the pyramid.
+    """
+    def _get_key(path):
+        try:
+            stat = os.stat(path)
+            identity = "%s|%d|%d" %(os.path.abspath(path), \
+                                    stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            identity = os.path.abspath(path)
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    """
+    Remove the directory of a pyramid. pyramid.json is removed first, so 
+    that a partly removed pyramid is never taken as complete.
+    @param path: str, the directory of the pyramid.
+    """
+    def _remove_directory(path):
+        try:
+            os.remove(os.path.join(path, "pyramid.json"))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(path)
+
+    """
+    Get the pyramids of a directory.
+    @param directory: str, the directory holding the pyramids.
+    @return list of (str, float, int), the path, time of last use and size 
+        of every pyramid.
+    """
+    def _get_entries(directory):
+        entries = []
+        try:
+            with os.scandir(directory) as iterator:
+                paths = [entry.path for entry in iterator if entry.is_dir()]
+        except OSError:
+            return entries
+
+        for path in paths:
+            try:
+                with open(os.path.join(path, "pyramid.json"), "r") as file:
+                    size = int(json.load(file)["size"])
+                used = os.stat(os.path.join(path, "pyramid.json")).st_mtime
+            except (OSError, ValueError, KeyError, TypeError):
+                # Incomplete pyramids, and those written before their size 
+                # was recorded, are measured.
+                size = 0
+                for root, _, files in os.walk(path):
+                    for name in files:
+                        try:
+                            size += os.path.getsize(os.path.join(root, name))
+                        except OSError:
+                            pass
+                try:
+                    used = os.stat(path).st_mtime
+                except OSError:
+                    continue
+            entries.append((path, used, size))
+        return entries
+
+    """
+    Get the path to a tile.
+    @param level: int, the index of the level.
+    @param column: int, the column of the tile.
+    @param row: int, the row of the tile.
+    @return str, the path of the tile.
+    """
+    def _get_tile_path(self, level, column, row):
+        return os.path.join(self._directory, str(level), \
+                            "%d_%d.png" %(column, row))
+
+    """
+    Cut a level into tiles and write them.
+    @param image: QImage, the image of the level.
+    @param level: int, the index of the level.
+    @return int, the size of the tiles in bytes.
+    """
+    def _write_level(self, image, level):
+        os.makedirs(os.path.join(self._directory, str(level)), exist_ok = True)
+        columns = math.ceil(image.width() / self.tile_size)
+        rows = math.ceil(image.height() / self.tile_size)
+
+        size = 0
+        for row in range(rows):
+            for column in range(columns):
+                tile = image.copy(column * self.tile_size, \
+                                  row * self.tile_size, \
+                                  min(self.tile_size, \
+                                      image.width() - column * self.tile_size), \
+                                  min(self.tile_size, \
+                                      image.height() - row * self.tile_size))
+
+                path = self._get_tile_path(level, column, row)
+                if not tile.save(path, "PNG", PreviewCache.png_quality):
+                    raise OSError("Failed to write tile.")
+                size += os.path.getsize(path)
+        return size
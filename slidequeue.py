@@ -27,6 +27,9 @@ from project import *
 class SlideQueue(QScrollArea):
     project_edited = pyqtSignal()
 
+    # Emitted with each change of the slides, see autosave.py.
+    edit_recorded = pyqtSignal(object)
+
     def __init__(self, project):
         super().__init__()
 
@@ -81,12 +84,14 @@ class SlideQueue(QScrollArea):
         # Checking if the order has been changed. If so, emit updated signal.
         # First, simply check if the length of Slides are different.
         if len(temp_slides) != len(self._project.slides):
+            self.edit_recorded.emit({"op": "slides"})
             self.project_edited.emit()
             return
         
         # If the lengths are the same, check each Slide and emit signal.
         for i in range(len(temp_slides)):
             if temp_slides[i].path != self._project.slides[i].path:
+                self.edit_recorded.emit({"op": "slides"})
                 self.project_edited.emit()
                 return
 
@@ -97,7 +102,9 @@ class SlideQueue(QScrollArea):
     @param index: int, the index of the Slide removed.
     """
     def remove_slide(self, index):
-        self._project.slides.pop(index)
+        slide = self._project.slides.pop(index)
+        self.edit_recorded.emit({"op": "remove_slide", "slide": slide, \
+                                 "index": index})
         self.project_edited.emit()
 
     """
@@ -11,8 +11,20 @@
 #   Selections can be moved by pressing on the selection and dragging.
 #   Selections can be removed by right clicking on the selection.
 #
+#   While the preview of a Slide is being loaded, its icon is stretched over 
+#   the area of the preview as a placeholder.
+#
+#   In tiled mode, a Slide with a tile pyramid is displayed as tiles in 
+#   full-resolution scene coordinates. Only the tiles of the level nearest to 
+#   the current zoom that cover the viewport are loaded; tiles leaving the 
+#   viewport are removed from the scene. The coarsest level stays below the 
+#   tiles as a backdrop while panning. If the tiles of a pyramid cannot be 
+#   read anymore, the Slide is displayed from its preview instead.
+#
 ################################################################################
 
+import math
+
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
@@ -28,6 +40,13 @@ from project import *
 class SlideViewer(QGraphicsView):
     project_edited = pyqtSignal()
 
+    # Emitted with each edit of the selections, see autosave.py.
+    edit_recorded = pyqtSignal(object)
+
+    # Emitted with the displayed Slide when its tiles cannot be read, once it
+    # has been set to be displayed from its preview.
+    pyramid_missing = pyqtSignal(object)
+
     def __init__(self, parent, color = QColor(255, 0, 0)):
         # Change this variable to adjust the speed of zooming.
         # This variable should always be larger than 1.
@@ -45,6 +64,14 @@ class SlideViewer(QGraphicsView):
         # This is the variable for calculating the real coordinates when 
         # clicked.
         self._coordinates_transform = 1
+        self._preview_transform = 1
+        self._resolution = 1
+
+        # Variables for the tiled mode.
+        # _tiles maps (level, column, row) to the QGraphicsPixmapItem shown.
+        self._tiled = False
+        self._pyramid = None
+        self._tiles = {}
 
         self._color = color
         self._selection_width = 2
@@ -56,6 +83,7 @@ class SlideViewer(QGraphicsView):
         self._image = QGraphicsPixmapItem()
         self._image.setShapeMode(
             QGraphicsPixmapItem.ShapeMode.BoundingRectShape)
+        self._image.setZValue(-2)
         self._scene = QGraphicsScene(self)
         self._scene.addItem(self._image)
 
@@ -103,7 +131,25 @@ class SlideViewer(QGraphicsView):
     @param resolution: float, resolution of the preview (1, 0.5, 0.25, or 0.1).
     """
     def set_resolution(self, resolution):
-        self._coordinates_transform = int(1 / resolution)
+        self._resolution = resolution
+        self._preview_transform = int(1 / resolution)
+        self._coordinates_transform = self._preview_transform
+
+    """
+    Sets whether Slides with a tile pyramid are displayed in tiled mode.
+    @param tiled: bool, True to use the tiled mode when possible.
+    """
+    def set_tiled(self, tiled):
+        self._tiled = tiled
+
+    """
+    Check whether a Slide is displayed in tiled mode.
+    @param slide: Slide object.
+    @return True (tiled mode) / False (preview).
+    """
+    def uses_tiles(self, slide):
+        return self._tiled and slide.pyramid is not None and \
+            slide.pyramid.exists()
 
     """
     Sets the selection size for the next selection added.
@@ -122,8 +168,112 @@ class SlideViewer(QGraphicsView):
     """
     def set_slide(self, slide):
         self._slide = slide
-        self.set_photo(self._slide.preview)
+        self.clear_tiles()
+        if self.uses_tiles(slide):
+            # Scene coordinates are full-resolution pixels in tiled mode, and 
+            # the coarsest level is stretched over the whole image.
+            self._pyramid = slide.pyramid
+            self._coordinates_transform = 1
+            level = len(self._pyramid.levels) - 1
+            scale_x, scale_y = self._pyramid.get_level_scale(level)
+            backdrop = self._pyramid.get_tile(level, 0, 0)
+            if backdrop.isNull():
+                self._drop_pyramid()
+                return
+            self._image.setTransform(QTransform.fromScale(scale_x, scale_y))
+            self.set_photo(QPixmap.fromImage(backdrop))
+        elif slide.preview is None or \
+            slide.preview_resolution != self._resolution:
+            # The icon stands in for the preview until it has been loaded.
+            self._pyramid = None
+            self._coordinates_transform = self._preview_transform
+            if slide.icon and not slide.icon.isNull() and slide.width:
+                self._image.setTransform(QTransform.fromScale(\
+                    math.ceil(slide.width * self._resolution) / \
+                    slide.icon.width(), \
+                    math.ceil(slide.height * self._resolution) / \
+                    slide.icon.height()))
+                self.set_photo(slide.icon)
+            else:
+                self._image.setTransform(QTransform())
+                self.set_photo(None)
+        else:
+            self._pyramid = None
+            self._coordinates_transform = self._preview_transform
+            self._image.setTransform(QTransform())
+            self.set_photo(self._slide.preview)
         self.set_selections(self._slide.selections)
+        self.update_tiles()
+
+    """
+    Load the tiles covering the viewport at the level nearest to the current 
+    zoom, and remove the tiles that are no longer needed.
+    """
+    def update_tiles(self):
+        if not self._pyramid or not self.has_photo():
+            return
+
+        visible = self.mapToScene(self.viewport().rect()).boundingRect()
+        visible = visible.intersected(self._image.sceneBoundingRect())
+        if visible.isEmpty():
+            self.clear_tiles()
+            return
+
+        # The horizontal scale of the view is the number of screen pixels per 
+        # full-resolution pixel.
+        level = self._pyramid.get_level(self.transform().m11())
+        scale_x, scale_y = self._pyramid.get_level_scale(level)
+        columns, rows = self._pyramid.get_tile_count(level)
+        tile_width = self._pyramid.tile_size * scale_x
+        tile_height = self._pyramid.tile_size * scale_y
+
+        needed = set()
+        for row in range(max(0, int(visible.top() // tile_height)), \
+                         min(rows, int(visible.bottom() // tile_height) + 1)):
+            for column in range(max(0, int(visible.left() // tile_width)), \
+                                min(columns, \
+                                    int(visible.right() // tile_width) + 1)):
+                needed.add((level, column, row))
+
+        # Evicting tiles that are off screen or of another level.
+        for key in list(self._tiles):
+            if key not in needed:
+                self._scene.removeItem(self._tiles.pop(key))
+
+        for key in needed:
+            if key in self._tiles:
+                continue
+            image = self._pyramid.get_tile(*key)
+            if image.isNull():
+                self._drop_pyramid()
+                return
+            tile = QGraphicsPixmapItem(QPixmap.fromImage(image))
+            tile.setTransformationMode(\
+                Qt.TransformationMode.SmoothTransformation)
+            tile.setAcceptedMouseButtons(Qt.MouseButton.NoButton)
+            tile.setTransform(QTransform.fromScale(scale_x, scale_y))
+            tile.setPos(key[1] * tile_width, key[2] * tile_height)
+            tile.setZValue(-1)
+            self._scene.addItem(tile)
+            self._tiles[key] = tile
+
+    """
+    Display the Slide from its preview, as the tiles of its pyramid cannot be
+    read anymore (the pyramid was removed from the disk).
+    """
+    def _drop_pyramid(self):
+        slide = self._slide
+        slide.pyramid = None
+        self.set_slide(slide)
+        self.pyramid_missing.emit(slide)
+
+    """
+    Remove all tiles from the scene.
+    """
+    def clear_tiles(self):
+        for tile in self._tiles.values():
+            self._scene.removeItem(tile)
+        self._tiles = {}
 
     """
     Draw a given SlideSelection onto the SlideViewer.
@@ -181,6 +331,8 @@ class SlideViewer(QGraphicsView):
         x *= self._coordinates_transform
         y *= self._coordinates_transform
         self._selections[index - 1].center_coordinates = (x, y)
+        self.edit_recorded.emit({"op": "move", "slide": self._slide, \
+                                 "index": index - 1})
         self.project_edited.emit()
 
     """
@@ -193,6 +345,8 @@ class SlideViewer(QGraphicsView):
         self._scene.removeItem(indexed_rectangle)
         for i in range(len(self._indexed_rectangles)):
             self._indexed_rectangles[i].set_index(i + 1)
+        self.edit_recorded.emit({"op": "remove", "slide": self._slide, \
+                                 "index": index - 1})
         self.project_edited.emit()
 
     ############################################################################
@@ -204,7 +358,9 @@ class SlideViewer(QGraphicsView):
         return not self._empty
 
     def reset_view(self, scale = 1):
-        rect = QRectF(self._image.pixmap().rect())
+        # The bounding rectangle in the scene also covers the stretched 
+        # backdrop in tiled mode.
+        rect = self._image.sceneBoundingRect()
         if not rect.isNull():
             # Weirdly, calling setSceneRect() on QGraphicsView doesn't change 
             # the rect of the QGraphicsScene. Therefore, both calls below are 
@@ -222,6 +378,7 @@ class SlideViewer(QGraphicsView):
                 factor = min(viewrect.width() / scenerect.width(),
                              viewrect.height() / scenerect.height()) * scale
                 self.scale(factor, factor)
+                self.update_tiles()
 
     def set_photo(self, pixmap = None):
         if pixmap and not pixmap.isNull():
@@ -246,6 +403,7 @@ class SlideViewer(QGraphicsView):
                 else:
                     factor = 1 / self._scale_factor ** abs(step)
                 self.scale(factor, factor)
+                self.update_tiles()
             else:
                 self.reset_view()
 
@@ -302,6 +460,8 @@ class SlideViewer(QGraphicsView):
             self.draw_selection(selection, len(self._selections) + 1)
             self._selections.append(selection)
 
+            self.edit_recorded.emit({"op": "select", "slide": self._slide, \
+                                     "index": len(self._selections) - 1})
             self.project_edited.emit()
         else:
             super().mousePressEvent(event)
@@ -326,6 +486,11 @@ class SlideViewer(QGraphicsView):
             # cursor shape.         
             super().mouseMoveEvent(event)
 
+    def scrollContentsBy(self, dx, dy):
+        # Panning reveals new regions of the image in tiled mode.
+        super().scrollContentsBy(dx, dy)
+        self.update_tiles()
+
     def resizeEvent(self, event):
         # This function is also written by ekhumoro. THANK YOU.
         super().resizeEvent(event)
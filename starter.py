@@ -17,6 +17,7 @@ from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
 from dialog import *
+from previewengine import *
 from project import *
 from projectverifier import *
 
@@ -25,11 +26,12 @@ BASEDIR = os.path.dirname(__file__)
 class Starter(QWidget):
     continue_clicked = pyqtSignal(Project)
 
-    def __init__(self, parent, resolution, color):
+    def __init__(self, parent, resolution, color, tiled = False):
         super().__init__(parent)
         self._project = None
         self._resolution = resolution
         self._color = color
+        self._tiled = tiled
 
         self._layout = self._get_starter()
         self.setLayout(self._layout)
@@ -55,6 +57,13 @@ class Starter(QWidget):
     def get_color(self):
         return self._color
 
+    """
+    Get whether tile pyramids are built for the tiled viewer.
+    @return bool, the current tiled viewer setting.
+    """
+    def get_tiled(self):
+        return self._tiled
+
     """
     Return a QVBoxLayout that is the start up screen.
     @return QLayout, the requeted layout.
@@ -342,16 +351,15 @@ class Starter(QWidget):
         dialog = QFileDialog()
         filename, _ = dialog.getOpenFileName(\
             caption = "Select a project file", \
-            filter = "SCP File (*.scp)")
+            filter = Project.FILE_FILTER)
 
         if filename:
             if not self._project:
                 self._project = Project()
-            self._project.load_json(filename)
-
-            # Verifying that all paths in the Project exist.
+            # Verifying that all paths in the Project exist while it is 
+            # loaded.
             verifier = ProjectVerifier(self._project)
-            if verifier.verify():
+            if verifier.verify(self._project.iter_load(filename)):
                 # Setting up the dialog and the worker thread.
                 self.dialog = ProgressDialog("Loading", \
                                              len(self._project.slides))
@@ -359,7 +367,8 @@ class Starter(QWidget):
                 self.preview_thread = QThread()
                 self.preview_thread.finished.connect(\
                     self.preview_thread.deleteLater)
-                self.worker = PreviewWorker(self._project, self._resolution)
+                self.worker = PreviewWorker(self._project, self._resolution, \
+                                            tiled = self._tiled)
                 self.worker.progress.connect(self.dialog.update)
                 self.worker.finished.connect(self.dialog.accept)
                 self.worker.finished.connect(self.preview_thread.quit)
@@ -386,7 +395,7 @@ class Starter(QWidget):
     """
     def settings_button_clicked(self):
         settings_edit_dialog = SettingsEditDialog(self._resolution, \
-                                                  self._color)
+                                                  self._color, self._tiled)
         settings_edit_dialog.settings_changed.connect(\
             self.settings_changed_handler)
         settings_edit_dialog.exec()
@@ -394,9 +403,10 @@ class Starter(QWidget):
     """
     Handler for when the program's settings are changed.
     """ 
-    def settings_changed_handler(self, resolution, color):
+    def settings_changed_handler(self, resolution, color, tiled):
         self._resolution = resolution
         self._color = color
+        self._tiled = tiled
 
     """
     Handler for when the user clicks the button that shows the application's 
@@ -407,18 +417,21 @@ class Starter(QWidget):
         info_dialog.exec()
 
 class PreviewWorker(QObject):
-    # PreviewWorker is a worker class for generating previews.
+    # PreviewWorker is a worker class for generating the icons of a project.
     # This step is generally slow on larger images, which is why this task is 
     # separated to prevent freezing the GUI.
 
     progress = pyqtSignal(int)
     finished = pyqtSignal()
     
-    def __init__(self, project, resolution):
+    def __init__(self, project, resolution, workers = 0, tiled = False):
         super().__init__()
         self.slides = []
         self.set_project(project)
         self._resolution = resolution
+        # Only icons are shown in Step1. Previews are loaded on demand in Step2.
+        self._engine = PreviewEngine(resolution, workers, tiled, \
+                                     previews = False)
 
         # 0: Continue processing.
         # 1: Stop.
@@ -435,13 +448,7 @@ class PreviewWorker(QObject):
     Execute the worker.
     """
     def run(self):
-        for i in range(len(self.project.slides)):
-            if not self.status:
-                self.project.slides[i].generate_preview(self._resolution)
-                self.progress.emit(i + 1)
-            else:
-                self.progress.emit(i + 1)
-                continue
+        self.slides = self._engine.run(self.project.slides, self.progress.emit)
         self.finished.emit()
 
     """
@@ -449,3 +456,4 @@ class PreviewWorker(QObject):
     """
     def stop(self):
         self.status = 1
+        self._engine.stop()
@@ -6,6 +6,8 @@
 #   Date: 2024-06-18
 #
 #   Step1 is a QWidget that contains all elements of the Step1 screen.
+#   Added Slides appear in the SlideQueue one by one as their icons are 
+#   generated, so the user can keep working while a large batch loads.
 #
 ################################################################################
 
@@ -16,6 +18,7 @@ from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 from PyQt6.QtWidgets import *
 
+from previewengine import *
 from stepheader import *
 from slidequeue import *
 
@@ -26,11 +29,18 @@ class Step1(QWidget):
     project_edited = pyqtSignal()
     returned = pyqtSignal()
 
-    def __init__(self, parent, project, resolution):
+    # Forwards the edits of the header and the SlideQueue, see autosave.py.
+    edit_recorded = pyqtSignal(object)
+
+    def __init__(self, parent, project, resolution, tiled = False):
         super().__init__(parent)
         self._project = project
         self._slide_queue = None
         self._resolution = resolution
+        self._tiled = tiled
+
+        # Whether Slides are currently being added.
+        self._adding = False
 
         self._layout = self._get_step_1()
         self.setLayout(self._layout)
@@ -50,6 +60,13 @@ class Step1(QWidget):
     def set_resolution(self, resolution):
         self._resolution = resolution
 
+    """
+    Set whether tile pyramids are built for the added Slides.
+    @param tiled: bool, True to build tile pyramids.
+    """
+    def set_tiled(self, tiled):
+        self._tiled = tiled
+
     """
     Update the project title and the slides.
     Note that this function is always called by MainWindow when returning to 
@@ -67,6 +84,7 @@ class Step1(QWidget):
     def _get_step_1(self):
         self._header = StepHeader(self, self._project, 1)
         self._header.project_edited.connect(self.project_edited_emit)
+        self._header.edit_recorded.connect(self.edit_recorded_emit)
         self._header.returned.connect(self.returned_handler)
         main_layout = self._get_step_1_main()
         footer_layout = self._get_step_1_footer()
@@ -90,20 +108,22 @@ class Step1(QWidget):
     def _get_step_1_main(self):
         self._slide_queue = SlideQueue(self._project)
         self._slide_queue.project_edited.connect(self.project_edited_emit)
+        self._slide_queue.edit_recorded.connect(self.edit_recorded_emit)
         self._slide_queue.add_slides(self._project.slides)
 
-        add_button = QPushButton(text = " Add Slides")
+        self._add_button = QPushButton(text = " Add Slides")
         if darkdetect.isDark():
-            add_button.setIcon(QIcon(os.path.join(BASEDIR, "svg", "dark", \
-                                                  "plus.svg")))
+            self._add_button.setIcon(QIcon(os.path.join(BASEDIR, "svg", \
+                                                        "dark", "plus.svg")))
         else:
-            add_button.setIcon(QIcon(os.path.join(BASEDIR, "svg", "plus.svg")))
-        add_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
-        add_button.clicked.connect(self.add_button_clicked)
+            self._add_button.setIcon(QIcon(os.path.join(BASEDIR, "svg", \
+                                                        "plus.svg")))
+        self._add_button.setCursor(QCursor(Qt.CursorShape.PointingHandCursor))
+        self._add_button.clicked.connect(self.add_button_clicked)
 
         add_layout = QHBoxLayout()
         add_layout.addStretch()
-        add_layout.addWidget(add_button)
+        add_layout.addWidget(self._add_button)
         add_layout.addStretch()
 
         main_layout = QVBoxLayout()
@@ -138,34 +158,47 @@ class Step1(QWidget):
 
         if filenames:
             # Setting up the dialog and the worker thread.
+            # The dialog is not modal so that the SlideQueue can be used while
+            # the Slides are being added. Cancelling keeps the added Slides.
             self.dialog = ProgressDialog("Loading", len(filenames))
 
             self.add_thread = QThread()
             self.add_thread.finished.connect(self.add_thread.deleteLater)
-            self.worker = AddWorker(filenames, self._resolution)
+            self.worker = AddWorker(filenames, self._resolution, \
+                                    tiled = self._tiled)
             self.worker.progress.connect(self.dialog.update)
+            self.worker.slide_added.connect(self.slide_added_handler)
             self.worker.finished.connect(self.dialog.accept)
             self.worker.finished.connect(self.add_thread.quit)
             self.worker.finished.connect(self.worker.deleteLater)
+            self.worker.finished.connect(self.add_finished_handler)
             self.dialog.rejected.connect(self.worker.stop)
             self.worker.moveToThread(self.add_thread)
             self.add_thread.started.connect(self.worker.run)
 
+            # Only one batch of Slides is added at a time.
+            self._adding = True
+            self._add_button.setEnabled(False)
+
             self.add_thread.start()
+            self.dialog.show()
+
+    """
+    Handler for when a Slide has been added by the AddWorker.
+    @param slide: Slide object, the added Slide.
+    """
+    def slide_added_handler(self, slide):
+        self._slide_queue.add_slide(slide)
+        self._project.slides.append(slide)
+        self.edit_recorded.emit({"op": "add_slide", "slide": slide})
+        self.project_edited.emit()
 
-            if self.dialog.exec():
-                if not self.add_thread.wait(10000):
-                    self.add_thread.quit()
-                    self.add_thread.wait(10000)
-                self._slide_queue.add_slides(self.worker.slides)
-                self._project.slides += self.worker.slides
-                self.project_edited.emit()
-            else:
-                # If the thread is killed by the user, wait for it to finish.
-                self.add_thread.quit()
-                if not self.add_thread.wait(10000):
-                    self.add_thread.quit()
-                    self.add_thread.wait(10000)
+    """
+    Handler for when the AddWorker has finished or has been stopped.
+    """
+    def add_finished_handler(self):
+        self._adding = False
+        self._add_button.setEnabled(True)
 
     """
     Handler for when the user clicks the "Continue" button.
@@ -180,26 +213,41 @@ class Step1(QWidget):
     def project_edited_emit(self):
         self.project_edited.emit()
 
+    """
+    Handler for when an edit of the Project has been recorded.
+    @param edit: dict, the edit.
+    """
+    def edit_recorded_emit(self, edit):
+        self.edit_recorded.emit(edit)
+
     """
     Handler for when the return procedure is completed and the program should 
     return to the starter.
     """
     def returned_handler(self):
+        # Slides still being added no longer belong to an opened project.
+        if self._adding:
+            self.worker.slide_added.disconnect(self.slide_added_handler)
+            self.dialog.reject()
         self.returned.emit()
 
 class AddWorker(QObject):
-    # AddWorker is a worker class for adding slides and generating previews.
+    # AddWorker is a worker class for adding slides and generating icons.
     # This step is generally slow on larger images, which is why this task is 
     # separated to prevent freezing the GUI.
 
     progress = pyqtSignal(int)
+    slide_added = pyqtSignal(object)
     finished = pyqtSignal()
     
-    def __init__(self, filenames, resolution):
+    def __init__(self, filenames, resolution, workers = 0, tiled = False):
         super().__init__()
         self.slides = []
         self.set_files(filenames)
         self._resolution = resolution
+        # Only icons are shown in Step1. Previews are loaded on demand in Step2.
+        self._engine = PreviewEngine(resolution, workers, tiled, \
+                                     previews = False)
     
         # 0: Continue processing.
         # 1: Stop.
@@ -216,15 +264,9 @@ class AddWorker(QObject):
     Execute the worker.
     """
     def run(self):
-        self.slides = []
-        for i in range(len(self.filenames)):
-            if not self.status:
-                self.slides.append(Slide(self.filenames[i]))
-                self.slides[-1].generate_preview(self._resolution)
-                self.progress.emit(i + 1)
-            else:
-                self.progress.emit(i + 1)
-                continue
+        slides = [Slide(filename) for filename in self.filenames]
+        self.slides = self._engine.run(slides, self.progress.emit, \
+                                       self.slide_added.emit)
         self.finished.emit()
 
     """
@@ -232,3 +274,4 @@ class AddWorker(QObject):
     """
     def stop(self):
         self.status = 1
+        self._engine.stop()
@@ -18,6 +18,9 @@ from PyQt6.QtWidgets import *
 
 from access import *
 from dialog import *
+from exportengine import *
+from previewloader import *
+from previewmemory import *
 from slideviewer import *
 from stepheader import *
 
@@ -28,13 +31,24 @@ class Step2(QWidget):
     project_edited = pyqtSignal()
     returned = pyqtSignal()
 
-    def __init__(self, parent, project, color, resolution):
+    # Forwards the edits of the header and the SlideViewer, see autosave.py.
+    edit_recorded = pyqtSignal(object)
+
+    def __init__(self, parent, project, color, resolution, tiled = False):
         super().__init__(parent)
         self._project = project
         self._selection_width = project.width
         self._selection_height = project.height
         self._color = color
         self._resolution = resolution
+        self._tiled = tiled
+
+        # Previews are loaded on demand for the Slide being displayed.
+        self._preview_loader = PreviewLoader(resolution)
+        self._preview_loader.preview_ready.connect(self.preview_ready_handler)
+
+        # Previews held in memory are kept within a budget.
+        self._preview_memory = PreviewMemory()
 
         self._layout = self._get_step_2(self._project.work_index)
         self.setLayout(self._layout)
@@ -60,6 +74,14 @@ class Step2(QWidget):
     """
     def set_resolution(self, resolution):
         self._resolution = resolution
+        self._preview_loader.set_resolution(resolution)
+
+    """
+    Set whether Slides with tile pyramids are displayed in tiled mode.
+    @param tiled: bool, True to use the tiled viewer.
+    """
+    def set_tiled(self, tiled):
+        self._tiled = tiled
 
     """
     Set the selection size.
@@ -78,6 +100,7 @@ class Step2(QWidget):
     def _get_step_2(self, index):
         self._header = StepHeader(self, self._project, 2)
         self._header.project_edited.connect(self.project_edited_handler)
+        self._header.edit_recorded.connect(self.edit_recorded_handler)
         self._header.returned.connect(self.returned_handler)
         main_layout = self._get_step_2_main(index)
         footer_layout = self._get_step_2_footer(index)
@@ -102,6 +125,7 @@ class Step2(QWidget):
     def _get_step_2_main(self, index):
         self._slide_viewer = SlideViewer(self, self._color)
         self._slide_viewer.set_resolution(self._resolution)
+        self._slide_viewer.set_tiled(self._tiled)
         self._slide_viewer.set_selection_size(self._project.width, \
                                               self._project.height)
         self._image_index_label = QLabel()
@@ -110,6 +134,7 @@ class Step2(QWidget):
         self._image_size_label = QLabel()
         self._image_selection_label = QLabel()
         self._image_selection_size_label = QLabel()
+        self._memory_label = QLabel()
         image_selection_size_button = QPushButton(text = "Edit")
         image_selection_size_button.setCursor(\
             QCursor(Qt.CursorShape.PointingHandCursor))
@@ -131,6 +156,7 @@ class Step2(QWidget):
         main_sublayout.addWidget(self._image_selection_label)
         main_sublayout.addLayout(main_selection_size_layout)
         main_sublayout.addStretch()
+        main_sublayout.addWidget(self._memory_label)
 
         main_sublayout_widget = QWidget()
         main_sublayout_widget.setFixedWidth(300)
@@ -140,8 +166,11 @@ class Step2(QWidget):
         main_layout.addWidget(self._slide_viewer)
         main_layout.addWidget(main_sublayout_widget)
 
+        self._slide_viewer.pyramid_missing.connect(\
+            self.pyramid_missing_handler)
         self._update_step_2_main(index)
         self._slide_viewer.project_edited.connect(self.project_edited_handler)
+        self._slide_viewer.edit_recorded.connect(self.edit_recorded_handler)
 
         return main_layout
 
@@ -152,7 +181,22 @@ class Step2(QWidget):
     """
     def _update_step_2_main(self, index):
         slide = self._project.slides[index - 1]
+
+        # A placeholder is displayed until the preview has been loaded.
+        # The previews of the neighbouring Slides are prefetched.
+        neighbours = [self._project.slides[i] for i in \
+                      self._preview_loader.get_prefetch_indices(\
+                          index - 1, len(self._project.slides))]
+        neighbours = [temp_slide for temp_slide in neighbours \
+                      if not self._slide_viewer.uses_tiles(temp_slide)]
+        if not self._slide_viewer.uses_tiles(slide):
+            self._preview_loader.request(slide, neighbours)
+        else:
+            self._preview_loader.request(None, neighbours)
         self._slide_viewer.set_slide(slide)
+        self._preview_memory.touch(slide)
+        self._preview_memory.evict([slide] + neighbours)
+        self.update_memory_label()
         self._image_index_label.setText("%d / %d" \
                                         %(index, len(self._project.slides)))
         self._image_title_label.setText(slide.file_name)
@@ -256,6 +300,7 @@ class Step2(QWidget):
                                               self._selection_height)
         self._slide_viewer.set_color(self._color)
         self._slide_viewer.set_resolution(self._resolution)
+        self._slide_viewer.set_tiled(self._tiled)
         self._header.update_title()
         self._update_step_2_main(self._project.work_index)
         self._update_step_2_footer(self._project.work_index)
@@ -270,6 +315,16 @@ class Step2(QWidget):
                                             selections), \
                                             self._project.selection))
     
+    """
+    Update the label displaying the memory held by previews and icons.
+    """
+    def update_memory_label(self):
+        self._memory_label.setText(\
+            "Previews: %.1f / %.0f MB\nIcons: %.1f MB" \
+            %(self._preview_memory.get_preview_bytes() / 1024 ** 2, \
+              self._preview_memory.budget / 1024 ** 2, \
+              PreviewMemory.get_icon_bytes(self._project.slides) / 1024 ** 2))
+
     """
     Update the label displaying the selection size.
     """
@@ -302,6 +357,8 @@ class Step2(QWidget):
         self._selection_height = height
         self._slide_viewer.set_selection_size(width, height)
         self.update()
+        self.edit_recorded.emit({"op": "resize", "width": width, \
+                                 "height": height})
         self.project_edited.emit()
 
     """
@@ -325,7 +382,9 @@ class Step2(QWidget):
             self.export_thread = QThread()
             self.export_thread.finished.connect(self.export_thread.deleteLater)
             self.worker = ExportWorker([self._project.slides[\
-                self._project.work_index - 1]], directory)
+                self._project.work_index - 1]], directory, \
+                settings = self._project.export_settings, \
+                current = self._project.slides)
             self.worker.progress.connect(self.dialog.update)
             self.worker.finished.connect(self.dialog.accept)
             self.worker.finished.connect(self.export_thread.quit)
@@ -371,7 +430,8 @@ class Step2(QWidget):
 
             self.export_thread = QThread()
             self.export_thread.finished.connect(self.export_thread.deleteLater)
-            self.worker = ExportWorker(self._project.slides, directory)
+            self.worker = ExportWorker(self._project.slides, directory, \
+                settings = self._project.export_settings)
             self.worker.progress.connect(self.dialog.update)
             self.worker.finished.connect(self.dialog.accept)
             self.worker.finished.connect(self.export_thread.quit)
@@ -438,13 +498,57 @@ class Step2(QWidget):
         self.project_edited.emit()
         self.update_selection_label()
 
+    """
+    Handler for when an edit of the Project has been recorded.
+    @param edit: dict, the edit.
+    """
+    def edit_recorded_handler(self, edit):
+        self.edit_recorded.emit(edit)
+
+    """
+    Handler for when the tiles of the displayed Slide cannot be read. Its 
+    preview is loaded instead.
+    @param slide: Slide object.
+    """
+    def pyramid_missing_handler(self, slide):
+        self._preview_loader.request(slide)
+
+    """
+    Handler for when the preview of a Slide has been loaded.
+    The SlideViewer is only updated if the Slide is still being displayed.
+    @param slide: Slide object.
+    """
+    def preview_ready_handler(self, slide):
+        index = self._project.work_index - 1
+        if 0 <= index < len(self._project.slides) and \
+            self._project.slides[index] is slide:
+            self._slide_viewer.set_slide(slide)
+            self._preview_memory.touch(slide)
+        else:
+            self._preview_memory.touch(slide, viewed = False)
+
+        # The displayed Slide and the Slides being prefetched are kept.
+        keep = [self._project.slides[i] for i in \
+                [index] + self._preview_loader.get_prefetch_indices(\
+                    index, len(self._project.slides)) \
+                if 0 <= i < len(self._project.slides)]
+        self._preview_memory.evict(keep)
+        self.update_memory_label()
+
     """
     Handler for when the return procedure is completed and the program should 
     return to the starter.
     """
     def returned_handler(self):
+        self.stop_preview_loader()
         self.returned.emit()
 
+    """
+    Stop loading previews, when Step2 is left for good.
+    """
+    def stop_preview_loader(self):
+        self._preview_loader.stop()
+
 class ExportToolButton(QToolButton):
     # The Export button and Export All button is implemented as a QToolButton 
     # in order to achieve the drop-down effect.
@@ -483,17 +587,25 @@ class ExportWorker(QObject):
     # ExportWorker is a worker class for exporting slides.
     # This step is generally slow on larger images, which is why this task is 
     # separated to prevent freezing the GUI.
+    # The Slides themselves are exported on a pool of processes by the 
+    # ExportEngine.
 
     progress = pyqtSignal(int)
     finished = pyqtSignal()
     
-    def __init__(self, slides, directory):
+    def __init__(self, slides, directory, workers = 0, settings = None, \
+                 current = None):
         super().__init__()
         self.failed = []
         self.slides = []
 
+        # current should be all the Slides of the project, when only some of
+        # them are exported, so that the crops of the others are kept.
+        self._current = current
+
         self.set_slides(slides)
         self.set_directory(directory)
+        self._engine = ExportEngine(workers, settings)
 
         # 0: Continue processing.
         # 1: Stop.
@@ -524,14 +636,8 @@ class ExportWorker(QObject):
     Execute the worker.
     """
     def run(self):
-        self.failed = []
-        for i in range(len(self.slides)):
-            if not self.status:
-                self.failed += self.slides[i].save_crops(self.directory)
-                self.progress.emit(i + 1)
-            else:
-                self.progress.emit(i + 1)
-                continue
+        self.failed = self._engine.run(self.slides, self.directory, \
+                                       self.progress.emit, self._current)
         self.finished.emit()
 
     """
@@ -539,3 +645,4 @@ class ExportWorker(QObject):
     """
     def stop(self):
         self.status = 1
+        self._engine.stop()
@@ -16,6 +16,7 @@ import darkdetect
 import os
 
 from access import *
+from autosave import *
 from dialog import *
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
@@ -25,6 +26,9 @@ BASEDIR = os.path.dirname(__file__)
 
 class StepHeader(QWidget):
     project_edited = pyqtSignal()
+
+    # Emitted when the settings of the project are edited, see autosave.py.
+    edit_recorded = pyqtSignal(object)
     returned = pyqtSignal()
 
     def __init__(self, parent, project, step):
@@ -152,7 +156,7 @@ class StepHeader(QWidget):
                 dialog = PermissionErrorDialog()
                 dialog.exec()
                 return False
-            self._project.save_json(self._project.path)
+            AutosaveService.save_project(self._project, self._project.path)
             self.window().setWindowModified(False)
         else:
             self.saveas_button_clicked()
@@ -161,16 +165,17 @@ class StepHeader(QWidget):
     Handler for when the user has clicked the "Save As" button.
     """
     def saveas_button_clicked(self):
-        filename, _ = QFileDialog.getSaveFileName(\
+        filename, selected = QFileDialog.getSaveFileName(\
             caption = "Create a project file", \
-            filter = "SCP File (*.scp)", directory = self._project.name + \
-            ".scp")
+            filter = Project.FILE_FILTER + ";;" + Project.DATABASE_FILTER, \
+            directory = self._project.name + ".scp")
         if filename:
             if Access.check_new_file_write(filename):
                 dialog = PermissionErrorDialog()
                 dialog.exec()
                 return False
-            self._project.save_json(filename)
+            AutosaveService.save_project(self._project, filename, \
+                                         selected == Project.DATABASE_FILTER)
             self.window().setWindowModified(False)
 
     """
@@ -185,5 +190,6 @@ class StepHeader(QWidget):
     with this function.
     """
     def project_edited_handler(self):
+        self.edit_recorded.emit({"op": "project"})
         self.project_edited.emit()
         self.update_title()
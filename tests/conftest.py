@@ -0,0 +1,16 @@
+#!/usr/bin/python
+################################################################################
+#
+#   conftest.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   The modules of the application are imported from the top directory of
+#   the repository, as main.py does.
+#
+################################################################################
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
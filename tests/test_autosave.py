@@ -0,0 +1,200 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_autosave.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests compacting the journal of a Project with AutosaveService.
+#
+################################################################################
+
+import json
+import os
+import time
+
+import pytest
+
+from PyQt6.QtCore import *
+
+from autosave import *
+from project import *
+from projectjournal import *
+
+@pytest.fixture(scope = "module")
+def application():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+"""
+Create a saved project with two slides.
+@param path: str, the path to the project file.
+@param database: bool, whether the project file is an SQLite database.
+@return Project object.
+"""
+def create_project(path, database = False):
+    project = Project()
+    project.name = "Test"
+    project.width = 100
+    project.height = 100
+    for i in range(2):
+        slide = Slide(slide_path = "/slides/slide%d.tif" %i)
+        slide.selections.add(100, 200, 100, 100)
+        project.slides.append(slide)
+    project.save(path, database)
+    return project
+
+"""
+Select an area of the first slide, as Step2 does.
+@param project: Project object.
+@param service: AutosaveService of the Project.
+"""
+def select(project, service):
+    project.slides[0].selections.add(300, 300, 100, 100)
+    project.saved = False
+    service.record({"op": "select", "slide": project.slides[0], \
+                    "index": len(project.slides[0].selections) - 1})
+
+"""
+Compact the journal and wait for the compaction to finish.
+@param service: AutosaveService object.
+"""
+def compact(service):
+    service.compact()
+    deadline = time.time() + 10
+    while service._thread is not None and time.time() < deadline:
+        QCoreApplication.processEvents()
+        time.sleep(0.01)
+    assert service._thread is None
+
+"""
+Load a project file.
+@param path: str, the path to the project file.
+@return Project object.
+"""
+def load(path):
+    project = Project()
+    project.load(path)
+    project.close_database()
+    return project
+
+@pytest.mark.parametrize("database", [False, True])
+def test_compaction_keeps_project_file(tmp_path, application, database):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path, database)
+    service = AutosaveService(project)
+    select(project, service)
+    compact(service)
+
+    # The project file keeps the last save.
+    assert ProjectJournal.read(path) == []
+    assert os.path.exists(ProjectJournal.get_snapshot_path(path))
+    assert not project.saved
+    project.close_database()
+    project.database = None
+    project_file = Project()
+    os.remove(ProjectJournal.get_snapshot_path(path))
+    project_file.load(path)
+    project_file.close_database()
+    assert len(project_file.slides[0].selections) == 1
+
+def test_snapshot_is_loaded(tmp_path, application):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    service = AutosaveService(project)
+    select(project, service)
+    compact(service)
+    select(project, service)
+    service.stop()
+
+    # The snapshot and the journal after it hold every edit.
+    loaded = load(path)
+    assert len(loaded.slides[0].selections) == 3
+    assert not loaded.saved
+
+    # Saving promotes the edits to the project file.
+    loaded.save(path)
+    assert not os.path.exists(ProjectJournal.get_snapshot_path(path))
+    assert len(load(path).slides[0].selections) == 3
+
+def test_discard_returns_to_last_save(tmp_path, application):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    service = AutosaveService(project)
+    select(project, service)
+    compact(service)
+    select(project, service)
+    service.stop()
+    project.discard_edits()
+
+    assert not os.path.exists(ProjectJournal.get_snapshot_path(path))
+    assert not os.path.exists(ProjectJournal.get_path(path))
+    loaded = load(path)
+    assert len(loaded.slides[0].selections) == 1
+    assert loaded.saved
+
+def test_stale_snapshot_is_ignored(tmp_path, application):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    snapshot = project.to_json()
+    snapshot["name"] = "Stale"
+    with open(ProjectJournal.get_snapshot_path(path), "w") as file:
+        json.dump(snapshot, file)
+    os.utime(ProjectJournal.get_snapshot_path(path), (0, 0))
+    assert load(path).name == "Test"
+
+def test_metadata_compacts_project_file(tmp_path, application):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    metadata = SlideMetadata()
+    metadata.width = 400
+    metadata.height = 300
+    project.slides[1].set_metadata(metadata)
+    project.record_edit({"op": "metadata", "slide": 1, \
+                         "path": project.slides[1].path, \
+                         "metadata": metadata.to_dict()})
+
+    # The metadata is not an edit of the user, so it goes to the project 
+    # file.
+    service = AutosaveService(project)
+    compact(service)
+    assert project.saved
+    assert not os.path.exists(ProjectJournal.get_snapshot_path(path))
+    assert load(path).slides[1].metadata.width == 400
+
+def test_save_project(tmp_path, application):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    service = AutosaveService(project)
+    select(project, service)
+    compact(service)
+    select(project, service)
+    service.stop()
+
+    # The file is written by an AutosaveWorker, and holds every edit.
+    AutosaveService.save_project(project, path)
+    assert project.saved
+    assert not os.path.exists(ProjectJournal.get_snapshot_path(path))
+    assert ProjectJournal.read(path) == []
+    assert len(load(path).slides[0].selections) == 3
+
+    # Save As.
+    new_path = str(tmp_path / "new.scp")
+    AutosaveService.save_project(project, new_path, True)
+    assert project.path == new_path
+    assert project.database is not None
+    project.close_database()
+    assert len(load(new_path).slides[0].selections) == 3
+
+def test_save_during_compaction(tmp_path, application):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    service = AutosaveService(project)
+    select(project, service)
+
+    # The snapshot written after the save no longer holds unsaved edits.
+    service.compact()
+    AutosaveService.save_project(project, path)
+    compact(service)
+    assert project.saved
+    assert not os.path.exists(ProjectJournal.get_snapshot_path(path))
+    assert len(load(path).slides[0].selections) == 2
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_exportpipeline.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests saving the crops of Slides with ExportPipeline: the order in which
+#   jobs and crops are handed over, stopping, and failed crops.
+#
+################################################################################
+
+import os
+
+import pytest
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+from exportpipeline import *
+from exportsinks import *
+from project import *
+
+"""
+Create an image with a pattern depending on its number.
+@param number: int, the number of the image.
+@return QImage.
+"""
+def create_image(number):
+    width, height = 120, 90
+    pixels = bytes((x * 3 + y * 5 + number * 40) % 256 \
+                   for y in range(height) for x in range(width * 3))
+    return QImage(pixels, width, height, width * 3, \
+                  QImage.Format.Format_RGB888).copy()
+
+"""
+Create Slides with three selections each, alternating PNG files and TIFF
+files read by regions.
+@param directory: pathlib.Path, the directory of the images.
+@param count: int, the number of Slides.
+@return list of Slide objects.
+"""
+def create_slides(directory, count):
+    slides = []
+    for number in range(count):
+        image = create_image(number)
+        if number % 2:
+            path = str(directory / ("slide%d.tif" %number))
+            with open(path, "wb") as file:
+                file.write(TiffWriter.encode(image))
+        else:
+            path = str(directory / ("slide%d.png" %number))
+            assert image.save(path)
+        slide = Slide(slide_path = path)
+        slide.selections.add(20, 20, 20, 10)
+        slide.selections.add(60, 45, 30, 30)
+        slide.selections.add(110, 80, 20, 20)
+        slides.append(slide)
+    return slides
+
+"""
+Get the temporary files left in a directory.
+@param directory: pathlib.Path, the directory.
+@return list of str, the names of the files.
+"""
+def get_temporary(directory):
+    return [name for name in os.listdir(directory) \
+            if name.startswith(ExportPipeline.TEMPORARY_PREFIX)]
+
+class RecordingSink(ExportSink):
+    # RecordingSink records the calls of the pipeline instead of writing.
+
+    def __init__(self, directory):
+        super().__init__(directory, ExportSettings())
+        self.calls = []
+
+    def add(self, slide, i, name, data):
+        assert data
+        self.calls.append(("add", slide.file_name, i))
+
+    def end(self, slide):
+        self.calls.append(("end", slide.file_name))
+        return []
+
+    def close(self):
+        self.calls.append(("close",))
+        return []
+
+class FailingSettings(ExportSettings):
+    # FailingSettings cannot encode crops 30 pixels wide.
+
+    def encode(self, image):
+        if image.width() == 30:
+            raise ValueError("The crop could not be encoded.")
+        return super().encode(image)
+
+def test_crops_are_written(tmp_path):
+    slides = create_slides(tmp_path, 4)
+    output = tmp_path / "output"
+    output.mkdir()
+    finished = []
+    pipeline = ExportPipeline(str(output), encoders = 3, depth = 2)
+    results = pipeline.run([(slide, None) for slide in slides], \
+                           lambda job, failed: finished.append(job))
+
+    assert results == [[], [], [], []]
+    assert sorted(finished) == [0, 1, 2, 3]
+    assert get_temporary(output) == []
+    for number, slide in enumerate(slides):
+        image = create_image(number)
+        for name, rect in zip(slide.get_crop_names(), \
+                              slide.get_crop_rects()):
+            crop = QImage(str(output / name))
+            assert crop.convertToFormat(image.format()) == image.copy(rect)
+
+def test_sink_order(tmp_path):
+    slides = create_slides(tmp_path, 3)
+    sink = RecordingSink(str(tmp_path))
+    pipeline = ExportPipeline(str(tmp_path), encoders = 4, depth = 1, \
+                              sink = sink)
+    results = pipeline.run([(slides[0], [2, 0]), (slides[1], []), \
+                            (slides[2], None)])
+
+    # Crops are added in the order of the jobs and of their selections,
+    # whatever the order in which they were encoded.
+    assert results == [[], [], []]
+    assert sink.calls == [
+        ("add", "slide0.png", 2), ("add", "slide0.png", 0),
+        ("end", "slide0.png"),
+        ("end", "slide1.tif"),
+        ("add", "slide2.png", 0), ("add", "slide2.png", 1),
+        ("add", "slide2.png", 2), ("end", "slide2.png"),
+        ("close",),
+    ]
+
+def test_stop(tmp_path):
+    slides = create_slides(tmp_path, 6)
+    output = tmp_path / "output"
+    output.mkdir()
+    pipeline = ExportPipeline(str(output), encoders = 1, depth = 1)
+
+    def done(job, failed):
+        pipeline.stop()
+
+    results = pipeline.run([(slide, None) for slide in slides], done)
+
+    # The first job is finished, while the last one is never decoded.
+    assert results[0] == []
+    assert results[-1] is None
+    assert get_temporary(output) == []
+    for slide, result in zip(slides, results):
+        names = slide.get_crop_names()
+        if result is not None:
+            assert all((output / name).exists() for name in names)
+
+def test_failed_crops(tmp_path):
+    slides = create_slides(tmp_path, 2)
+    output = tmp_path / "output"
+    output.mkdir()
+
+    # The last crop of the second Slide cannot replace a directory.
+    (output / slides[1].get_crop_names()[2]).mkdir()
+    pipeline = ExportPipeline(str(output), FailingSettings(), encoders = 2)
+    results = pipeline.run([(slide, None) for slide in slides])
+
+    # Failures are reported in the order of the selections.
+    assert results == [[slides[0].get_crop_names()[1]], \
+                       slides[1].get_crop_names()[1:]]
+    assert get_temporary(output) == []
+    assert (output / slides[0].get_crop_names()[0]).exists()
+    assert not (output / slides[0].get_crop_names()[1]).exists()
+
+def test_error_in_done(tmp_path):
+    slides = create_slides(tmp_path, 3)
+    output = tmp_path / "output"
+    output.mkdir()
+
+    def done(job, failed):
+        raise RuntimeError("done failed")
+
+    # The error stops the pipeline and is raised once every stage is done.
+    pipeline = ExportPipeline(str(output))
+    with pytest.raises(RuntimeError):
+        pipeline.run([(slide, None) for slide in slides], done)
+    assert pipeline.status == 1
+    assert get_temporary(output) == []
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_exportsinks.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests exporting crops into containers with the export sinks: multi-page
+#   TIFF files, ZIP and TAR shards of a limited size, and NumPy stacks.
+#
+################################################################################
+
+import json
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+from exportpipeline import *
+from exportsinks import *
+from project import *
+
+"""
+Create Slides with two selections of 300 x 300 pixels each, so that an
+uncompressed crop takes about 270 kB.
+@param directory: pathlib.Path, the directory of the images.
+@param count: int, the number of Slides.
+@return list of Slide objects.
+"""
+def create_slides(directory, count):
+    slides = []
+    for number in range(count):
+        width, height = 700, 400
+        pixels = bytes((x * 7 + y * 3 + number * 50) % 256 \
+                       for y in range(height) for x in range(width * 3))
+        image = QImage(pixels, width, height, width * 3, \
+                       QImage.Format.Format_RGB888)
+        path = str(directory / ("slide%d.png" %number))
+        assert image.save(path)
+        slide = Slide(slide_path = path)
+        slide.selections.add(160, 160, 300, 300)
+        slide.selections.add(500, 200, 300, 300)
+        slides.append(slide)
+    return slides
+
+"""
+Export the crops of Slides into the container of the given settings.
+@param directory: pathlib.Path, the output directory.
+@param slides: list of Slide objects.
+@param settings: ExportSettings object.
+@return list of list of str, the failed crops of each Slide.
+"""
+def export(directory, slides, settings):
+    sink = ExportSink.create(str(directory), settings)
+    pipeline = ExportPipeline(str(directory), settings, sink = sink)
+    return pipeline.run([(slide, None) for slide in slides])
+
+"""
+Get the crops of Slides, as decoded from the whole images.
+@param slides: list of Slide objects.
+@return dict mapping the name of each crop to its QImage.
+"""
+def get_crops(slides):
+    crops = {}
+    for slide in slides:
+        image = QImage(slide.path)
+        for name, rect in zip(slide.get_crop_names(), \
+                              slide.get_crop_rects()):
+            crops[name] = image.copy(rect)
+    return crops
+
+"""
+Get the temporary files left in a directory.
+@param directory: pathlib.Path, the directory.
+@return list of str, the names of the files.
+"""
+def get_temporary(directory):
+    return [name for name in os.listdir(directory) \
+            if name.startswith(ExportPipeline.TEMPORARY_PREFIX)]
+
+def test_multi_page_tiff(tmp_path):
+    slides = create_slides(tmp_path, 2)
+    output = tmp_path / "output"
+    output.mkdir()
+    settings = ExportSettings("TIFF", "Deflate", container = "TIFF")
+    assert export(output, slides, settings) == [[], []]
+
+    crops = get_crops(slides)
+    for slide in slides:
+        path = str(output / MultiPageTiffSink.get_name(slide))
+        reader = QImageReader(path)
+        assert reader.imageCount() == 2
+        for i, name in enumerate(slide.get_crop_names()):
+            assert reader.jumpToImage(i)
+            page = reader.read()
+            assert page.convertToFormat(crops[name].format()) == crops[name]
+
+@pytest.mark.parametrize("container", ["ZIP", "TAR"])
+def test_shards(tmp_path, container):
+    slides = create_slides(tmp_path, 3)
+    output = tmp_path / "output"
+    output.mkdir()
+    settings = ExportSettings("TIFF", container = container, shard_size = 1)
+    assert export(output, slides, settings) == [[], [], []]
+
+    with open(output / ShardSink.index_name, "r") as file:
+        index = json.load(file)
+    extension = container.lower()
+    assert index["shards"] == ["crops_0001." + extension, \
+                               "crops_0002." + extension]
+
+    # No shard exceeds the shard size.
+    for shard in index["shards"]:
+        assert os.path.getsize(output / shard) <= 1024 * 1024
+
+    # Every crop is read from its shard at its offset, as well as through
+    # the archive.
+    crops = get_crops(slides)
+    assert sorted(index["crops"]) == sorted(crops)
+    for name, entry in index["crops"].items():
+        with open(output / entry["shard"], "rb") as file:
+            file.seek(entry["offset"])
+            data = file.read(entry["size"])
+        assert data == settings.encode(crops[name])
+        if container == "ZIP":
+            with zipfile.ZipFile(output / entry["shard"]) as archive:
+                assert archive.read(name) == data
+        else:
+            with tarfile.open(output / entry["shard"]) as archive:
+                assert archive.extractfile(name).read() == data
+
+def test_old_shards_are_removed(tmp_path):
+    slides = create_slides(tmp_path, 3)
+    output = tmp_path / "output"
+    output.mkdir()
+    (output / "notes.zip").write_bytes(b"kept")
+    settings = ExportSettings("TIFF", container = "ZIP", shard_size = 1)
+    export(output, slides, settings)
+    assert (output / "crops_0002.zip").exists()
+
+    # Only the shards listed by the previous index are removed.
+    export(output, slides[:1], settings)
+    assert (output / "crops_0001.zip").exists()
+    assert not (output / "crops_0002.zip").exists()
+    assert (output / "notes.zip").read_bytes() == b"kept"
+    assert get_temporary(output) == []
+
+def test_array_stacks(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    slides = create_slides(tmp_path, 2)
+
+    # Crops of another size are written to a stack of their own.
+    slides[1].selections.add(50, 50, 20, 10)
+    output = tmp_path / "output"
+    output.mkdir()
+    settings = ExportSettings(container = "NPY")
+    assert export(output, slides, settings) == [[], []]
+
+    with open(output / ArrayStackSink.index_name, "r") as file:
+        stacks = json.load(file)["stacks"]
+    assert sorted(stacks) == ["stack_0001.npy", "stack_0002.npy"]
+    assert stacks["stack_0001.npy"]["shape"] == [4, 300, 300, 3]
+    assert stacks["stack_0002.npy"]["shape"] == [1, 10, 20, 3]
+
+    crops = get_crops(slides)
+    for stack_name, stack in stacks.items():
+        array = numpy.load(str(output / stack_name), mmap_mode = "r")
+        assert list(array.shape) == stack["shape"]
+        for row, entry in enumerate(stack["rows"]):
+            image, expected = Slide._get_array(crops[entry["name"]])
+            assert numpy.array_equal(array[row], expected)
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_itercrops.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests reading the crops of a Slide as NumPy arrays with iter_crops, as a
+#   library, without main.py.
+#
+################################################################################
+
+import pytest
+
+from PyQt6.QtGui import *
+
+from project import *
+from tiffio import *
+
+numpy = pytest.importorskip("numpy")
+
+"""
+Create an image with a gradient, so that every crop differs.
+@param width: int, the width.
+@param height: int, the height.
+@param image_format: QImage.Format, the format.
+@return QImage.
+"""
+def create_image(width, height, image_format):
+    y, x = numpy.mgrid[0:height, 0:width]
+    pixels = numpy.dstack([x % 256, y % 256, (x + y) % 256, \
+                           255 - x % 200]).astype(numpy.uint8)
+    image = QImage(pixels.tobytes(), width, height, width * 4, \
+                   QImage.Format.Format_RGBA8888)
+    return image.convertToFormat(image_format)
+
+"""
+Create a Slide with selections inside, across and outside the image.
+@param path: str, the path to the image.
+@return Slide object.
+"""
+def create_slide(path):
+    slide = Slide(slide_path = path)
+    slide.selections.add(30, 20, 20, 10)
+    slide.selections.add(5, 90, 30, 30)
+    slide.selections.add(900, 900, 10, 10)
+    return slide
+
+"""
+Get the expected arrays of the crops of a Slide, from the whole image.
+@param slide: Slide object.
+@param image: QImage, the image of the Slide.
+@return list of numpy.ndarray.
+"""
+def get_expected(slide, image):
+    image, array = Slide._get_array(image)
+    bounds = QRect(0, 0, image.width(), image.height())
+    expected = []
+    for rect in slide.get_crop_rects():
+        rect = rect.intersected(bounds)
+        expected.append(array[rect.top():rect.top() + rect.height(), \
+                              rect.left():rect.left() + rect.width()].copy())
+    return expected
+
+@pytest.fixture
+def allocation_limit():
+    # Images larger than the limit can only be read once it is lifted.
+    limit = QImageReader.allocationLimit()
+    QImageReader.setAllocationLimit(1)
+    yield
+    QImageReader.setAllocationLimit(limit)
+
+@pytest.mark.parametrize("image_format, shape", [
+    (QImage.Format.Format_Grayscale8, ()),
+    (QImage.Format.Format_RGB32, (3,)),
+    (QImage.Format.Format_ARGB32, (4,)),
+])
+def test_decoded(tmp_path, allocation_limit, image_format, shape):
+    path = str(tmp_path / "slide.png")
+    image = create_image(800, 700, image_format)
+    assert image.save(path)
+    slide = create_slide(path)
+
+    crops = list(slide.iter_crops())
+    assert [crop.array.shape for crop in crops] == \
+        [(10, 20) + shape, (30, 20) + shape, (0, 0) + shape]
+    for crop, expected in zip(crops, get_expected(slide, image)):
+        assert numpy.array_equal(crop.array, expected)
+
+@pytest.mark.parametrize("image_format, shape", [
+    (QImage.Format.Format_Grayscale8, ()),
+    (QImage.Format.Format_Grayscale16, ()),
+    (QImage.Format.Format_RGB32, (3,)),
+    (QImage.Format.Format_ARGB32, (4,)),
+])
+def test_tiff_regions(tmp_path, allocation_limit, image_format, shape):
+    path = str(tmp_path / "slide.tif")
+    image = create_image(800, 700, image_format)
+    with open(path, "wb") as file:
+        file.write(TiffWriter.encode(image))
+    assert TiffRegionReader(path).is_supported()
+    slide = create_slide(path)
+
+    # The whole image cannot be decoded under the limit, so the crops are 
+    # read from the file.
+    crops = list(slide.iter_crops([0, 1, 2]))
+    assert [crop.array.shape for crop in crops] == \
+        [(10, 20) + shape, (30, 20) + shape, (0, 0) + shape]
+    for crop, expected in zip(crops, get_expected(slide, image)):
+        assert numpy.array_equal(crop.array, expected)
+
+def test_unreadable(tmp_path):
+    path = str(tmp_path / "slide.png")
+    with open(path, "wb") as file:
+        file.write(b"not an image")
+    with pytest.raises(OSError):
+        list(create_slide(path).iter_crops())
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_projectdb.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests storing a Project in an SQLite database with ProjectDB: saving only
+#   the rows that changed, and converting between JSON and SQLite project
+#   files.
+#
+################################################################################
+
+import json
+import sqlite3
+
+import pytest
+
+from project import *
+from projectdb import *
+
+"""
+Create a project with slides of two selections each, the first slide with
+the metadata of its image.
+@param count: int, the number of slides.
+@return Project object.
+"""
+def create_project(count):
+    project = Project()
+    project.name = "Test"
+    project.width = 100
+    project.height = 80
+    project.export_settings = ExportSettings("PNG", png_level = 9)
+    for i in range(count):
+        slide = Slide(slide_path = "/slides/slide%d.tif" %i)
+        slide.selections.add(100 + i, 200, 100, 80)
+        slide.selections.add(300, 400 + i, 100, 80)
+        project.slides.append(slide)
+    metadata = SlideMetadata()
+    metadata.width = 4000
+    metadata.height = 3000
+    metadata.file_format = "tiff"
+    project.slides[0].set_metadata(metadata)
+    return project
+
+"""
+Get the number of rows changed by a save of the database of a Project.
+@param project: Project object, saved to an SQLite project file.
+@return int, the number of rows inserted, updated or deleted.
+"""
+def save_changes(project):
+    connection = project.database._connection
+    changes = connection.total_changes
+    project.save(project.path)
+    return connection.total_changes - changes
+
+"""
+Load a project file.
+@param path: str, the path to the project file.
+@return Project object.
+"""
+def load(path):
+    project = Project()
+    project.load(path)
+    project.close_database()
+    return project
+
+def test_is_database(tmp_path):
+    project = create_project(2)
+    project.save(str(tmp_path / "project.scp"), True)
+    project.save(str(tmp_path / "project.json.scp"), False)
+    assert ProjectDB.is_database(str(tmp_path / "project.scp"))
+    assert not ProjectDB.is_database(str(tmp_path / "project.json.scp"))
+    assert not ProjectDB.is_database(str(tmp_path / "missing.scp"))
+
+def test_diff_save(tmp_path):
+    path = str(tmp_path / "project.scp")
+    project = create_project(50)
+    project.save(path, True)
+
+    # Nothing is written when nothing changed.
+    assert save_changes(project) == 0
+
+    # A moved selection is a single row.
+    project.slides[10].selections[1].center_coordinates = (310, 420)
+    assert save_changes(project) == 1
+
+    # A new selection is a single row, and the name a single value.
+    project.slides[20].selections.add(500, 500, 100, 80)
+    project.name = "Renamed"
+    assert save_changes(project) == 2
+
+    # Removing the last slide deletes its row and those of its selections.
+    project.slides.pop()
+    assert save_changes(project) == 3
+
+    # Swapping two slides updates their positions only.
+    project.slides[1], project.slides[2] = project.slides[2], \
+        project.slides[1]
+    assert save_changes(project) == 2
+
+    # Removing a selection deletes its row and moves the following one.
+    project.slides[3].selections.pop(0)
+    assert save_changes(project) == 2
+    project.close_database()
+
+    loaded = load(path)
+    assert loaded.name == "Renamed"
+    assert [slide.path for slide in loaded.slides] == \
+        [slide.path for slide in project.slides]
+    assert [slide.selections.rows() for slide in loaded.slides] == \
+        [slide.selections.rows() for slide in project.slides]
+
+def test_json_round_trip(tmp_path):
+    json_path = str(tmp_path / "project.scp")
+    database_path = str(tmp_path / "project.db.scp")
+    project = create_project(5)
+    project.save(json_path, False)
+    expected = project.to_json()
+
+    # JSON to SQLite and back, as with Save As.
+    project = load(json_path)
+    project.save(database_path, True)
+    project.close_database()
+    project = load(database_path)
+    assert project.to_json() == expected
+    assert project.slides[0].metadata.width == 4000
+    assert project.slides[1].metadata is None
+
+    project.save(json_path, False)
+    with open(json_path, "r") as file:
+        assert json.load(file) == expected
+
+def test_failed_save_keeps_file(tmp_path):
+    path = str(tmp_path / "project.scp")
+    project = create_project(3)
+    project.save(path, True)
+
+    # A value that cannot be stored aborts the whole transaction.
+    project.name = "Renamed"
+    project.slides[0].selections[0].center_coordinates = (1, 2)
+    project.slides[1].path = None
+    with pytest.raises(sqlite3.IntegrityError):
+        project.database.save(project)
+    project.close_database()
+
+    loaded = load(path)
+    assert loaded.name == "Test"
+    assert loaded.slides[0].selections.rows()[0] == (100, 200, 100, 80)
@@ -0,0 +1,148 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_projectjournal.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests replaying and compacting the ProjectJournal of a Project.
+#
+################################################################################
+
+import os
+
+from project import *
+from projectjournal import *
+
+"""
+Create a saved JSON project with three slides.
+@param path: str, the path to the project file.
+@return Project object.
+"""
+def create_project(path):
+    project = Project()
+    project.name = "Test"
+    project.width = 100
+    project.height = 100
+    for i in range(3):
+        slide = Slide(slide_path = "/slides/slide%d.tif" %i)
+        slide.selections.add(100 + i, 200, 100, 100)
+        project.slides.append(slide)
+    project.save_json(path)
+    return project
+
+"""
+Get the paths and selections of the slides of a Project.
+@param project: Project object.
+@return list of (str, list), the path and selections of each Slide.
+"""
+def get_slides(project):
+    return [(slide.path, slide.selections.rows()) for slide in project.slides]
+
+def test_remove_then_add_slide(tmp_path):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+
+    # The slide is removed before the project records the edit, as in step1.
+    removed = project.slides.pop(1)
+    project.record_edit({"op": "remove_slide", "slide": 1, \
+                         "path": removed.path})
+    project.slides.append(Slide(slide_path = "/slides/slide3.tif"))
+    project.record_edit({"op": "add_slide", "path": "/slides/slide3.tif"})
+    project.slides[2].selections.add(50, 60, 100, 100)
+    project.record_edit({"op": "select", "slide": 2, \
+                         "path": "/slides/slide3.tif", "index": 0, \
+                         "center": [50, 60], "width": 100, "height": 100})
+
+    # Replaying the journal over the project file restores the edits.
+    replayed = Project()
+    replayed.load_json(path)
+    assert get_slides(replayed) == get_slides(project)
+    assert replayed.journal_sequence == 3
+    assert not replayed.saved
+
+    # Once compacted, the project file holds the edits and the journal is 
+    # removed.
+    replayed.save_json(path)
+    assert not os.path.exists(ProjectJournal.get_path(path))
+    compacted = Project()
+    compacted.load_json(path)
+    assert get_slides(compacted) == get_slides(project)
+    assert compacted.journal_sequence == 3
+    assert compacted.saved
+
+def test_records_in_file_are_skipped(tmp_path):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    project.slides[0].selections.add(300, 300, 100, 100)
+    project.record_edit({"op": "select", "slide": 0, \
+                         "path": "/slides/slide0.tif", "index": 1, \
+                         "center": [300, 300], "width": 100, "height": 100})
+
+    # The project file is written without trimming the journal, as by an 
+    # autosave interrupted before the trim.
+    project.write_json(path, project.to_json())
+    loaded = Project()
+    loaded.load_json(path)
+    assert get_slides(loaded) == get_slides(project)
+
+def test_truncated_last_line(tmp_path):
+    path = str(tmp_path / "project.scp")
+    project = create_project(path)
+    project.slides[0].selections.add(300, 300, 100, 100)
+    project.record_edit({"op": "select", "slide": 0, \
+                         "path": "/slides/slide0.tif", "index": 1, \
+                         "center": [300, 300], "width": 100, "height": 100})
+    expected = get_slides(project)
+
+    # The program crashed while writing the next record.
+    with open(ProjectJournal.get_path(path), "a") as file:
+        file.write('{"op": "remove_slide", "slide": 0, "pa')
+    assert [record["seq"] for record in ProjectJournal.read(path)] == [1]
+
+    loaded = Project()
+    loaded.load_json(path)
+    assert get_slides(loaded) == expected
+    assert loaded.journal_sequence == 1
+
+    # Compacting drops the incomplete record.
+    loaded.save_json(path)
+    assert ProjectJournal.read(path) == []
+
+def test_save_as_removes_previous_journal(tmp_path):
+    path = str(tmp_path / "project.scp")
+    new_path = str(tmp_path / "copy.scp")
+    project = create_project(path)
+    project.slides[0].selections.pop()
+    project.record_edit({"op": "remove", "slide": 0, \
+                         "path": "/slides/slide0.tif", "index": 0})
+    project.save_json(new_path)
+    assert not os.path.exists(ProjectJournal.get_path(path))
+
+    # The previous file keeps its last saved state.
+    previous = Project()
+    previous.load_json(path)
+    assert len(previous.slides[0].selections) == 1
+    copy = Project()
+    copy.load_json(new_path)
+    assert len(copy.slides[0].selections) == 0
+
+    # Edits are now recorded next to the new file.
+    project.record_edit({"op": "project", "name": "Copy", \
+                         "selection": 6, "width": 100, "height": 100, \
+                         "export": project.export_settings.to_dict()})
+    assert os.path.exists(ProjectJournal.get_path(new_path))
+    assert not os.path.exists(ProjectJournal.get_path(path))
+
+def test_save_as_database_removes_previous_journal(tmp_path):
+    path = str(tmp_path / "project.scp")
+    new_path = str(tmp_path / "project.db.scp")
+    project = create_project(path)
+    project.slides[1].selections.pop()
+    project.record_edit({"op": "remove", "slide": 1, \
+                         "path": "/slides/slide1.tif", "index": 0})
+    try:
+        project.save_database(new_path)
+        assert not os.path.exists(ProjectJournal.get_path(path))
+    finally:
+        project.close_database()
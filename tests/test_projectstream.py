@@ -0,0 +1,97 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_projectstream.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests reading JSON project files incrementally with ProjectStream.
+#
+################################################################################
+
+import json
+
+import pytest
+
+from project import *
+from projectstream import *
+
+"""
+Create a saved JSON project.
+@param path: str, the path to the project file.
+@param count: int, the number of slides.
+@return dict, the content of the project file.
+"""
+def create_project(path, count):
+    project = Project()
+    project.name = "Test \"stream\" {[,:]}"
+    project.width = 100
+    project.height = 80
+    for i in range(count):
+        slide = Slide(slide_path = "/slides/slide %d [%d].tif" %(i, i))
+        for j in range(i % 3):
+            slide.selections.add(100.5 + j, 200 + i, 100, 80)
+        project.slides.append(slide)
+    project.save_json(path)
+    with open(path, "r") as file:
+        return json.load(file)
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 4096])
+def test_small_chunks(tmp_path, chunk_size):
+    path = str(tmp_path / "project.scp")
+    expected = create_project(path, 5)
+
+    stream = ProjectStream(path, chunk_size)
+    slides = list(stream)
+    assert slides == expected["slides"]
+    assert stream.values == {key: value for key, value in expected.items() \
+                             if key != "slides"}
+
+@pytest.mark.parametrize("chunk_size", [1, 5])
+def test_compact_and_reordered(tmp_path, chunk_size):
+    # Files written by other tools may have no whitespace, and the slides 
+    # before the other values.
+    path = str(tmp_path / "project.scp")
+    values = {"slides": [{"path": "/a.tif", "selections": []}, \
+                         {"path": "/b.tif", "selections": []}], \
+              "name": "Test", "work_index": 2}
+    with open(path, "w") as file:
+        json.dump(values, file, separators = (",", ":"))
+
+    stream = ProjectStream(path, chunk_size)
+    assert list(stream) == values["slides"]
+    assert stream.values == {"name": "Test", "work_index": 2}
+
+@pytest.mark.parametrize("chunk_size", [1, 3])
+def test_empty_slides(tmp_path, chunk_size):
+    path = str(tmp_path / "project.scp")
+    expected = create_project(path, 0)
+
+    stream = ProjectStream(path, chunk_size)
+    assert list(stream) == []
+    assert stream.values["name"] == expected["name"]
+
+@pytest.mark.parametrize("chunk_size", [1, 4])
+def test_truncated_file(tmp_path, chunk_size):
+    path = str(tmp_path / "project.scp")
+    create_project(path, 3)
+    with open(path, "r") as file:
+        content = file.read()
+    with open(path, "w") as file:
+        file.write(content[:len(content) // 2])
+
+    with pytest.raises(ValueError):
+        list(ProjectStream(path, chunk_size))
+
+def test_load_json(tmp_path):
+    path = str(tmp_path / "project.scp")
+    create_project(path, 4)
+    ProjectStream.chunk_size, chunk_size = 3, ProjectStream.chunk_size
+    try:
+        project = Project()
+        project.load_json(path)
+    finally:
+        ProjectStream.chunk_size = chunk_size
+    assert project.name == "Test \"stream\" {[,:]}"
+    assert [len(slide.selections) for slide in project.slides] == \
+        [0, 1, 2, 0]
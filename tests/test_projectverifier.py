@@ -0,0 +1,68 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_projectverifier.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests checking the Slides of a Project with ProjectVerifier.
+#
+################################################################################
+
+import pytest
+
+from PyQt6.QtGui import *
+
+from project import *
+from projectjournal import *
+from projectverifier import *
+
+"""
+Create a saved JSON project with a slide per image, without metadata.
+@param directory: pathlib.Path, the directory of the images and project.
+@param count: int, the number of slides.
+@return str, the path to the project file.
+"""
+def create_project(directory, count):
+    project = Project()
+    project.name = "Test"
+    project.width = 20
+    project.height = 20
+    for i in range(count):
+        path = str(directory / ("slide%d.png" %i))
+        image = QImage(64 + i, 48, QImage.Format.Format_RGB32)
+        image.fill(0)
+        assert image.save(path)
+        slide = Slide(slide_path = path)
+        slide.selections.add(30, 20, 20, 20)
+        project.slides.append(slide)
+
+    path = str(directory / "project.scp")
+    project.save_json(path)
+    return path
+
+def test_probed_metadata_is_saved(tmp_path, monkeypatch):
+    path = create_project(tmp_path, 3)
+
+    project = Project()
+    assert ProjectVerifier(project).verify(project.iter_load(path))
+    assert [slide.width for slide in project.slides] == [64, 65, 66]
+    assert project.saved
+    records = ProjectJournal.read(path)
+    assert [record["op"] for record in records] == ["metadata"] * 3
+
+    # The journal is replayed if the project is not compacted.
+    replayed = Project()
+    replayed.load_json(path)
+    assert [slide.metadata.width for slide in replayed.slides] == \
+        [64, 65, 66]
+
+    # Once compacted, the images are not probed again.
+    project.save_json(path)
+    reloaded = Project()
+    monkeypatch.setattr(SlideMetadata, "read", \
+                        lambda *args: pytest.fail("The image was probed."))
+    assert ProjectVerifier(reloaded).verify(reloaded.iter_load(path))
+    assert reloaded.saved
+    assert ProjectJournal.read(path) == []
+    assert [slide.width for slide in reloaded.slides] == [64, 65, 66]
@@ -0,0 +1,122 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_selectionstore.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests the SelectionStore of a Slide: its use as a list of SlideSelection
+#   views, and the checks and changes of all its selections, with and
+#   without NumPy.
+#
+################################################################################
+
+import random
+
+import pytest
+
+import selectionstore
+from selectionstore import *
+
+"""
+Create a store of random selections, some of them overflowing a 1000 x 800
+image and some larger than it.
+@param count: int, the number of selections.
+@return SelectionStore object.
+"""
+def create_store(count):
+    generator = random.Random(count)
+    store = SelectionStore()
+    for i in range(count):
+        store.add(generator.uniform(-100, 1100), generator.uniform(-100, 900), \
+                  generator.choice([50, 101, 300, 1200]), \
+                  generator.choice([40, 99, 250, 900]))
+    return store
+
+"""
+Copy a store.
+@param store: SelectionStore object.
+@return SelectionStore object, holding the same selections.
+"""
+def copy_store(store):
+    copy = SelectionStore()
+    for row in store.rows():
+        copy.add(*row)
+    return copy
+
+def test_list_of_views():
+    store = SelectionStore()
+    store.add(10, 20, 30, 40)
+    store.add(50.5, 60.5, 70, 80)
+    assert len(store) == 2
+    assert store[-1].center_coordinates == (50.5, 60.5)
+    with pytest.raises(IndexError):
+        store[2]
+
+    # Views change the store.
+    store[0].width = 35.0
+    store[0].center_coordinates = (15, 25)
+    assert store.rows() == [(15, 25, 35, 40), (50.5, 60.5, 70, 80)]
+    assert [selection.height for selection in store] == [40, 80]
+
+    # Appended selections are copied, and popped ones are copies.
+    selection = SlideSelection()
+    selection.width = 5
+    store.append(selection)
+    selection.width = 6
+    assert store[2].width == 5
+    popped = store.pop(0)
+    popped.width = 1
+    assert store.rows() == [(50.5, 60.5, 70, 80), (0, 0, 5, 0)]
+
+    # The rows of a store have no attributes of their own.
+    with pytest.raises(AttributeError):
+        store[0].name = "selection"
+
+def test_resize():
+    store = create_store(10)
+    centers = [row[:2] for row in store.rows()]
+    store.resize(120, 90)
+    assert [row[2:] for row in store.rows()] == [(120, 90)] * 10
+    assert [row[:2] for row in store.rows()] == centers
+
+@pytest.mark.parametrize("count", [1, SelectionStore.vector_size - 1, \
+                                   SelectionStore.vector_size, \
+                                   SelectionStore.vector_size + 1, 500])
+def test_numpy_matches_python(monkeypatch, count):
+    pytest.importorskip("numpy")
+    store = create_store(count)
+    python_store = copy_store(store)
+    sizes = [(10, 10), (100, 80), (300, 250), (1200, 900)]
+    fits = [store.fits(1000, 800, width, height) for width, height in sizes]
+    store.clamp(1000, 800)
+
+    monkeypatch.setattr(selectionstore, "numpy", None)
+    assert [python_store.fits(1000, 800, width, height) for width, height \
+            in sizes] == fits
+    python_store.clamp(1000, 800)
+    assert python_store.rows() == store.rows()
+
+@pytest.mark.parametrize("count", [SelectionStore.vector_size - 1, \
+                                   SelectionStore.vector_size + 1])
+def test_clamp(count):
+    store = create_store(count)
+    store.clamp(1000, 800)
+    for center_x, center_y, width, height in store.rows():
+        if width <= 1000:
+            assert center_x - width // 2 >= 0
+            assert center_x + (width - width // 2) <= 1000
+        else:
+            # Selections larger than the image are aligned to its left.
+            assert center_x == width // 2
+        if height <= 800:
+            assert center_y - height // 2 >= 0
+            assert center_y + (height - height // 2) <= 800
+        else:
+            assert center_y == height // 2
+
+    # Once clamped, every selection fits at its size.
+    store.resize(100, 80)
+    store.clamp(1000, 800)
+    assert store.fits(1000, 800, 100, 80)
+    assert not store.fits(1000, 800, 1001, 80)
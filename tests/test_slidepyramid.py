@@ -0,0 +1,81 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_slidepyramid.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests building and evicting tile pyramids.
+#
+################################################################################
+
+import os
+
+from PyQt6.QtGui import *
+
+from slidepyramid import *
+
+"""
+Create images of different sizes.
+@param directory: pathlib.Path, the directory of the images.
+@param count: int, the number of images.
+@return list of str, the paths to the images.
+"""
+def create_images(directory, count):
+    paths = []
+    for i in range(count):
+        path = str(directory / ("slide%d.png" %i))
+        image = QImage(300 + 10 * i, 200, QImage.Format.Format_RGB32)
+        image.fill(QColor(10 * i, 100, 200))
+        assert image.save(path)
+        paths.append(path)
+    return paths
+
+def test_build_and_load(tmp_path):
+    path = create_images(tmp_path, 1)[0]
+    directory = str(tmp_path / "pyramids")
+    pyramid = SlidePyramid(directory, path, 128)
+    assert not pyramid.exists()
+    assert pyramid.build()
+
+    loaded = SlidePyramid(directory, path, 128)
+    assert loaded.levels == [(300, 200), (150, 100), (75, 50)]
+    assert loaded.get_tile_count(0) == (3, 2)
+    assert loaded.get_tile(0, 2, 1).size() == QSize(44, 72)
+    assert loaded.get_tile(1, 1, 0).size() == QSize(22, 100)
+
+def test_evict_keeps_listed(tmp_path):
+    paths = create_images(tmp_path, 4)
+    directory = str(tmp_path / "pyramids")
+    for path in paths:
+        assert SlidePyramid(directory, path, 128).build()
+    entries = SlidePyramid._get_entries(directory)
+    assert len(entries) == 4
+
+    # No eviction happens while building.
+    assert all(SlidePyramid(directory, path, 128).exists() for path in paths)
+
+    # Everything beyond the limit goes, except the listed images.
+    SlidePyramid.evict(directory, paths[:2], 1)
+    assert [SlidePyramid(directory, path, 128).exists() \
+            for path in paths] == [True, True, False, False]
+
+    # Within the limit, nothing is removed.
+    SlidePyramid.evict(directory, [], 1 << 30)
+    assert len(SlidePyramid._get_entries(directory)) == 2
+
+def test_evict_least_recently_used(tmp_path):
+    paths = create_images(tmp_path, 3)
+    directory = str(tmp_path / "pyramids")
+    for path in paths:
+        assert SlidePyramid(directory, path, 128).build()
+
+    # Loading the first pyramid marks it as used last.
+    for i in range(3):
+        os.utime(os.path.join(directory, SlidePyramid._get_key(paths[i]), \
+                              "pyramid.json"), (i, i))
+    SlidePyramid(directory, paths[0], 128)
+    size = max(entry[2] for entry in SlidePyramid._get_entries(directory))
+    SlidePyramid.evict(directory, [], size)
+    assert [SlidePyramid(directory, path, 128).exists() \
+            for path in paths] == [True, False, False]
@@ -0,0 +1,346 @@
+#!/usr/bin/python
+################################################################################
+#
+#   test_tiffio.py
+#   Author: Roger Wang
+#   Date: 2024-07-27
+#
+#   Tests reading regions of TIFF images with TiffRegionReader, against
+#   QImage.copy of the whole image, for every supported layout.
+#
+################################################################################
+
+import random
+import struct
+import sys
+import zlib
+
+import pytest
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+import tiffio
+from tiffio import *
+
+WIDTH = 70
+HEIGHT = 50
+
+# (QImage.Format, bytes per pixel, samples per pixel, bits per sample,
+# photometric interpretation) of each supported layout.
+LAYOUTS = [
+    (QImage.Format.Format_Grayscale8, 1, 1, 8, 1),
+    (QImage.Format.Format_Grayscale16, 2, 1, 16, 1),
+    (QImage.Format.Format_RGB888, 3, 3, 8, 2),
+    (QImage.Format.Format_RGBA8888, 4, 4, 8, 2),
+]
+
+# (compression, predictor) of each supported encoding.
+ENCODINGS = [(1, 1), (32773, 1), (5, 1), (5, 2), (8, 1), (8, 2)]
+
+# Regions inside the image, across strips and tiles, and partly or entirely
+# outside of the image.
+RECTS = [
+    QRect(0, 0, WIDTH, HEIGHT),
+    QRect(3, 5, 10, 7),
+    QRect(20, 10, 40, 30),
+    QRect(-10, -5, 30, 20),
+    QRect(60, 40, 20, 20),
+    QRect(100, 100, 5, 5),
+]
+
+"""
+Create the pixels of an image, with runs and noise so that every encoding
+is exercised.
+@param line_size: int, the number of bytes of a row.
+@return bytes, the pixels in the byte order of the machine.
+"""
+def create_pixels(line_size):
+    generator = random.Random(line_size)
+    pixels = bytearray()
+    for y in range(HEIGHT):
+        for x in range(line_size):
+            pixels.append((x // 8 * 16 + y) % 256 if x < line_size // 2 \
+                          else generator.randrange(256))
+    return bytes(pixels)
+
+"""
+Encode data with TIFF LZW, the reverse of TiffRegionReader._decode_lzw.
+@param data: bytes, the data.
+@return bytes, the compressed data.
+"""
+def encode_lzw(data):
+    output = bytearray()
+    state = {"bits": 0, "count": 0}
+
+    def emit(code, width):
+        state["bits"] = (state["bits"] << width) | code
+        state["count"] += width
+        while state["count"] >= 8:
+            state["count"] -= 8
+            output.append((state["bits"] >> state["count"]) & 0xff)
+
+    table = {bytes((i,)): i for i in range(256)}
+    next_code = 258
+    width = 9
+    emit(256, width)
+    current = b""
+    for byte in data:
+        extended = current + bytes((byte,))
+        if extended in table:
+            current = extended
+            continue
+        emit(table[current], width)
+        table[extended] = next_code
+        next_code += 1
+        if next_code == 4094:
+            emit(256, width)
+            table = {bytes((i,)): i for i in range(256)}
+            next_code = 258
+            width = 9
+        elif next_code > (1 << width) - 1:
+            width += 1
+        current = bytes((byte,))
+    if current:
+        emit(table[current], width)
+        next_code += 1
+        if next_code > (1 << width) - 1 and width < 12:
+            width += 1
+    emit(257, width)
+    if state["count"]:
+        output.append((state["bits"] << (8 - state["count"])) & 0xff)
+    return bytes(output)
+
+"""
+Encode data with PackBits, as literal runs and repeated bytes.
+@param data: bytes, the data.
+@return bytes, the compressed data.
+"""
+def encode_packbits(data):
+    output = bytearray()
+    i = 0
+    while i < len(data):
+        run = 1
+        while i + run < len(data) and run < 128 and \
+            data[i + run] == data[i]:
+            run += 1
+        if run > 1:
+            output += bytes((257 - run, data[i]))
+        else:
+            output += bytes((0, data[i]))
+        i += run
+    return bytes(output)
+
+"""
+Store each sample as the difference from the same sample of the previous
+pixel, the reverse of TiffRegionReader._undo_predictor.
+@param data: bytes, the rows of a strip or tile in the byte order of the
+    file.
+@param line_size: int, the number of bytes of a row.
+@param layout: tuple, an item of LAYOUTS.
+@param order: str, the byte order of the file.
+@return bytes, the differences.
+"""
+def apply_predictor(data, line_size, layout, order):
+    sample_size = layout[3] // 8
+    samples = layout[2]
+    sample_format = order + ("B" if sample_size == 1 else "H")
+    step = struct.calcsize(sample_format)
+    values = [struct.unpack_from(sample_format, data, i)[0] \
+              for i in range(0, len(data), step)]
+    mask = (1 << layout[3]) - 1
+    line_length = line_size // sample_size
+    result = list(values)
+    for start in range(0, len(values), line_length):
+        for i in range(start + samples, start + line_length):
+            result[i] = (values[i] - values[i - samples]) & mask
+    return struct.pack(order + sample_format[1] * len(result), *result)
+
+"""
+Write a TIFF image in strips or tiles.
+@param path: str, the path to the file.
+@param pixels: bytes, the pixels in the byte order of the machine.
+@param layout: tuple, an item of LAYOUTS.
+@param compression: int, the TIFF compression.
+@param predictor: int, the TIFF predictor.
+@param tiled: bool, whether the image is written in 32 x 32 tiles.
+@param order: str, the byte order of the file, "<" or ">".
+"""
+def write_tiff(path, pixels, layout, compression, predictor, tiled, order):
+    image_format, pixel_size, samples, bits, photometric = layout
+    line_size = WIDTH * pixel_size
+    if bits == 16 and order != ("<" if sys.byteorder == "little" else ">"):
+        swapped = bytearray(len(pixels))
+        swapped[0::2] = pixels[1::2]
+        swapped[1::2] = pixels[0::2]
+        pixels = bytes(swapped)
+
+    # The rows of each strip or tile, tiles being padded with zeros.
+    chunks = []
+    if tiled:
+        for top in range(0, HEIGHT, 32):
+            for left in range(0, WIDTH, 32):
+                chunk = bytearray()
+                for y in range(top, top + 32):
+                    row = pixels[y * line_size + left * pixel_size:\
+                                 y * line_size + min(WIDTH, left + 32) * \
+                                 pixel_size] if y < HEIGHT else b""
+                    chunk += row.ljust(32 * pixel_size, b"\x00")
+                chunks.append((bytes(chunk), 32 * pixel_size))
+    else:
+        for top in range(0, HEIGHT, 16):
+            chunks.append((pixels[top * line_size:\
+                                  min(HEIGHT, top + 16) * line_size], \
+                           line_size))
+
+    encoded = []
+    for chunk, chunk_line_size in chunks:
+        if predictor == 2:
+            chunk = apply_predictor(chunk, chunk_line_size, layout, order)
+        if compression == 5:
+            chunk = encode_lzw(chunk)
+        elif compression == 8:
+            chunk = zlib.compress(chunk)
+        elif compression == 32773:
+            chunk = encode_packbits(chunk)
+        encoded.append(chunk)
+
+    offsets = []
+    data = bytearray(b"II*\x00" if order == "<" else b"MM\x00*")
+    data += b"\x00" * 4
+    for chunk in encoded:
+        offsets.append(len(data))
+        data += chunk
+        if len(data) % 2:
+            data += b"\x00"
+
+    tags = [
+        (TiffRegionReader.IMAGE_WIDTH, 4, [WIDTH]),
+        (TiffRegionReader.IMAGE_LENGTH, 4, [HEIGHT]),
+        (TiffRegionReader.BITS_PER_SAMPLE, 3, [bits] * samples),
+        (TiffRegionReader.COMPRESSION, 3, [compression]),
+        (TiffRegionReader.PHOTOMETRIC, 3, [photometric]),
+        (TiffRegionReader.SAMPLES_PER_PIXEL, 3, [samples]),
+        (TiffRegionReader.PLANAR_CONFIGURATION, 3, [1]),
+        (TiffRegionReader.PREDICTOR, 3, [predictor]),
+    ]
+    if tiled:
+        tags += [
+            (TiffRegionReader.TILE_WIDTH, 4, [32]),
+            (TiffRegionReader.TILE_LENGTH, 4, [32]),
+            (TiffRegionReader.TILE_OFFSETS, 4, offsets),
+            (TiffRegionReader.TILE_BYTE_COUNTS, 4, \
+             [len(chunk) for chunk in encoded]),
+        ]
+    else:
+        tags += [
+            (TiffRegionReader.STRIP_OFFSETS, 4, offsets),
+            (TiffRegionReader.ROWS_PER_STRIP, 4, [16]),
+            (TiffRegionReader.STRIP_BYTE_COUNTS, 4, \
+             [len(chunk) for chunk in encoded]),
+        ]
+    if samples == 4:
+        tags.append((TiffRegionReader.EXTRA_SAMPLES, 3, [2]))
+    tags.sort(key = lambda tag: tag[0])
+
+    # Values that do not fit in an entry are written after the directory.
+    ifd_offset = len(data)
+    struct.pack_into(order + "I", data, 4, ifd_offset)
+    extra_offset = ifd_offset + 2 + len(tags) * 12 + 4
+    entries = bytearray()
+    extra = bytearray()
+    for tag, value_type, values in tags:
+        value = struct.pack(order + ("H" if value_type == 3 else "I") * \
+                            len(values), *values)
+        if len(value) <= 4:
+            value = value.ljust(4, b"\x00")
+        else:
+            value_offset = extra_offset + len(extra)
+            extra += value
+            value = struct.pack(order + "I", value_offset)
+        entries += struct.pack(order + "HHI", tag, value_type, \
+                               len(values)) + value
+    data += struct.pack(order + "H", len(tags)) + entries
+    data += struct.pack(order + "I", 0) + extra
+    with open(path, "wb") as file:
+        file.write(data)
+
+"""
+Write a TIFF image and get the image it holds.
+@param path: str, the path to the file.
+@param layout: tuple, an item of LAYOUTS.
+@param compression, predictor, tiled, order: see write_tiff.
+@return QImage, the whole image.
+"""
+def create_tiff(path, layout, compression, predictor, tiled, order):
+    pixels = create_pixels(WIDTH * layout[1])
+    write_tiff(path, pixels, layout, compression, predictor, tiled, order)
+    image = QImage(pixels, WIDTH, HEIGHT, WIDTH * layout[1], layout[0])
+    return image.copy()
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("compression, predictor", ENCODINGS)
+@pytest.mark.parametrize("tiled", [False, True])
+@pytest.mark.parametrize("order", ["<", ">"])
+def test_read_region(tmp_path, layout, compression, predictor, tiled, order):
+    path = str(tmp_path / "slide.tif")
+    image = create_tiff(path, layout, compression, predictor, tiled, order)
+    reader = TiffRegionReader(path)
+    assert reader.is_supported()
+    assert (reader.width, reader.height) == (WIDTH, HEIGHT)
+    for rect in RECTS:
+        region = reader.read_region(rect)
+        assert region.format() == layout[0]
+        assert region == image.copy(rect)
+    reader.close()
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_predictor_without_numpy(tmp_path, monkeypatch, layout):
+    path = str(tmp_path / "slide.tif")
+    image = create_tiff(path, layout, 8, 2, False, ">")
+    monkeypatch.setattr(tiffio, "numpy", None)
+    reader = TiffRegionReader(path)
+    for rect in RECTS:
+        assert reader.read_region(rect) == image.copy(rect)
+    reader.close()
+
+def test_last_chunk_is_kept(tmp_path, monkeypatch):
+    path = str(tmp_path / "slide.tif")
+    image = create_tiff(path, LAYOUTS[2], 5, 2, True, "<")
+    reader = TiffRegionReader(path)
+    decoded = []
+    decode_lzw = reader._decode_lzw
+    monkeypatch.setattr(reader, "_decode_lzw", \
+                        lambda data: decoded.append(data) or decode_lzw(data))
+
+    # Both regions are within the first tile.
+    assert reader.read_region(QRect(0, 0, 10, 10)) == \
+        image.copy(QRect(0, 0, 10, 10))
+    assert reader.read_region(QRect(10, 10, 10, 10)) == \
+        image.copy(QRect(10, 10, 10, 10))
+    assert len(decoded) == 1
+    reader.close()
+
+@pytest.mark.parametrize("image_format", [
+    QImage.Format.Format_Grayscale8,
+    QImage.Format.Format_RGB888,
+    QImage.Format.Format_RGBA8888,
+])
+def test_qt_lzw(tmp_path, image_format):
+    path = str(tmp_path / "slide.tif")
+    # The alpha of Qt TIFF images is premultiplied, so the image is opaque 
+    # for the pixels to be compared exactly.
+    image = QImage(create_pixels(WIDTH * 3), WIDTH, HEIGHT, WIDTH * 3, \
+                   QImage.Format.Format_RGB888).convertToFormat(image_format)
+    writer = QImageWriter(path, b"tiff")
+
+    # Compression 1 is LZW for the TIFF writer of Qt.
+    writer.setCompression(1)
+    assert writer.write(image)
+    reader = TiffRegionReader(path)
+    assert reader.is_supported()
+    expected = QImage(path)
+    for rect in RECTS:
+        region = reader.read_region(rect)
+        assert region == expected.copy(rect).convertToFormat(region.format())
+    reader.close()
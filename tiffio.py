@@ -0,0 +1,638 @@
+#!/usr/bin/python
+################################################################################
+#
+#   tiffio.py
+#   Author: Roger Wang
+#   Date: 2024-07-12
+#
+#   TiffRegionReader reads rectangular regions of a TIFF (or BigTIFF) image
+#   without decoding the whole image. The file is memory-mapped, and only the
+#   strips or tiles intersecting a region are read, so cropping a few small
+#   areas out of a very large slide only touches a small part of the file.
+#   Rows of uncompressed images are read directly from the mapping. The last
+#   strip or tile decompressed is kept, as neighbouring crops usually need it
+#   again.
+#
+#   Only the first image of the file is read. Supported images are 8-bit
+#   grayscale, RGB and RGBA (and 16-bit grayscale) with interleaved samples,
+#   either uncompressed or compressed with PackBits, LZW or Deflate. LZW and
+#   Deflate images may use the horizontal predictor. is_supported should be 
+#   checked before reading, and other images should be decoded with QImage 
+#   instead.
+#
+#   TiffWriter encodes a QImage into a Deflate-compressed TIFF, which the
+#   TIFF writer of Qt does not offer (it only supports LZW). Pages are 
+#   encoded separately (TiffPage) and can be appended one at a time to a 
+#   multi-page TIFF file, so the pages never have to be held together.
+#
+################################################################################
+
+import array
+import io
+import mmap
+import struct
+import sys
+import zlib
+
+from PyQt6.QtCore import *
+from PyQt6.QtGui import *
+
+try:
+    import numpy
+except ImportError:
+    # The horizontal predictor is undone in Python without NumPy.
+    numpy = None
+
+class TiffRegionReader():
+    # TIFF tags used by the reader.
+    IMAGE_WIDTH = 256
+    IMAGE_LENGTH = 257
+    BITS_PER_SAMPLE = 258
+    COMPRESSION = 259
+    PHOTOMETRIC = 262
+    STRIP_OFFSETS = 273
+    SAMPLES_PER_PIXEL = 277
+    ROWS_PER_STRIP = 278
+    STRIP_BYTE_COUNTS = 279
+    PLANAR_CONFIGURATION = 284
+    PREDICTOR = 317
+    TILE_WIDTH = 322
+    TILE_LENGTH = 323
+    TILE_OFFSETS = 324
+    TILE_BYTE_COUNTS = 325
+    EXTRA_SAMPLES = 338
+    SAMPLE_FORMAT = 339
+
+    # None, LZW, Deflate, Adobe Deflate and PackBits.
+    COMPRESSIONS = (1, 5, 8, 32946, 32773)
+
+    # No prediction and horizontal differencing.
+    PREDICTORS = (1, 2)
+
+    def __init__(self, path):
+        self.path = path
+        self.width = 0
+        self.height = 0
+
+        self._file = None
+        self._map = None
+        self._tags = {}
+        self._format = None
+
+        # _chunk should be the index and the decompressed data of the last 
+        # strip or tile decompressed, or None.
+        self._chunk = None
+
+        try:
+            self._file = open(path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, \
+                                  access = mmap.ACCESS_READ)
+            self._read_header()
+            self._check_format()
+        except (OSError, ValueError, struct.error, IndexError):
+            self._format = None
+
+    """
+    Check whether the regions of the image can be read.
+    @return True (supported) / False (decode the image with QImage instead).
+    """
+    def is_supported(self):
+        return self._format is not None
+
+    """
+    Read a region of the image. Parts of the region outside of the image are
+    filled with zeros, as QImage.copy does.
+    @param rect: QRect, the region in pixels of the full image.
+    @return QImage, the region (null if the file could not be read).
+    """
+    def read_region(self, rect):
+        if not self.is_supported() or rect.width() <= 0 or \
+            rect.height() <= 0:
+            return QImage()
+        image_format, pixel_size = self._format
+        line_size = rect.width() * pixel_size
+        buffer = bytearray(line_size * rect.height())
+
+        # Only the part of the region within the image is read.
+        left = max(0, rect.left())
+        top = max(0, rect.top())
+        right = min(self.width, rect.left() + rect.width())
+        bottom = min(self.height, rect.top() + rect.height())
+
+        try:
+            if left < right and top < bottom:
+                for chunk in self._get_chunks(left, top, right, bottom):
+                    self._copy_chunk(chunk, left, top, right, bottom, rect, \
+                                     buffer, line_size)
+        except (ValueError, IndexError, zlib.error):
+            return QImage()
+
+        # 16-bit samples of QImage are in the byte order of the machine.
+        if self._tags.get(TiffRegionReader.BITS_PER_SAMPLE, (8,))[0] == 16 \
+            and self._order != ("<" if sys.byteorder == "little" else ">"):
+            buffer = self._swap_16(buffer)
+
+        image = QImage(bytes(buffer), rect.width(), rect.height(), line_size, \
+                       image_format)
+
+        # The QImage only references the buffer until it is copied.
+        return image.copy()
+
+    """
+    Close the file.
+    """
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunk = None
+
+    """
+    Read the header and the first image file directory.
+    """
+    def _read_header(self):
+        header = self._map[:16]
+        if header[:2] == b"II":
+            self._order = "<"
+        elif header[:2] == b"MM":
+            self._order = ">"
+        else:
+            raise ValueError("Not a TIFF file.")
+
+        version = struct.unpack(self._order + "H", header[2:4])[0]
+        if version == 43:
+            self._bigtiff = True
+            offset = struct.unpack(self._order + "Q", header[8:16])[0]
+            count = struct.unpack(self._order + "Q", \
+                                  self._map[offset:offset + 8])[0]
+            entry_size = 20
+            offset += 8
+        elif version == 42:
+            self._bigtiff = False
+            offset = struct.unpack(self._order + "I", header[4:8])[0]
+            count = struct.unpack(self._order + "H", \
+                                  self._map[offset:offset + 2])[0]
+            entry_size = 12
+            offset += 2
+        else:
+            raise ValueError("Not a TIFF file.")
+
+        # BYTE, SHORT, LONG and LONG8 values are read.
+        formats = {1: "B", 3: "H", 4: "I", 16: "Q"}
+        for i in range(count):
+            entry = self._map[offset + i * entry_size:\
+                              offset + (i + 1) * entry_size]
+            tag, value_type = struct.unpack(self._order + "HH", entry[:4])
+            if value_type not in formats:
+                continue
+            if self._bigtiff:
+                value_count = struct.unpack(self._order + "Q", entry[4:12])[0]
+                data = entry[12:20]
+            else:
+                value_count = struct.unpack(self._order + "I", entry[4:8])[0]
+                data = entry[8:12]
+
+            value_format = self._order + formats[value_type] * value_count
+            size = struct.calcsize(value_format)
+            if size > len(data):
+                # The values are stored elsewhere in the file.
+                value_offset = struct.unpack(\
+                    self._order + ("Q" if self._bigtiff else "I"), data)[0]
+                data = self._map[value_offset:value_offset + size]
+            self._tags[tag] = struct.unpack(value_format, data[:size])
+
+        self.width = self._tags[TiffRegionReader.IMAGE_WIDTH][0]
+        self.height = self._tags[TiffRegionReader.IMAGE_LENGTH][0]
+
+    """
+    Check whether the image can be read and find the QImage format matching
+    its pixels.
+    """
+    def _check_format(self):
+        tags = self._tags
+        samples = tags.get(TiffRegionReader.SAMPLES_PER_PIXEL, (1,))[0]
+        bits = tags.get(TiffRegionReader.BITS_PER_SAMPLE, (1,) * samples)
+        photometric = tags.get(TiffRegionReader.PHOTOMETRIC, (-1,))[0]
+        extra_samples = tags.get(TiffRegionReader.EXTRA_SAMPLES, (0,))
+        compression = tags.get(TiffRegionReader.COMPRESSION, (1,))[0]
+        predictor = tags.get(TiffRegionReader.PREDICTOR, (1,))[0]
+
+        # The predictor only applies to LZW and Deflate.
+        if compression not in TiffRegionReader.COMPRESSIONS or \
+            predictor not in TiffRegionReader.PREDICTORS or \
+            (predictor != 1 and compression in (1, 32773)) or \
+            tags.get(TiffRegionReader.PLANAR_CONFIGURATION, (1,))[0] != 1 or \
+            tags.get(TiffRegionReader.SAMPLE_FORMAT, (1,))[0] != 1:
+            return
+        if TiffRegionReader.TILE_OFFSETS not in tags and \
+            TiffRegionReader.STRIP_OFFSETS not in tags:
+            return
+
+        # BlackIsZero grayscale, RGB and RGBA.
+        if photometric == 1 and samples == 1 and bits[0] == 8:
+            self._format = (QImage.Format.Format_Grayscale8, 1)
+        elif photometric == 1 and samples == 1 and bits[0] == 16:
+            self._format = (QImage.Format.Format_Grayscale16, 2)
+        elif photometric == 2 and samples == 3 and set(bits) == {8}:
+            self._format = (QImage.Format.Format_RGB888, 3)
+        elif photometric == 2 and samples == 4 and set(bits) == {8}:
+            if extra_samples[0] == 1:
+                self._format = (QImage.Format.Format_RGBA8888_Premultiplied, 4)
+            else:
+                self._format = (QImage.Format.Format_RGBA8888, 4)
+
+    """
+    Get the strips or tiles intersecting a region.
+    @param left, top, right, bottom: int, the region within the image.
+    @return list of (int, int, int, int, int), the index, left, top, width and
+        number of rows of each strip or tile.
+    """
+    def _get_chunks(self, left, top, right, bottom):
+        tags = self._tags
+        chunks = []
+        if TiffRegionReader.TILE_OFFSETS in tags:
+            tile_width = tags[TiffRegionReader.TILE_WIDTH][0]
+            tile_length = tags[TiffRegionReader.TILE_LENGTH][0]
+            columns = -(-self.width // tile_width)
+            for row in range(top // tile_length, \
+                             (bottom - 1) // tile_length + 1):
+                for column in range(left // tile_width, \
+                                    (right - 1) // tile_width + 1):
+                    chunks.append((row * columns + column, \
+                                   column * tile_width, row * tile_length, \
+                                   tile_width, tile_length))
+        else:
+            rows_per_strip = min(self.height, tags.get(\
+                TiffRegionReader.ROWS_PER_STRIP, (self.height,))[0])
+            for strip in range(top // rows_per_strip, \
+                               (bottom - 1) // rows_per_strip + 1):
+                chunks.append((strip, 0, strip * rows_per_strip, self.width, \
+                               rows_per_strip))
+        return chunks
+
+    """
+    Copy the part of a strip or tile within a region to the region's buffer.
+    @param chunk: tuple, an item of _get_chunks.
+    @param left, top, right, bottom: int, the region within the image.
+    @param rect: QRect, the whole region.
+    @param buffer: bytearray, the pixels of the region.
+    @param line_size: int, the number of bytes of a row of the region.
+    """
+    def _copy_chunk(self, chunk, left, top, right, bottom, rect, buffer, \
+                    line_size):
+        index, chunk_left, chunk_top, chunk_width, chunk_rows = chunk
+        pixel_size = self._format[1]
+        chunk_line_size = chunk_width * pixel_size
+        tiled = TiffRegionReader.TILE_OFFSETS in self._tags
+        offset = self._tags[TiffRegionReader.TILE_OFFSETS if tiled else \
+                            TiffRegionReader.STRIP_OFFSETS][index]
+        byte_count = self._tags[TiffRegionReader.TILE_BYTE_COUNTS if tiled \
+                                else TiffRegionReader.STRIP_BYTE_COUNTS][index]
+
+        compression = self._tags.get(TiffRegionReader.COMPRESSION, (1,))[0]
+        if compression == 1:
+            # Rows are read straight from the mapping.
+            data = self._map
+            base = offset
+        elif self._chunk is not None and self._chunk[0] == index:
+            data = self._chunk[1]
+            base = 0
+        else:
+            compressed = self._map[offset:offset + byte_count]
+            if compression == 32773:
+                data = self._unpack_bits(compressed)
+            elif compression == 5:
+                data = self._decode_lzw(compressed)
+            else:
+                data = zlib.decompress(compressed)
+            if self._tags.get(TiffRegionReader.PREDICTOR, (1,))[0] == 2:
+                data = self._undo_predictor(data, chunk_line_size)
+            self._chunk = (index, data)
+            base = 0
+
+        first_column = max(left, chunk_left)
+        last_column = min(right, chunk_left + chunk_width)
+        if first_column >= last_column:
+            return
+        start = (first_column - chunk_left) * pixel_size
+        size = (last_column - first_column) * pixel_size
+        destination = (first_column - rect.left()) * pixel_size
+
+        for row in range(max(top, chunk_top), \
+                         min(bottom, chunk_top + chunk_rows)):
+            source = base + (row - chunk_top) * chunk_line_size + start
+            target = (row - rect.top()) * line_size + destination
+            line = data[source:source + size]
+            if len(line) != size:
+                raise ValueError("Truncated strip or tile.")
+            buffer[target:target + size] = line
+
+    """
+    Decompress PackBits data.
+    @param data: bytes, the compressed data.
+    @return bytearray, the decompressed data.
+    """
+    def _unpack_bits(self, data):
+        result = bytearray()
+        i = 0
+        while i < len(data):
+            header = data[i]
+            i += 1
+            if header < 128:
+                result += data[i:i + header + 1]
+                i += header + 1
+            elif header > 128:
+                result += data[i:i + 1] * (257 - header)
+                i += 1
+        return result
+
+    """
+    Decompress LZW data, as written by libtiff and Qt (with codes from 9 to 
+    12 bits, most significant bit first, widened one code early).
+    @param data: bytes, the compressed data.
+    @return bytearray, the decompressed data.
+    """
+    def _decode_lzw(self, data):
+        result = bytearray()
+        table = [bytes((i,)) for i in range(256)] + [b"", b""]
+        width = 9
+        bits = 0
+        count = 0
+        previous = None
+        for byte in data:
+            bits = (bits << 8) | byte
+            count += 8
+            if count < width:
+                continue
+            count -= width
+            code = bits >> count
+            bits &= (1 << count) - 1
+
+            # 256 clears the table and 257 ends the data.
+            if code == 256:
+                del table[258:]
+                width = 9
+                previous = None
+                continue
+            if code == 257:
+                break
+            if code < len(table):
+                entry = table[code]
+                if previous is not None and len(table) < 4096:
+                    table.append(previous + entry[:1])
+            elif code == len(table) and previous is not None:
+                entry = previous + previous[:1]
+                table.append(entry)
+            else:
+                raise ValueError("Invalid LZW code.")
+            result += entry
+            previous = entry
+            if len(table) >= (1 << width) - 1 and width < 12:
+                width += 1
+        return result
+
+    """
+    Undo the horizontal predictor, which stores each sample as the 
+    difference from the same sample of the previous pixel of its row.
+    @param data: bytearray, the decompressed strip or tile.
+    @param line_size: int, the number of bytes of a row of the strip or tile.
+    @return bytes-like, the samples.
+    """
+    def _undo_predictor(self, data, line_size):
+        samples = self._tags.get(TiffRegionReader.SAMPLES_PER_PIXEL, (1,))[0]
+        sample_size = self._format[1] // samples
+        rows = len(data) // line_size
+        data = data[:rows * line_size]
+
+        # Sums wrap around as the samples do.
+        if numpy is not None:
+            dtype = numpy.dtype(numpy.uint8 if sample_size == 1 else \
+                                self._order + "u2")
+            values = numpy.frombuffer(bytes(data), dtype = dtype).reshape(\
+                rows, line_size // (sample_size * samples), samples)
+            values = numpy.cumsum(values, axis = 1, dtype = dtype)
+
+            # The sums may be in the byte order of the machine.
+            return values.astype(dtype, copy = False).tobytes()
+
+        values = array.array("B" if sample_size == 1 else "H", bytes(data))
+        swap = sample_size == 2 and \
+            self._order != ("<" if sys.byteorder == "little" else ">")
+        if swap:
+            values.byteswap()
+        mask = 0xff if sample_size == 1 else 0xffff
+        line_length = line_size // sample_size
+        for start in range(0, len(values), line_length):
+            for i in range(start + samples, start + line_length):
+                values[i] = (values[i] + values[i - samples]) & mask
+        if swap:
+            values.byteswap()
+        return values.tobytes()
+
+    """
+    Swap the bytes of 16-bit samples.
+    @param buffer: bytearray, the samples.
+    @return bytearray, the samples in the other byte order.
+    """
+    def _swap_16(self, buffer):
+        swapped = bytearray(len(buffer))
+        swapped[0::2] = buffer[1::2]
+        swapped[1::2] = buffer[0::2]
+        return swapped
+
+class TiffPage():
+    # TiffPage contains an encoded page, ready to be written by TiffWriter.
+
+    def __init__(self):
+        self.width = 0
+        self.height = 0
+        self.samples = 1
+        self.bits = 8
+        self.photometric = 1
+        self.compression = 1
+        self.rows_per_strip = 0
+
+        # name is written as the PageName of the page when not empty.
+        self.name = ""
+
+        # strips should be a list of bytes, the encoded strips.
+        self.strips = []
+
+class TiffWriter():
+    # TiffWriter appends pages to a TIFF file in a single pass.
+    # Each page is written as its strips followed by its directory, and the
+    # directory of the previous page is then linked to it.
+
+    PAGE_NAME = 285
+
+    # Number of uncompressed bytes in each strip.
+    strip_size = 65536
+
+    def __init__(self, file):
+        self._file = file
+
+        # Samples of QImage are in the byte order of the machine.
+        self._order = "<" if sys.byteorder == "little" else ">"
+
+        # _link is the position of the offset to the next directory.
+        self._start = file.tell()
+        file.write((b"II*\x00" if self._order == "<" else b"MM\x00*") + \
+                   b"\x00" * 4)
+        self._link = self._start + 4
+
+    """
+    Append a page to the file.
+    @param page: TiffPage, the encoded page.
+    """
+    def add_page(self, page):
+        file = self._file
+        offsets = []
+        for strip in page.strips:
+            offsets.append(file.tell() - self._start)
+            file.write(strip)
+        if (file.tell() - self._start) % 2:
+            file.write(b"\x00")
+
+        # (tag, type, values), where type 2 is ASCII, 3 is SHORT and 4 is 
+        # LONG.
+        tags = [
+            (TiffRegionReader.IMAGE_WIDTH, 4, [page.width]),
+            (TiffRegionReader.IMAGE_LENGTH, 4, [page.height]),
+            (TiffRegionReader.BITS_PER_SAMPLE, 3, [page.bits] * page.samples),
+            (TiffRegionReader.COMPRESSION, 3, [page.compression]),
+            (TiffRegionReader.PHOTOMETRIC, 3, [page.photometric]),
+            (TiffRegionReader.STRIP_OFFSETS, 4, offsets),
+            (TiffRegionReader.SAMPLES_PER_PIXEL, 3, [page.samples]),
+            (TiffRegionReader.ROWS_PER_STRIP, 4, [page.rows_per_strip]),
+            (TiffRegionReader.STRIP_BYTE_COUNTS, 4, \
+             [len(strip) for strip in page.strips]),
+            (TiffRegionReader.PLANAR_CONFIGURATION, 3, [1]),
+        ]
+        if page.name:
+            tags.append((TiffWriter.PAGE_NAME, 2, \
+                         page.name.encode("utf-8") + b"\x00"))
+        if page.samples == 4:
+            tags.append((TiffRegionReader.EXTRA_SAMPLES, 3, [2]))
+        tags.sort(key = lambda tag: tag[0])
+
+        # Values that do not fit in an entry are written after the directory.
+        ifd_offset = file.tell() - self._start
+        extra_offset = ifd_offset + 2 + len(tags) * 12 + 4
+        if extra_offset + 8 * len(offsets) + 512 > 0xffffffff:
+            raise OSError("The TIFF file is larger than 4 GB.")
+        entries = bytearray()
+        extra = bytearray()
+        for tag, value_type, values in tags:
+            if value_type == 2:
+                value = bytes(values)
+            else:
+                value = struct.pack(self._order + ("H" if value_type == 3 \
+                                                   else "I") * len(values), \
+                                    *values)
+            if len(value) <= 4:
+                value = value.ljust(4, b"\x00")
+            else:
+                value_offset = extra_offset + len(extra)
+                extra += value
+                if len(extra) % 2:
+                    extra += b"\x00"
+                value = struct.pack(self._order + "I", value_offset)
+            entries += struct.pack(self._order + "HHI", tag, value_type, \
+                                   len(values)) + value
+
+        file.write(struct.pack(self._order + "H", len(tags)) + entries)
+        link = file.tell()
+        file.write(struct.pack(self._order + "I", 0) + extra)
+        end = file.tell()
+
+        # Linking the previous directory (or the header) to this one.
+        file.seek(self._link)
+        file.write(struct.pack(self._order + "I", ifd_offset))
+        file.seek(end)
+        self._link = link
+
+    """
+    Get the layout of the samples used to write an image.
+    @param image: QImage, the image.
+    @return (QImage.Format, int, int, int, int), the format to convert the 
+        image to, bytes per pixel, samples per pixel, bits per sample and 
+        photometric interpretation.
+    """
+    def get_layout(image):
+        # The layout only depends on the format of the image, and never on 
+        # its pixels, so that all crops of a slide are written alike.
+        image_format = image.format()
+        if image_format == QImage.Format.Format_Grayscale16:
+            return (QImage.Format.Format_Grayscale16, 2, 1, 16, 1)
+        if image.hasAlphaChannel():
+            return (QImage.Format.Format_RGBA8888, 4, 4, 8, 2)
+        # Indexed images are grayscale when their color table is.
+        if image_format == QImage.Format.Format_Grayscale8 or \
+            (image_format in (QImage.Format.Format_Indexed8, \
+                              QImage.Format.Format_Mono, \
+                              QImage.Format.Format_MonoLSB) and \
+             image.isGrayscale()):
+            return (QImage.Format.Format_Grayscale8, 1, 1, 8, 1)
+        return (QImage.Format.Format_RGB888, 3, 3, 8, 2)
+
+    """
+    Encode an image into a page.
+    Grayscale images are written with one sample per pixel, and images with
+    an alpha channel with an unassociated alpha sample.
+    @param image: QImage, the image to encode.
+    @param level: int, the zlib compression level (0 to 9), or None to leave
+        the page uncompressed.
+    @param name: str, the name of the page.
+    @param layout: tuple, the layout to write the image in, as from 
+        get_layout, or None for the layout of the image.
+    @return TiffPage, the encoded page (None if the image is null).
+    """
+    def encode_page(image, level = 6, name = "", layout = None):
+        if image.isNull():
+            return None
+
+        image_format, pixel_size, samples, bits, photometric = \
+            layout if layout else TiffWriter.get_layout(image)
+
+        image = image.convertToFormat(image_format)
+        page = TiffPage()
+        page.width = image.width()
+        page.height = image.height()
+        page.samples = samples
+        page.bits = bits
+        page.photometric = photometric
+        page.compression = 1 if level is None else 8
+        page.name = name
+
+        line_size = page.width * pixel_size
+        bytes_per_line = image.bytesPerLine()
+        pixels = image.constBits()
+        pixels.setsize(image.sizeInBytes())
+        pixels = pixels.asstring()
+
+        page.rows_per_strip = max(1, TiffWriter.strip_size // line_size)
+        for top in range(0, page.height, page.rows_per_strip):
+            rows = [pixels[y * bytes_per_line:y * bytes_per_line + line_size] \
+                    for y in range(top, min(page.height, \
+                                            top + page.rows_per_strip))]
+            strip = b"".join(rows)
+            page.strips.append(strip if level is None else \
+                               zlib.compress(strip, level))
+        return page
+
+    """
+    Encode an image into a Deflate-compressed TIFF.
+    @param image: QImage, the image to encode.
+    @param level: int, the zlib compression level (0 to 9).
+    @return bytes, the TIFF file (empty if the image is null).
+    """
+    def encode(image, level = 6):
+        page = TiffWriter.encode_page(image, level)
+        if page is None:
+            return b""
+        file = io.BytesIO()
+        TiffWriter(file).add_page(page)
+        return file.getvalue()